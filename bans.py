@@ -0,0 +1,39 @@
+import time
+from typing import Dict, Optional, Tuple
+
+class BanList:
+    """Забаненные пользователи в памяти процесса: user_id → (ban_until, reason).
+
+    ban_until=None — бессрочно. Истёкший бан считается снятым сразу при чтении,
+    а из базы его убирает периодическая зачистка (database_async._sweep_bans_forever).
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._bans: Dict[int, Tuple[Optional[int], Optional[str]]] = {}
+
+    def __len__(self):
+        return len(self._bans)
+
+    def load(self, rows):
+        """Заменяет содержимое строками (user_id, ban_until, ban_reason)."""
+        self._bans = {user_id: (until, reason) for user_id, until, reason in rows}
+        self.ready = True
+
+    def put(self, user_id: int, ban_until: Optional[int], reason: Optional[str] = None):
+        self._bans[user_id] = (ban_until, reason)
+
+    def remove(self, user_id: int):
+        self._bans.pop(user_id, None)
+
+    def get(self, user_id: int, now: float = None) -> Optional[Tuple[Optional[int], Optional[str]]]:
+        ban = self._bans.get(user_id)
+        if ban is None:
+            return None
+        until = ban[0]
+        if until is not None and (now or time.time()) >= until:
+            return None
+        return ban
+
+    def is_banned(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
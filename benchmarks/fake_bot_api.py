@@ -0,0 +1,175 @@
+"""Фейковый Bot API для проверки webhook-режима: отвечает на вызовы бота и шлёт ему апдейты.
+
+Запуск:
+    python benchmarks/fake_bot_api.py [--updates 2000] [--concurrency 50] [--polling]
+и в другом терминале бот против него:
+    BOT_MODE=webhook BOT_API_URL=http://127.0.0.1:8081 WEBHOOK_URL=http://127.0.0.1:5000 python main.py
+(шардированный режим — то же с BOT_WORKERS=4; с --polling — без BOT_MODE и WEBHOOK_URL).
+
+Скрипт ждёт setWebhook, проверяет, что запрос без секрета отклоняется, отправляет
+апдейты /start от несуществующих пользователей (бот только читает базу) и замеряет
+время ответа webhook и время до последнего ответного sendMessage.
+С --polling апдейты отдаются через getUpdates, а в конце проверяется, что бот
+подтвердил offset всех полученных апдейтов.
+"""
+import time
+import asyncio
+import argparse
+import statistics
+from aiohttp import web, ClientError, ClientSession
+
+PORT = 8081
+USER_BASE = 9_000_000_000
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class FakeBotAPI:
+    """Минимум методов Bot API, которые вызывает бот на /start."""
+
+    def __init__(self):
+        self.webhook = asyncio.get_running_loop().create_future()
+        self.polled = asyncio.get_running_loop().create_future()
+        self.pending = []  # ещё не подтверждённые апдейты для getUpdates
+        self.arrived = asyncio.Event()
+        self.confirmed = 0
+        self.replies = 0
+        self.replied = asyncio.Event()
+        self.expected = None
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"].lower()
+        form = await request.post()
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Beem", "username": "beem_fake_bot"}
+        elif method == "setwebhook":
+            if not self.webhook.done():
+                self.webhook.set_result((form["url"], form.get("secret_token", "")))
+            result = True
+        elif method == "getupdates":
+            result = await self.get_updates(int(form.get("offset") or 0), int(form.get("limit") or 100),
+                                            float(form.get("timeout") or 0))
+        elif method == "sendmessage":
+            self.replies += 1
+            if self.expected is not None and self.replies >= self.expected:
+                self.replied.set()
+            result = {"message_id": self.replies, "date": int(time.time()),
+                      "chat": {"id": int(form["chat_id"]), "type": "private"}, "text": form.get("text", "")}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def get_updates(self, offset: int, limit: int, timeout: float) -> list:
+        if not self.polled.done():
+            self.polled.set_result(None)
+        if offset:
+            before = len(self.pending)
+            self.pending = [u for u in self.pending if u["update_id"] >= offset]
+            self.confirmed += before - len(self.pending)
+        if not self.pending and timeout:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.pending[:limit]
+
+    def push(self, update: dict):
+        self.pending.append(update)
+        self.arrived.set()
+
+def start_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+            "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+def fmt(samples: list) -> str:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return f"p50 {statistics.median(samples):8.2f} ms   p95 {p95:8.2f} ms   max {samples[-1]:8.2f} ms"
+
+async def polling(api: FakeBotAPI, updates: int):
+    print("жду getUpdates…")
+    await api.polled
+    api.expected = updates
+    started = time.perf_counter()
+    for i in range(updates):
+        api.push(start_update(i + 1, USER_BASE + i))
+    try:
+        await asyncio.wait_for(api.replied.wait(), 120)
+    except asyncio.TimeoutError:
+        pass
+    handled = time.perf_counter() - started
+    print(f"апдейтов: {updates}, обработаны ({api.replies} sendMessage) за {handled:.2f} с "
+          f"({api.replies / handled:.0f}/с)")
+    print("жду остановки бота (Ctrl+C / SIGTERM ему), чтобы проверить подтверждение offset…")
+    while api.confirmed < updates:
+        await asyncio.sleep(0.5)
+    print(f"подтверждено getUpdates: {api.confirmed} ✅")
+
+async def main(updates: int, concurrency: int, poll: bool):
+    api = FakeBotAPI()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    print(f"Фейковый Bot API на http://127.0.0.1:{PORT}")
+    if poll:
+        await polling(api, updates)
+        await runner.cleanup()
+        return
+    print("жду setWebhook…")
+    url, secret = await api.webhook
+    print(f"webhook: {url}")
+
+    async with ClientSession() as http:
+        async with http.post(url, json=start_update(0, USER_BASE)) as resp:
+            print(f"без секрета: HTTP {resp.status}" + (" ✅" if resp.status == 401 else " ❌"))
+
+        api.expected = updates
+        statuses, latencies = {}, []
+        sem = asyncio.Semaphore(concurrency)
+
+        async def post(i: int):
+            async with sem:
+                start = time.perf_counter()
+                try:
+                    async with http.post(url, json=start_update(i + 1, USER_BASE + i),
+                                         headers={SECRET_HEADER: secret}) as resp:
+                        await resp.read()
+                    status = resp.status
+                except ClientError:
+                    status = "error"  # бот остановлен посреди нагрузки
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(updates)))
+        acked = time.perf_counter() - started
+        api.expected = statuses.get(200, 0)
+        if api.replies >= api.expected:
+            api.replied.set()
+        try:
+            await asyncio.wait_for(api.replied.wait(), 120)
+        except asyncio.TimeoutError:
+            pass
+        handled = time.perf_counter() - started
+
+    print(f"апдейтов: {updates}, параллельно: {concurrency}, ответы webhook: {statuses}")
+    print(f"ответ webhook  {fmt(latencies)}")
+    print(f"приняты за {acked:.2f} с ({updates / acked:.0f}/с), "
+          f"обработаны ({api.replies} sendMessage) за {handled:.2f} с ({api.replies / handled:.0f}/с)")
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--polling", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.updates, args.concurrency, args.polling))
@@ -0,0 +1,95 @@
+"""Бенчмарк выборки ленты анкет: ORDER BY RANDOM() против rand_key + wraparound.
+
+Запуск (нужен DATABASE_URL, данные пишутся во временную схему и удаляются):
+    python benchmarks/feed_sampling.py [10000 100000 1000000]
+"""
+import os
+import sys
+import time
+import random
+import statistics
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+import migrations
+
+SCHEMA = "beem_bench_feed"
+RUNS = 50
+LEGACY_RUNS = 5
+
+LEGACY_SQL = """
+    SELECT p.*, u.name, u.age, u.gender, u.interests_mask
+    FROM profiles p
+    JOIN users u ON p.user_id = u.user_id
+    WHERE p.active=1
+      AND p.user_id != %s
+      AND u.banned = 0
+      AND p.user_id NOT IN (SELECT blocked_id FROM blocks WHERE blocker_id=%s)
+      AND p.user_id NOT IN (SELECT blocker_id FROM blocks WHERE blocked_id=%s)
+    ORDER BY RANDOM()
+    LIMIT 50
+"""
+
+def seed(c, n: int):
+    c.execute(f"""INSERT INTO users (user_id, name, age, gender, interests_mask, registered, banned, created_at)
+        SELECT g, 'Name ' || g, 18 + g % 40, (ARRAY['male','female'])[1 + g % 2],
+               (ARRAY[33, 2, 24, 192])[1 + g % 4],
+               1, (g % 100 = 0)::int, 1700000000 + g
+        FROM generate_series(1, {n}) g""")
+    c.execute(f"""INSERT INTO profiles (user_id, description, created_at, active)
+        SELECT g, 'profile ' || g, 1700000000 + g, 1
+        FROM generate_series(1, {n}) g""")
+    c.execute(f"""INSERT INTO blocks (blocker_id, blocked_id, created_at)
+        SELECT 1 + g % {n}, 1 + (g * 7) % {n}, 0
+        FROM generate_series(1, {max(n // 10, 1)}) g ON CONFLICT DO NOTHING""")
+    c.execute("ANALYZE")
+
+def timed(fn, runs: int) -> list:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def fmt(samples: list) -> str:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return f"p50 {statistics.median(samples):8.2f} ms   p95 {p95:8.2f} ms"
+
+def bench(n: int):
+    admin = psycopg2.connect(db.DATABASE_URL)
+    admin.autocommit = True
+    c = admin.cursor()
+    c.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    c.execute(f"CREATE SCHEMA {SCHEMA}")
+    c.execute(f"SET search_path TO {SCHEMA}")
+    original_pool = db.pool
+    db.pool = db.ConnectionPool(db.DATABASE_URL, 1, 1, options=f"-c search_path={SCHEMA}")
+    try:
+        migrations.migrate()
+        seed(c, n)
+        viewer = lambda: random.randint(1, n)
+
+        def legacy():
+            with db.get_conn() as conn:
+                v = viewer()
+                conn.cursor().execute(LEGACY_SQL, (v, v, v))
+
+        db.get_matching_profiles(viewer(), 1)  # прогрев
+        print(f"{n:>9} active profiles")
+        print(f"    ORDER BY RANDOM()   {fmt(timed(legacy, LEGACY_RUNS))}")
+        print(f"    rand_key seek       {fmt(timed(lambda: db.get_matching_profiles(viewer(), 1), RUNS))}")
+    finally:
+        db.pool.closeall()
+        db.pool = original_pool
+        c.execute("SET search_path TO DEFAULT")
+        c.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        admin.close()
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for size in sizes:
+        bench(size)
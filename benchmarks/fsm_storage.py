@@ -0,0 +1,117 @@
+"""Бенчмарк хранилища FSM: MemoryStorage против PgStorage с пакетной записью и без неё.
+
+Каждый пользователь проходит регистрацию и собирает анкету из 10 медиа — та же
+последовательность get_state/update_data/get_data, что делают хендлеры.
+Пользователи идут параллельно, как апдейты разных чатов.
+
+Запуск (нужен DATABASE_URL, данные пишутся во временную схему и удаляются):
+    python benchmarks/fsm_storage.py [пользователей [параллельно]]
+"""
+import os
+import sys
+import time
+import asyncio
+import statistics
+import psycopg2
+import asyncpg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import database as db
+import database_async as adb
+import migrations
+from fsm_storage import PgStorage, storage_key
+
+SCHEMA = "beem_bench_fsm"
+BOT_ID = 1
+MEDIA = 10
+
+async def scenario(storage, user_id: int, latencies: list, write_through: bool):
+    key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+    async def op(call):
+        start = time.perf_counter()
+        await storage.get_state(key)  # FSM-фильтры читают состояние на каждом апдейте
+        await call
+        if write_through:
+            # как хранилище без кэша записи: каждый вызов — свой upsert
+            await adb.save_fsm_states([(storage_key(key), await storage.get_state(key), await storage.get_data(key))])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    await op(storage.set_state(key, "Reg:name"))
+    await op(storage.update_data(key, {"name": f"User {user_id}"}))
+    await op(storage.set_state(key, "Reg:age"))
+    await op(storage.update_data(key, {"age": 25}))
+    await op(storage.update_data(key, {"gender": "female", "interests": []}))
+    for interest in ("games", "music", "anime"):
+        data = await storage.get_data(key)
+        await op(storage.update_data(key, {"interests": data["interests"] + [interest]}))
+    await op(storage.set_state(key, None))
+    await op(storage.set_data(key, {}))
+    await op(storage.set_state(key, "ProfileFSM:collect"))
+    await op(storage.update_data(key, {"description": "", "media": []}))
+    for i in range(MEDIA):
+        data = await storage.get_data(key)
+        await op(storage.update_data(key, {"media": data["media"] + [[f"file{i}", "photo"]]}))
+    await op(storage.set_state(key, None))
+    await op(storage.set_data(key, {}))
+
+async def run(name: str, storage, users: int, parallel: int, write_through: bool = False):
+    latencies = []
+    sem = asyncio.Semaphore(parallel)
+
+    async def user(uid: int):
+        async with sem:
+            await scenario(storage, uid, latencies, write_through)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(uid) for uid in range(1, users + 1)))
+    if isinstance(storage, PgStorage):
+        await storage.flush()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)]
+    line = (f"{name:28} {len(latencies) / elapsed:9.0f} оп/с   p50 {statistics.median(latencies):7.3f} ms"
+            f"   p95 {p95:7.3f} ms")
+    if isinstance(storage, PgStorage) and not write_through:
+        s = storage.stats()
+        line += f"   записей в базу {s['flushed']} за {s['batches']} пачек"
+    print(line)
+
+async def bench(users: int, parallel: int):
+    adb._pool = await asyncpg.create_pool(adb.DATABASE_URL, min_size=1, max_size=10, init=adb._init_conn,
+                                          server_settings={"search_path": SCHEMA})
+    try:
+        print(f"{users} пользователей, {parallel} параллельно, {14 + MEDIA} операций на пользователя")
+        await run("MemoryStorage", MemoryStorage(), users, parallel)
+        storage = PgStorage()
+        await storage.start()
+        await run("PgStorage (пакетная запись)", storage, users, parallel)
+        await storage.stop()
+        await run("PgStorage (запись сразу)", PgStorage(), users, parallel, write_through=True)
+    finally:
+        await adb.close_pool()
+
+def main(users: int, parallel: int):
+    admin = psycopg2.connect(db.DATABASE_URL)
+    admin.autocommit = True
+    c = admin.cursor()
+    c.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    c.execute(f"CREATE SCHEMA {SCHEMA}")
+    original_pool = db.pool
+    db.pool = db.ConnectionPool(db.DATABASE_URL, 1, 1, options=f"-c search_path={SCHEMA}")
+    try:
+        migrations.migrate()
+        asyncio.run(bench(users, parallel))
+    finally:
+        db.pool.closeall()
+        db.pool = original_pool
+        c.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        admin.close()
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(args[0] if args else 2000, args[1] if len(args) > 1 else 100)
@@ -0,0 +1,117 @@
+"""Бенчмарк outbox: пересылка в чатах во время рассылки, с outbox и без него.
+
+Фейковый Telegram держит лимиты как настоящий: ~30 сообщений в секунду на бота и
+1 в секунду в чат (всплеск до 3), сверх — 429 с retry_after. Чаты шлют пачки по
+3 сообщения раз в 3 секунды (в пределах лимита чата), рассылка — BROADCAST_CONCURRENCY
+потоков без пауз.
+Без outbox рассылку сдерживает только её собственный бакет на 25/с (как было раньше),
+а пересылка в чатах идёт напрямую: 429 теряет сообщение.
+
+Запуск (сеть и база не нужны):
+    python benchmarks/outbox.py [секунд [чатов]]
+"""
+import os
+import sys
+import time
+import asyncio
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+import outbox
+from config import BROADCAST_CONCURRENCY
+
+API_LATENCY = 0.02
+GLOBAL_RATE = 30
+CHAT_RATE, CHAT_BURST = 1, 3
+RETRY_AFTER = 2
+BURST, PERIOD = 3, 3
+
+class FakeTelegram:
+    """make_request с лимитами Telegram: сверх лимита — TelegramRetryAfter."""
+
+    def __init__(self):
+        self.bot = outbox.TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self.chats = {}
+        self.sent = 0
+        self.flood = 0
+
+    async def __call__(self, bot, method):
+        await asyncio.sleep(API_LATENCY)
+        chat = self.chats.setdefault(method.chat_id, outbox.TokenBucket(CHAT_RATE, CHAT_BURST))
+        if chat.take() or self.bot.take():
+            self.flood += 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=RETRY_AFTER)
+        self.sent += 1
+        return True
+
+def fmt(samples: list) -> str:
+    if not samples:
+        return "—"
+    samples = sorted(samples)
+    return f"p50 {statistics.median(samples):7.0f} ms  p95 {samples[int(len(samples) * 0.95)]:7.0f} ms"
+
+async def run(name: str, seconds: float, chats: int, use_outbox: bool):
+    api = FakeTelegram()
+    box = outbox.Outbox(25, retries=3)
+    legacy = outbox.TokenBucket(25, 25)  # собственный лимит рассылки до outbox
+    relay_latency, lost = [], 0
+    broadcast_sent = 0
+    deadline = time.monotonic() + seconds
+
+    async def send(chat_id: int, level: int):
+        method = SendMessage(chat_id=chat_id, text="hi")
+        if not use_outbox:
+            return await api(None, method)
+        with outbox.priority(level):
+            return await box(api, None, method)
+
+    async def chat(chat_id: int):
+        nonlocal lost
+        await asyncio.sleep(chat_id % 20 / 10)  # чаты не синхронны
+        while time.monotonic() < deadline:
+            async def one():
+                nonlocal lost
+                start = time.perf_counter()
+                try:
+                    await send(chat_id, outbox.CHAT)
+                    relay_latency.append((time.perf_counter() - start) * 1000)
+                except TelegramRetryAfter:
+                    lost += 1
+            await asyncio.gather(*(one() for _ in range(BURST)))
+            await asyncio.sleep(PERIOD)
+
+    async def broadcaster(worker: int):
+        nonlocal broadcast_sent
+        user_id = 10_000_000 + worker
+        while time.monotonic() < deadline:
+            if not use_outbox:
+                await legacy.acquire()
+            try:
+                await send(user_id, outbox.BROADCAST)
+                broadcast_sent += 1
+            except TelegramRetryAfter:
+                if not use_outbox:
+                    legacy.pause(RETRY_AFTER)
+            user_id += BROADCAST_CONCURRENCY
+
+    started = time.monotonic()
+    await asyncio.gather(*(chat(i) for i in range(chats)),
+                         *(broadcaster(w) for w in range(BROADCAST_CONCURRENCY)))
+    elapsed = time.monotonic() - started
+    print(f"{name:12} пересылка {fmt(relay_latency)}   потеряно {lost:4}   "
+          f"рассылка {broadcast_sent / elapsed:5.1f}/с   всего {api.sent / elapsed:5.1f}/с   "
+          f"429 от Telegram: {api.flood}")
+
+async def main(seconds: float, chats: int):
+    print(f"{seconds:.0f} с, {chats} чатов по {BURST} сообщения раз в {PERIOD} с "
+          f"({chats * BURST / PERIOD:.0f}/с), рассылка в {BROADCAST_CONCURRENCY} потоков")
+    await run("без outbox", seconds, chats, use_outbox=False)
+    await run("outbox", seconds, chats, use_outbox=True)
+
+if __name__ == "__main__":
+    args = [float(a) for a in sys.argv[1:]]
+    asyncio.run(main(args[0] if args else 20, int(args[1]) if len(args) > 1 else 8))
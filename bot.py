@@ -1,21 +1,74 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
+from config import BOT_TOKEN, BOT_MODE, BOT_API_URL, FSM_STORAGE, WORKER_ID, WORKER_SOCKET
+import broadcast
+import database_async as db
+from fsm_storage import PgStorage
+import journal
+import outbox
+import web
+import webhook
 from handlers import user, admin, profile, chat
+from middlewares import BanMiddleware
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+_prefix = f"[w{WORKER_ID}] " if WORKER_ID else ""
+logging.basicConfig(level=logging.INFO, format=f"%(asctime)s %(levelname)s {_prefix}%(message)s")
 
-async def main():
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+def create_bot() -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None
+    bot = Bot(token=BOT_TOKEN, session=session)
+    bot.session.middleware(outbox.outbox)  # все отправки — через лимиты и приоритеты outbox
+    return bot
+
+def create_dispatcher(storage: BaseStorage) -> Dispatcher:
+    dp = Dispatcher(storage=storage)
+    dp.update.outer_middleware(BanMiddleware())
     dp.include_router(admin.router)
     dp.include_router(profile.router)
     dp.include_router(chat.router)
     dp.include_router(user.router)
-    await bot.delete_webhook(drop_pending_updates=True)
-    logging.info("🐝 Beem Bot запущен!")
+    return dp
+
+async def main():
+    bot = create_bot()
+    storage = PgStorage() if FSM_STORAGE == "postgres" else MemoryStorage()
+    dp = create_dispatcher(storage)
+    dp.startup.register(db.startup)
+    if isinstance(storage, PgStorage):
+        dp.startup.register(storage.start)
+    dp.startup.register(journal.start)
+    if WORKER_SOCKET:
+        # воркер шардированного режима: апдейты своих пользователей приносит ingress
+        # (workers.py), панель и рассылки работают там
+        dp.startup.register(webhook.start_worker)
+        dp.shutdown.register(webhook.stop_worker)
+    else:
+        dp.startup.register(broadcast.start)  # продолжает прерванные рассылки
+        dp.startup.register(web.start)  # веб-панель в этом же event loop
+        dp.shutdown.register(web.stop)
+        if BOT_MODE == "webhook":
+            dp.startup.register(webhook.start)  # апдейты принимает сервер панели
+            dp.shutdown.register(webhook.stop)  # дорабатывает принятые апдейты
+        dp.shutdown.register(broadcast.stop)
+    if isinstance(storage, PgStorage):
+        dp.shutdown.register(storage.stop)  # после обработки апдейтов, до закрытия пула
+    dp.shutdown.register(journal.stop)  # до закрытия пула
+    dp.shutdown.register(db.shutdown)
+    if WORKER_SOCKET:
+        logging.info(f"🐝 Воркер {WORKER_ID} запущен")
+        await webhook.run(dp, bot)
+        return
+    logging.info(f"🐝 Beem Bot запущен! ({BOT_MODE})")
+    if BOT_MODE == "webhook":
+        await webhook.run(dp, bot)
+        return
+    # накопившиеся апдейты не выбрасываем — их отработает polling
+    await bot.delete_webhook(drop_pending_updates=False)
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
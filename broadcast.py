@@ -0,0 +1,260 @@
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+import events
+import outbox
+import database_async as db
+from config import BROADCAST_CONCURRENCY, BROADCAST_BATCH, BROADCAST_RETRIES, BROADCAST_PROGRESS_INTERVAL
+from keyboards import broadcast_kb
+
+# Фоновые рассылки. Задание живёт в таблице broadcasts (миграция 14): получатели
+# читаются из users пачками по возрастанию user_id, после каждой пачки в базу пишется
+# курсор last_user_id и счётчики. Отправка идёт в BROADCAST_CONCURRENCY потоков через
+# outbox с низшим приоритетом: скорость и паузы после 429 держит он, рассылка получает
+# то, что осталось от пересылки в чатах и ответов пользователям.
+# При остановке процесса задание остаётся в статусе running и продолжается с курсора
+# при следующем старте. Получатель, которому сообщение ушло, но курсор ещё не записан,
+# после падения может получить его повторно — не больше одной пачки. При паузе повтор
+# тоже возможен: курсор и счётчики доходят только до первого необработанного получателя,
+# а отправленные параллельно за ним (до BROADCAST_CONCURRENCY - 1) получат сообщение снова.
+# Выполняет задания только процесс, вызвавший start(): при BOT_WORKERS > 1 это ingress
+# (workers.py), а админ, чьи апдейты обрабатывает воркер, лишь меняет строку в базе —
+# процесс с рассылками узнаёт об этом по событию "broadcast" и запускает или останавливает задание.
+
+ANNOUNCEMENT = "📢 <b>Объявление от Beem:</b>\n\n{}"
+DB_RETRY_DELAY = 5
+
+STATUS_LABELS = {
+    "running":   "▶️ идёт",
+    "paused":    "⏸ на паузе",
+    "done":      "✅ завершена",
+    "cancelled": "⛔ отменена",
+}
+
+_jobs: Dict[int, "Broadcast"] = {}
+_bot: Optional[Bot] = None  # задан только в процессе, который выполняет рассылки
+_stopping = False
+
+class Broadcast:
+    """Выполняющееся задание: job — строка broadcasts, счётчики обновляются на месте."""
+
+    def __init__(self, bot: Bot, job: Dict):
+        self.bot = bot
+        self.job = job
+        self.text = ANNOUNCEMENT.format(job["text"])
+        self.halt = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    async def _deliver(self, user_id: int) -> Optional[str]:
+        """sent | blocked | failed; None — задание остановили до первой попытки."""
+        errors = 0
+        attempted = False
+        with outbox.priority(outbox.BROADCAST, self.halt):
+            while not self.halt.is_set():
+                try:
+                    await self.bot.send_message(user_id, self.text, parse_mode="HTML")
+                    return "sent"
+                except outbox.Halted:
+                    break
+                except TelegramRetryAfter:
+                    # outbox уже выждал паузы и сдался; лимит общий на бота — не вина получателя
+                    attempted = True
+                except TelegramForbiddenError:
+                    return "blocked"  # бот заблокирован или аккаунт удалён
+                except TelegramBadRequest:
+                    return "failed"   # chat not found и т.п. — повтор не поможет
+                except TelegramAPIError as e:
+                    attempted = True
+                    errors += 1
+                    if errors > BROADCAST_RETRIES:
+                        logging.warning(f"📢 Рассылка #{self.job['id']}: не доставлено {user_id} ({e})")
+                        return "failed"
+                    if await outbox.sleep(2 ** errors, self.halt):
+                        break
+                except Exception:
+                    logging.exception(f"📢 Рассылка #{self.job['id']}: ошибка отправки {user_id}")
+                    return "failed"
+        # остановленный посреди повторов считается недоставленным, а не пропуском: каждый
+        # пропуск в середине пачки останавливает курсор, и всем за ним сообщение уйдёт повторно
+        return "failed" if attempted else None
+
+    async def _send_batch(self, user_ids: List[int]) -> int:
+        """Рассылает пачку до остановки; возвращает, сколько первых получателей обработано."""
+        outcomes: List[Optional[str]] = [None] * len(user_ids)
+        position = 0
+
+        async def worker():
+            nonlocal position
+            # получателей берут строго по порядку; пропуск бывает, только если halt снял
+            # с очереди outbox одного, пока следующий (другой чат) уже получил токен
+            while position < len(user_ids) and not self.halt.is_set():
+                i = position
+                position += 1
+                outcomes[i] = await self._deliver(user_ids[i])
+
+        await asyncio.gather(*(worker() for _ in range(BROADCAST_CONCURRENCY)))
+        done = 0
+        while done < len(outcomes) and outcomes[done]:
+            done += 1
+        # за пропуском курсор не сдвинется — тех получателей пройдём заново и посчитаем тогда
+        for outcome in outcomes[:done]:
+            self.job[outcome] += 1
+        return done
+
+    async def run(self):
+        job = self.job
+        last_report = time.monotonic()
+        try:
+            while not self.halt.is_set():
+                try:
+                    batch = await db.get_broadcast_recipients(job["last_user_id"], BROADCAST_BATCH)
+                    if not batch:
+                        if await db.set_broadcast_status(job["id"], "done"):
+                            job["status"] = "done"
+                        break
+                    done = await self._send_batch(batch)
+                    if done:
+                        job["last_user_id"] = batch[done - 1]
+                    await db.save_broadcast_progress(job["id"], job["last_user_id"],
+                                                     job["sent"], job["blocked"], job["failed"])
+                except Exception as e:
+                    logging.warning(f"📢 Рассылка #{job['id']}: ошибка базы ({e}), повтор")
+                    await outbox.sleep(DB_RETRY_DELAY, self.halt)
+                    continue
+                if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                    await self.report()
+                    last_report = time.monotonic()
+        finally:
+            _jobs.pop(job["id"], None)
+            await self.report()
+        if job["status"] == "done":
+            logging.info(f"📢 Рассылка #{job['id']} завершена: {job['sent']} доставлено")
+            try:
+                with outbox.priority(outbox.ADMIN):
+                    await self.bot.send_message(
+                        job["progress_chat_id"],
+                        f"📢 Рассылка #{job['id']} завершена:\n✅ Доставлено: {job['sent']}\n"
+                        f"🚫 Заблокировали бота: {job['blocked']}\n❌ Ошибок: {job['failed']}")
+            except TelegramAPIError:
+                pass
+
+    async def report(self):
+        """Обновляет сообщение с прогрессом у админа."""
+        job = self.job
+        if not job["progress_chat_id"]:
+            return
+        try:
+            with outbox.priority(outbox.ADMIN):
+                await self.bot.edit_message_text(
+                    fmt_progress(job), chat_id=job["progress_chat_id"], message_id=job["progress_message_id"],
+                    parse_mode="HTML", reply_markup=broadcast_kb(job))
+        except TelegramAPIError:
+            pass  # текст не изменился, сообщение удалено или лимит не отпустил
+
+def fmt_progress(job: Dict) -> str:
+    running = _jobs.get(job["id"])
+    if running is not None:
+        job = running.job  # свежие счётчики, а не прочитанные из базы после последней пачки
+    processed = job["sent"] + job["blocked"] + job["failed"]
+    total = max(job["total"], processed)
+    percent = processed * 100 // total if total else 100
+    lines = [
+        f"📢 <b>Рассылка #{job['id']}</b> — {STATUS_LABELS.get(job['status'], job['status'])}",
+        "",
+        f"📊 {processed} / {total} ({percent}%)",
+        f"✅ Доставлено: {job['sent']}",
+        f"🚫 Заблокировали бота: {job['blocked']}",
+        f"❌ Ошибок: {job['failed']}",
+    ]
+    if running is not None and outbox.paused_for() > 0:
+        lines.append(f"⏳ Лимит Telegram: пауза ещё {int(outbox.paused_for()) + 1} с")
+    return "\n".join(lines)
+
+def _launch(job: Dict):
+    if _bot is None or _stopping or job["id"] in _jobs:
+        return
+    running = _jobs[job["id"]] = Broadcast(_bot, job)
+    running.task = asyncio.create_task(running.run())
+
+async def _stop_job(broadcast_id: int, status: str):
+    running = _jobs.get(broadcast_id)
+    if running is not None:
+        running.job["status"] = status
+        running.halt.set()
+        await running.task  # дожидаемся отправок в полёте и записи курсора
+
+async def _sync(key: str):
+    """Событие "broadcast" из другого процесса: приводим выполнение к статусу в базе."""
+    if _bot is None:
+        return
+    job = await db.get_broadcast(int(key))
+    if job is None:
+        return
+    if job["status"] == "running":
+        _launch(job)
+    else:
+        await _stop_job(job["id"], job["status"])
+
+async def _resync(key: str = ""):
+    if _bot is None:
+        return
+    running = await db.get_running_broadcasts()
+    for job in running:
+        _launch(job)
+    ids = {job["id"] for job in running}
+    for broadcast_id in [i for i in _jobs if i not in ids]:
+        await _sync(str(broadcast_id))
+
+events.subscribe("broadcast", _sync)
+events.subscribe("resync", _resync)
+
+async def create(admin_id: int, text: str, chat_id: int, message_id: int) -> Dict:
+    """Создаёт задание и запускает его в фоне; прогресс пишется в сообщение message_id."""
+    job = await db.create_broadcast(admin_id, text, chat_id, message_id)
+    _launch(job)
+    return job
+
+async def _halt(broadcast_id: int, status: str) -> bool:
+    if not await db.set_broadcast_status(broadcast_id, status):
+        return False
+    await _stop_job(broadcast_id, status)
+    return True
+
+async def pause(broadcast_id: int) -> bool:
+    return await _halt(broadcast_id, "paused")
+
+async def cancel(broadcast_id: int) -> bool:
+    return await _halt(broadcast_id, "cancelled")
+
+async def resume(broadcast_id: int) -> bool:
+    job = await db.get_broadcast(broadcast_id)
+    if not job or job["status"] != "paused" or broadcast_id in _jobs:
+        return False
+    if not await db.set_broadcast_status(broadcast_id, "running"):
+        return False
+    job["status"] = "running"
+    _launch(job)
+    return True
+
+async def start(bot: Bot):
+    """Делает процесс исполнителем рассылок и продолжает задания, прерванные прошлой остановкой."""
+    global _bot, _stopping
+    _bot, _stopping = bot, False
+    for job in await db.get_running_broadcasts():
+        logging.info(f"📢 Рассылка #{job['id']} продолжается с user_id > {job['last_user_id']}")
+        _launch(job)
+
+async def stop():
+    """Останавливает рассылки, оставляя их в статусе running (до закрытия пула)."""
+    global _stopping
+    _stopping = True
+    jobs = list(_jobs.values())
+    for running in jobs:
+        running.halt.set()
+    # без cancel(): отправки в полёте завершаются, и курсор записывается в базу
+    await asyncio.gather(*(running.task for running in jobs), return_exceptions=True)
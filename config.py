@@ -1,12 +1,82 @@
 import os
+import hashlib
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "YOUR_BOT_TOKEN_HERE")
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "123456789").split(",")))
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
 ADMIN_SECRET = os.getenv("ADMIN_SECRET", "beem_super_secret_key_2024")
 
+# Получение апдейтов: polling (разработка) или webhook (прод, см. webhook.py).
+# BOT_API_URL — свой Bot API сервер (telegram-bot-api или фейковый для тестов).
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+_public_domain = os.getenv("RAILWAY_PUBLIC_DOMAIN")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or (f"https://{_public_domain}" if _public_domain else "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Telegram присылает секрет в заголовке каждого запроса; по умолчанию выводится из токена
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "32"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+# Шардирование (workers.py): при BOT_WORKERS > 1 главный процесс принимает апдейты
+# и раздаёт их процессам-воркерам по user_id; auto — по числу ядер.
+# BOT_WORKER_ID / BOT_WORKER_SOCKET выставляет супервизор в окружении воркера.
+BOT_WORKERS = (os.cpu_count() or 1) if os.getenv("BOT_WORKERS") == "auto" else int(os.getenv("BOT_WORKERS", "1"))
+WORKER_ID = os.getenv("BOT_WORKER_ID", "")
+WORKER_SOCKET = os.getenv("BOT_WORKER_SOCKET", "")
+WORKER_QUEUE_SIZE = 1000  # апдейтов в очереди ingress на одного воркера
+WORKER_BATCH = 100
+WORKER_RESTART_MAX_DELAY = 30
+WORKER_STOP_TIMEOUT = 30
+
 PROFILE_COOLDOWN = 300  # 5 минут
 
+# Кэш пользователей и активных анкет в процессе бота
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "10000"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", "60"))
+BLOCK_CACHE_TTL = int(os.getenv("BLOCK_CACHE_TTL", "600"))
+
+# Как часто снимать в базе истёкшие временные баны (секунды)
+BAN_SWEEP_INTERVAL = 60
+
+# Сколько секунд отдавать счётчики статистики из кэша
+STATS_CACHE_TTL = 5
+
+# Живой дашборд (SSE): изменения счётчиков копятся до секунды и уходят одним событием;
+# пустой комментарий раз в LIVE_STATS_HEARTBEAT секунд держит соединение за прокси
+LIVE_STATS_INTERVAL = 1.0
+LIVE_STATS_HEARTBEAT = 15
+
+# Исходящие сообщения (outbox.py): Telegram пропускает ~30 сообщений в секунду на бота
+# и около одного в секунду в один чат; общий лимит держим с запасом
+OUTBOX_RATE = float(os.getenv("OUTBOX_RATE", "25"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = 3
+OUTBOX_RETRIES = 3
+
+# Рассылки (broadcast.py): скорость задаёт outbox — рассылке достаётся то, что не занял
+# живой трафик; прогресс пишется в базу после каждой пачки
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_BATCH = 200
+BROADCAST_RETRIES = 3
+BROADCAST_PROGRESS_INTERVAL = 5
+
+# Состояния FSM (fsm_storage.py): postgres — переживают рестарт, memory — MemoryStorage aiogram.
+# Записи копятся в памяти и уходят в базу одной пачкой раз в FSM_FLUSH_INTERVAL секунд;
+# состояния, не менявшиеся FSM_TTL секунд, удаляются
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres")
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "20000"))
+FSM_TTL = int(os.getenv("FSM_TTL", str(30 * 86400)))
+FSM_CLEANUP_INTERVAL = 3600
+
+# Журнал сообщений чатов: write_behind | group_commit | sync (см. journal.py)
+JOURNAL_MODE = os.getenv("JOURNAL_MODE", "write_behind")
+JOURNAL_BATCH_SIZE = 500
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", "0.5"))
+JOURNAL_MAX_BUFFER = 20000
+
+# Порядок задаёт биты маски users.interests_mask — новые интересы только в конец.
 INTERESTS = [
     ("🎮 Игры",        "games"),
     ("💋 Флирт",       "flirt"),
@@ -22,6 +92,13 @@ INTERESTS = [
 
 INTERESTS_DISPLAY = {key: name for name, key in INTERESTS}
 
+REPORT_REASONS = {
+    "nsfw":  "🔞 Нежелательный контент",
+    "spam":  "💬 Спам",
+    "abuse": "😡 Оскорбления",
+    "scam":  "🤖 Бот/скам",
+}
+
 BAN_DURATIONS = {
     "1h":       ("1 час",      3600),
     "24h":      ("24 часа",    86400),
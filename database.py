@@ -1,97 +1,259 @@
 import os
 import time
+import random
+import threading
 import psycopg2
 import psycopg2.extras
-from typing import Optional, List, Dict
+import psycopg2.extensions
+import psycopg2.pool
+from typing import Optional, List, Dict, Tuple
 
-DATABASE_URL = os.getenv("DATABASE_URL", "")
+import events
+from config import STATS_CACHE_TTL
 
-def get_conn():
-    conn = psycopg2.connect(DATABASE_URL)
-    return conn
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+
+# ── Pool ───────────────────────────────────────────────────────────────────────
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    pass
+
+class PooledConnection:
+    """Соединение из пула: close() возвращает его в пул, with — транзакция + возврат."""
+
+    def __init__(self, pool: "ConnectionPool", raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise psycopg2.InterfaceError("connection already returned to pool")
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.putconn(raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._raw is None:
+            return
+        raw = self._raw
+        try:
+            if exc_type is None:
+                raw.commit()
+            else:
+                raw.rollback()
+        except psycopg2.Error:
+            self._raw = None
+            self._pool.putconn(raw, discard=True)
+            if exc_type is None:
+                raise
+            return
+        self.close()
+
+class ConnectionPool:
+    """Потокобезопасный пул psycopg2 с проверкой соединений при выдаче и метриками."""
+
+    def __init__(self, dsn: str, minconn: int = 1, maxconn: int = 10, timeout: float = 10.0,
+                 check_idle: float = 30.0, max_idle: float = 300.0, **connect_kwargs):
+        self.dsn = dsn
+        self.connect_kwargs = connect_kwargs
+        self.minconn = minconn
+        self.maxconn = max(maxconn, minconn, 1)
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.max_idle = max_idle
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []  # [(conn, last_used)], LIFO
+        self._size = 0
+        self._warm = False
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.exhausted = 0
+        self.timeouts = 0
+        self.discarded = 0
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn, **self.connect_kwargs)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - last_used < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as c:
+                c.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _prune(self):
+        # под self._cond: закрываем давно простаивающие соединения сверх minconn
+        now = time.monotonic()
+        while self._idle and self._size > self.minconn and now - self._idle[0][1] > self.max_idle:
+            conn, _ = self._idle.pop(0)
+            self._size -= 1
+            self._close(conn)
+
+    def _prefill(self):
+        conns = []
+        try:
+            for _ in range(self.minconn):
+                conns.append(self._connect())
+        finally:
+            now = time.monotonic()
+            with self._cond:
+                for conn in conns:
+                    self._idle.append((conn, now))
+                    self._size += 1
+                self._cond.notify_all()
+
+    def getconn(self):
+        if os.getpid() != self._pid:
+            # после fork соединения родителя использовать нельзя
+            with self._cond:
+                self._reset()
+        with self._cond:
+            warm, self._warm = self._warm, True
+        if not warm:
+            self._prefill()
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            conn = last_used = None
+            with self._cond:
+                self._prune()
+                while True:
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    if not waited:
+                        waited = True
+                        self.exhausted += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"no free connection in {self.timeout:.1f}s (max={self.maxconn})")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._healthy(conn, last_used):
+                self._discard(conn)
+                continue
+
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self.checkouts += 1
+                if waited:
+                    self.waits += 1
+                self.wait_time += elapsed
+                self.max_wait = max(self.max_wait, elapsed)
+            return conn
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._cond:
+            self._size -= 1
+            self.discarded += 1
+            self._cond.notify()
+
+    def putconn(self, conn, discard: bool = False):
+        if os.getpid() != self._pid:
+            return
+        if not discard and not conn.closed:
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        if discard or conn.closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def connection(self) -> PooledConnection:
+        return PooledConnection(self, self.getconn())
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min": self.minconn,
+                "max": self.maxconn,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time_total": round(self.wait_time, 6),
+                "wait_time_avg": round(self.wait_time / self.checkouts, 6) if self.checkouts else 0.0,
+                "wait_time_max": round(self.max_wait, 6),
+                "exhausted": self.exhausted,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+            }
+
+pool = ConnectionPool(
+    DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT,
+    check_idle=DB_POOL_CHECK_IDLE, max_idle=DB_POOL_MAX_IDLE,
+)
+
+def get_conn() -> PooledConnection:
+    return pool.connection()
+
+def pool_stats() -> Dict:
+    return pool.stats()
 
 def init_db():
-    conn = get_conn()
-    c = conn.cursor()
-
-    c.execute("""CREATE TABLE IF NOT EXISTS users (
-        user_id     BIGINT PRIMARY KEY,
-        username    TEXT,
-        name        TEXT,
-        age         INTEGER,
-        gender      TEXT,
-        interests   TEXT,
-        search_gender TEXT DEFAULT 'any',
-        registered  INTEGER DEFAULT 0,
-        banned      INTEGER DEFAULT 0,
-        ban_until   BIGINT,
-        ban_reason  TEXT,
-        created_at  BIGINT DEFAULT 0
-    )""")
-
-    c.execute("""CREATE TABLE IF NOT EXISTS profiles (
-        id          SERIAL PRIMARY KEY,
-        user_id     BIGINT,
-        description TEXT,
-        created_at  BIGINT,
-        active      INTEGER DEFAULT 1,
-        likes       INTEGER DEFAULT 0
-    )""")
-
-    c.execute("""CREATE TABLE IF NOT EXISTS profile_likes (
-        id          SERIAL PRIMARY KEY,
-        profile_id  INTEGER,
-        liker_id    BIGINT,
-        created_at  BIGINT,
-        UNIQUE(profile_id, liker_id)
-    )""")
-
-    c.execute("""CREATE TABLE IF NOT EXISTS profile_media (
-        id          SERIAL PRIMARY KEY,
-        profile_id  INTEGER,
-        file_id     TEXT,
-        media_type  TEXT,
-        created_at  BIGINT
-    )""")
-
-    c.execute("""CREATE TABLE IF NOT EXISTS chats (
-        id          SERIAL PRIMARY KEY,
-        profile_id  INTEGER,
-        sender_id   BIGINT,
-        target_id   BIGINT,
-        created_at  BIGINT
-    )""")
-
-    c.execute("""CREATE TABLE IF NOT EXISTS messages (
-        id          SERIAL PRIMARY KEY,
-        chat_id     INTEGER,
-        sender_id   BIGINT,
-        content     TEXT,
-        msg_type    TEXT DEFAULT 'text',
-        file_id     TEXT,
-        created_at  BIGINT
-    )""")
-
-    c.execute("""CREATE TABLE IF NOT EXISTS reports (
-        id          SERIAL PRIMARY KEY,
-        chat_id     INTEGER,
-        reporter_id BIGINT,
-        reported_id BIGINT,
-        reason      TEXT,
-        status      TEXT DEFAULT 'new',
-        created_at  BIGINT
-    )""")
-
-    c.execute("""CREATE TABLE IF NOT EXISTS blocks (
-        id          SERIAL PRIMARY KEY,
-        blocker_id  BIGINT,
-        blocked_id  BIGINT,
-        created_at  BIGINT,
-        UNIQUE(blocker_id, blocked_id)
-    )""")
-
-    conn.commit()
-    conn.close()
+    from migrations import migrate
+    migrate()
+
+def _notify(c, kind: str, key):
+    c.execute("SELECT pg_notify(%s, %s)", (events.CHANNEL, events.encode(kind, key, applied=False)))
 
 def _row(cursor, one=True):
     cols = [d[0] for d in cursor.description]
@@ -100,51 +262,112 @@ def _row(cursor, one=True):
         return dict(zip(cols, row)) if row else None
     return [dict(zip(cols, r)) for r in cursor.fetchall()]
 
+def _keyset(key: str, after, before) -> Tuple[str, str, list]:
+    """Условие, ORDER BY и параметры keyset-страницы по убыванию key ("created_at, id")."""
+    cols = [c.strip() for c in key.split(",")]
+    cursor, op, direction = (before, ">", "ASC") if before else (after, "<", "DESC")
+    order = ", ".join(f"{c} {direction}" for c in cols)
+    if not cursor:
+        return "TRUE", order, []
+    return f"({', '.join(cols)}) {op} %s", order, [tuple(cursor)]
+
+def _fetch_page(sql: str, key: str, limit: Optional[int], after, before, args=()) -> List[Dict]:
+    """sql с {where} и {order}; LIMIT и курсор добавляются после своих параметров."""
+    cond, order, cursor = _keyset(key, after, before)
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(sql.format(where=cond, order=order) + " LIMIT %s", [*args, *cursor, limit])
+        rows = _row(c, one=False)
+    return rows[::-1] if before else rows
+
 # ── Users ──────────────────────────────────────────────────────────────────────
 
 def get_user(user_id: int) -> Optional[Dict]:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE user_id=%s", (user_id,))
-    result = _row(c)
-    conn.close()
-    return result
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM users WHERE user_id=%s", (user_id,))
+        return _row(c)
 
 def upsert_user(user_id: int, **kwargs):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM users WHERE user_id=%s", (user_id,))
-    existing = c.fetchone()
-    if existing:
-        sets = ", ".join(f"{k}=%s" for k in kwargs)
-        c.execute(f"UPDATE users SET {sets} WHERE user_id=%s", list(kwargs.values()) + [user_id])
-    else:
-        kwargs["user_id"] = user_id
-        cols = ", ".join(kwargs.keys())
-        qs = ", ".join(["%s"] * len(kwargs))
-        c.execute(f"INSERT INTO users ({cols}) VALUES ({qs})", list(kwargs.values()))
-    conn.commit()
-    conn.close()
-
-def get_all_users() -> List[Dict]:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE registered=1 ORDER BY created_at DESC")
-    result = _row(c, one=False)
-    conn.close()
-    return result
+    cols = ", ".join(["user_id", *kwargs])
+    qs = ", ".join(["%s"] * (len(kwargs) + 1))
+    sets = ", ".join(f"{k}=EXCLUDED.{k}" for k in kwargs)
+    on_conflict = f"DO UPDATE SET {sets}" if kwargs else "DO NOTHING"
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(f"INSERT INTO users ({cols}) VALUES ({qs}) ON CONFLICT (user_id) {on_conflict}",
+                  [user_id, *kwargs.values()])
+        _notify(c, "user", user_id)
+
+def get_all_users(limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Зарегистрированные, новые первыми; курсор — (created_at, user_id)."""
+    return _fetch_page(
+        "SELECT * FROM users WHERE registered=1 AND {where} ORDER BY {order}",
+        "created_at, user_id", limit, after, before
+    )
+
+# Выражение совпадает с индексом users_search_trgm_idx (миграция 10)
+_USER_SEARCH_TEXT = "lower(coalesce(name, '') || ' ' || coalesce(username, ''))"
+
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_users(query: str = "", banned: Optional[int] = None, gender: Optional[str] = None,
+                 created_from: Optional[int] = None, created_to: Optional[int] = None,
+                 limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Подстрока имени/username, префикс user_id и фильтры; порядок и курсор как у get_all_users."""
+    conds, args = ["registered=1"], []
+    query = (query or "").strip().lstrip("@")
+    if query:
+        like = f"%{_like_escape(query.lower())}%"
+        if query.isdigit():
+            conds.append(f"({_USER_SEARCH_TEXT} LIKE %s OR user_id::text LIKE %s)")
+            args += [like, f"{query}%"]
+        else:
+            conds.append(f"{_USER_SEARCH_TEXT} LIKE %s")
+            args.append(like)
+    if banned is not None:
+        conds.append("banned=%s")
+        args.append(int(banned))
+    if gender:
+        conds.append("gender=%s")
+        args.append(gender)
+    if created_from is not None:
+        conds.append("created_at >= %s")
+        args.append(created_from)
+    if created_to is not None:
+        conds.append("created_at < %s")
+        args.append(created_to)
+    return _fetch_page(
+        f"SELECT * FROM users WHERE {' AND '.join(conds)} AND {{where}} ORDER BY {{order}}",
+        "created_at, user_id", limit, after, before, args
+    )
 
 def is_banned(user_id: int) -> bool:
     user = get_user(user_id)
     if not user or not user.get("banned"):
         return False
-    ban_until = user.get("ban_until")
-    if ban_until is None:
-        return True
-    if time.time() < ban_until:
-        return True
-    upsert_user(user_id, banned=0, ban_until=None, ban_reason=None)
-    return False
+    return user.get("ban_until") is None or time.time() < user["ban_until"]
+
+def get_banned_users() -> List[Dict]:
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT user_id, ban_until, ban_reason FROM users WHERE banned=1")
+        return _row(c, one=False)
+
+def unban_expired() -> List[int]:
+    """Снимает истёкшие временные баны, возвращает user_id."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            UPDATE users SET banned=0, ban_until=NULL, ban_reason=NULL
+            WHERE banned=1 AND ban_until <= %s
+            RETURNING user_id
+        """, (int(time.time()),))
+        expired = [r[0] for r in c.fetchall()]
+        for user_id in expired:
+            _notify(c, "user", user_id)
+        return expired
 
 def ban_user(user_id: int, duration_key: str, reason: str = ""):
     from config import BAN_DURATIONS
@@ -158,255 +381,440 @@ def unban_user(user_id: int):
 # ── Profiles ───────────────────────────────────────────────────────────────────
 
 def create_profile(user_id: int, description: str) -> int:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("UPDATE profiles SET active=0 WHERE user_id=%s", (user_id,))
-    c.execute(
-        "INSERT INTO profiles (user_id, description, created_at, active) VALUES (%s,%s,%s,1) RETURNING id",
-        (user_id, description, int(time.time()))
-    )
-    pid = c.fetchone()[0]
-    conn.commit()
-    conn.close()
-    return pid
+    return create_profile_with_media(user_id, description, [])
+
+def create_profile_with_media(user_id: int, description: str, media: List[Tuple[str, str]]) -> int:
+    """Публикует анкету вместе с медиа [(file_id, media_type), ...] одной транзакцией."""
+    now = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE profiles SET active=0 WHERE user_id=%s AND active=1", (user_id,))
+        c.execute(
+            "INSERT INTO profiles (user_id, description, created_at, active) VALUES (%s,%s,%s,1) RETURNING id",
+            (user_id, description, now)
+        )
+        pid = c.fetchone()[0]
+        if media:
+            c.execute("""
+                INSERT INTO profile_media (profile_id, file_id, media_type, created_at)
+                SELECT %s, m.file_id, m.media_type, %s
+                FROM unnest(%s::text[], %s::text[]) AS m(file_id, media_type)
+            """, (pid, now, [f for f, _ in media], [t for _, t in media]))
+        _notify(c, "profile", user_id)
+        return pid
 
 def add_profile_media(profile_id: int, file_id: str, media_type: str):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO profile_media (profile_id, file_id, media_type, created_at) VALUES (%s,%s,%s,%s)",
-        (profile_id, file_id, media_type, int(time.time()))
-    )
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO profile_media (profile_id, file_id, media_type, created_at) VALUES (%s,%s,%s,%s)",
+            (profile_id, file_id, media_type, int(time.time()))
+        )
 
 def get_profile_media(profile_id: int) -> List[Dict]:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT * FROM profile_media WHERE profile_id=%s ORDER BY id", (profile_id,))
-    result = _row(c, one=False)
-    conn.close()
-    return result
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM profile_media WHERE profile_id=%s ORDER BY id", (profile_id,))
+        return _row(c, one=False)
+
+def get_profile(profile_id: int) -> Optional[Dict]:
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM profiles WHERE id=%s", (profile_id,))
+        return _row(c)
 
 def get_active_profile(user_id: int) -> Optional[Dict]:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT * FROM profiles WHERE user_id=%s AND active=1", (user_id,))
-    result = _row(c)
-    conn.close()
-    return result
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM profiles WHERE user_id=%s AND active=1", (user_id,))
+        return _row(c)
 
 def delete_active_profile(user_id: int):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("UPDATE profiles SET active=0 WHERE user_id=%s AND active=1", (user_id,))
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE profiles SET active=0 WHERE user_id=%s AND active=1", (user_id,))
+        _notify(c, "profile", user_id)
 
 def get_last_profile_time(user_id: int) -> int:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT MAX(created_at) as t FROM profiles WHERE user_id=%s", (user_id,))
-    row = c.fetchone()
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT MAX(created_at) as t FROM profiles WHERE user_id=%s", (user_id,))
+        row = c.fetchone()
     return row[0] or 0 if row else 0
 
-def get_matching_profiles(viewer_id: int, interests: List[str], limit: int = 2) -> List[Dict]:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("""
-        SELECT p.*, u.name, u.age, u.gender, u.interests
-        FROM profiles p
-        JOIN users u ON p.user_id = u.user_id
-        WHERE p.active=1
-          AND p.user_id != %s
+# Анкета с полями владельца и медиа одной строкой: media — json-массив {file_id, media_type}
+_PROFILE_FULL_SQL = """
+    SELECT p.*, u.name, u.age, u.gender, u.username, u.interests_mask,
+           COALESCE(m.media, '[]'::json) AS media
+    FROM profiles p
+    JOIN users u ON p.user_id = u.user_id
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object('file_id', pm.file_id, 'media_type', pm.media_type) ORDER BY pm.id) AS media
+        FROM profile_media pm WHERE pm.profile_id = p.id
+    ) m ON true
+"""
+
+def get_profiles_full(profile_ids: List[int]) -> List[Dict]:
+    """Анкеты с полями владельца и медиа одним запросом, в порядке profile_ids."""
+    if not profile_ids:
+        return []
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(_PROFILE_FULL_SQL + " WHERE p.id = ANY(%(ids)s::int[]) ORDER BY array_position(%(ids)s::int[], p.id)",
+                  {"ids": list(profile_ids)})
+        return _row(c, one=False)
+
+# Случайная выборка без сортировки всех анкет: у каждой анкеты есть rand_key,
+# берём анкеты по индексу начиная со случайной точки и при нехватке
+# продолжаем с начала диапазона (wraparound). Совпадение интересов —
+# побитовое AND масок прямо в запросе, до LIMIT.
+_FEED_FILTERS = """
+          AND p.user_id != %(viewer)s
           AND u.banned = 0
-          AND p.user_id NOT IN (SELECT blocked_id FROM blocks WHERE blocker_id=%s)
-          AND p.user_id NOT IN (SELECT blocker_id FROM blocks WHERE blocked_id=%s)
-        ORDER BY RANDOM()
-        LIMIT 50
-    """, (viewer_id, viewer_id, viewer_id))
-    rows = _row(c, one=False)
-    conn.close()
-
-    results, seen = [], set()
-    for d in rows:
-        if d["user_id"] in seen:
-            continue
-        p_interests = set((d.get("interests") or "").split(","))
-        if set(interests) & p_interests:
-            seen.add(d["user_id"])
-            results.append(d)
-        if len(results) >= limit:
-            break
-    return results
+          AND (u.interests_mask & %(mask)s) <> 0
+          AND NOT EXISTS (SELECT 1 FROM blocks b WHERE b.blocker_id=%(viewer)s AND b.blocked_id=p.user_id)
+          AND NOT EXISTS (SELECT 1 FROM blocks b WHERE b.blocked_id=%(viewer)s AND b.blocker_id=p.user_id)
+"""
+_FEED_SQL = f"""
+    ({_PROFILE_FULL_SQL}
+     WHERE p.active=1 AND p.rand_key >= %(start)s {_FEED_FILTERS}
+     ORDER BY p.rand_key LIMIT %(n)s)
+    UNION ALL
+    ({_PROFILE_FULL_SQL}
+     WHERE p.active=1 AND p.rand_key < %(start)s {_FEED_FILTERS}
+     ORDER BY p.rand_key LIMIT %(n)s)
+    LIMIT %(n)s
+"""
+
+def get_matching_profiles(viewer_id: int, interests_mask: int, limit: int = 2) -> List[Dict]:
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(_FEED_SQL, {"viewer": viewer_id, "start": random.random(), "mask": interests_mask, "n": limit})
+        return _row(c, one=False)
 
 def like_profile(profile_id: int, liker_id: int) -> bool:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT id FROM profile_likes WHERE profile_id=%s AND liker_id=%s", (profile_id, liker_id))
-    existing = c.fetchone()
-    if existing:
-        c.execute("DELETE FROM profile_likes WHERE profile_id=%s AND liker_id=%s", (profile_id, liker_id))
-        c.execute("UPDATE profiles SET likes = GREATEST(0, likes-1) WHERE id=%s", (profile_id,))
-        conn.commit()
-        conn.close()
-        return False
-    else:
-        c.execute(
-            "INSERT INTO profile_likes (profile_id, liker_id, created_at) VALUES (%s,%s,%s)",
-            (profile_id, liker_id, int(time.time()))
-        )
-        c.execute("UPDATE profiles SET likes = likes+1 WHERE id=%s", (profile_id,))
-        conn.commit()
-        conn.close()
-        return True
-
-def get_active_profiles_admin() -> List[Dict]:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("""
-        SELECT p.*, u.name, u.age, u.gender, u.username
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id FROM profile_likes WHERE profile_id=%s AND liker_id=%s", (profile_id, liker_id))
+        existing = c.fetchone()
+        if existing:
+            c.execute("DELETE FROM profile_likes WHERE profile_id=%s AND liker_id=%s", (profile_id, liker_id))
+            c.execute("UPDATE profiles SET likes = GREATEST(0, likes-1) WHERE id=%s RETURNING user_id", (profile_id,))
+            liked = False
+        else:
+            c.execute(
+                "INSERT INTO profile_likes (profile_id, liker_id, created_at) VALUES (%s,%s,%s)",
+                (profile_id, liker_id, int(time.time()))
+            )
+            c.execute("UPDATE profiles SET likes = likes+1 WHERE id=%s RETURNING user_id", (profile_id,))
+            liked = True
+        owner = c.fetchone()
+        if owner:
+            _notify(c, "likes", owner[0])
+        return liked
+
+def get_active_profiles_admin(limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Курсор — (created_at, id) анкеты."""
+    return _fetch_page("""
+        SELECT p.*, u.name, u.age, u.gender, u.username, u.interests_mask
         FROM profiles p JOIN users u ON p.user_id = u.user_id
-        WHERE p.active=1 ORDER BY p.created_at DESC
-    """)
-    result = _row(c, one=False)
-    conn.close()
-    return result
+        WHERE p.active=1 AND {where} ORDER BY {order}
+    """, "p.created_at, p.id", limit, after, before)
 
 # ── Chats ──────────────────────────────────────────────────────────────────────
 
 def create_chat(profile_id: int, sender_id: int, target_id: int) -> int:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT id FROM chats WHERE profile_id=%s AND sender_id=%s", (profile_id, sender_id))
-    existing = c.fetchone()
-    if existing:
-        conn.close()
-        return existing[0]
-    c.execute(
-        "INSERT INTO chats (profile_id, sender_id, target_id, created_at) VALUES (%s,%s,%s,%s) RETURNING id",
-        (profile_id, sender_id, target_id, int(time.time()))
-    )
-    cid = c.fetchone()[0]
-    conn.commit()
-    conn.close()
-    return cid
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            WITH ins AS (
+                INSERT INTO chats (profile_id, sender_id, target_id, created_at)
+                VALUES (%(profile)s, %(sender)s, %(target)s, %(now)s)
+                ON CONFLICT (profile_id, sender_id) DO NOTHING
+                RETURNING id
+            )
+            SELECT id FROM ins
+            UNION ALL
+            SELECT id FROM chats WHERE profile_id=%(profile)s AND sender_id=%(sender)s
+            LIMIT 1
+        """, {"profile": profile_id, "sender": sender_id, "target": target_id, "now": int(time.time())})
+        row = c.fetchone()
+        if row is None:
+            # чат вставлен параллельной транзакцией, которую снимок запроса не видел
+            c.execute("SELECT id FROM chats WHERE profile_id=%s AND sender_id=%s", (profile_id, sender_id))
+            row = c.fetchone()
+        return row[0]
 
 def get_chat(chat_id: int) -> Optional[Dict]:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT * FROM chats WHERE id=%s", (chat_id,))
-    result = _row(c)
-    conn.close()
-    return result
-
-def get_user_chats(user_id: int) -> List[Dict]:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT * FROM chats WHERE sender_id=%s OR target_id=%s ORDER BY id DESC", (user_id, user_id))
-    result = _row(c, one=False)
-    conn.close()
-    return result
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM chats WHERE id=%s", (chat_id,))
+        return _row(c)
+
+def get_user_chats(user_id: int, limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Курсор — (id,)."""
+    return _fetch_page(
+        "SELECT * FROM chats WHERE (sender_id=%s OR target_id=%s) AND {where} ORDER BY {order}",
+        "id", limit, after, before, (user_id, user_id)
+    )
 
 def add_message(chat_id: int, sender_id: int, content: str, msg_type: str = "text", file_id: str = None) -> int:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO messages (chat_id, sender_id, content, msg_type, file_id, created_at) VALUES (%s,%s,%s,%s,%s,%s) RETURNING id",
-        (chat_id, sender_id, content, msg_type, file_id, int(time.time()))
-    )
-    mid = c.fetchone()[0]
-    conn.commit()
-    conn.close()
-    return mid
-
-def get_chat_messages(chat_id: int, limit: int = 100) -> List[Dict]:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute(
-        "SELECT * FROM (SELECT * FROM messages WHERE chat_id=%s ORDER BY created_at DESC LIMIT %s) sub ORDER BY created_at ASC",
-        (chat_id, limit)
-    )
-    result = _row(c, one=False)
-    conn.close()
-    return result
-
-def get_all_chats_admin() -> List[Dict]:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("""
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO messages (chat_id, sender_id, content, msg_type, file_id, created_at) VALUES (%s,%s,%s,%s,%s,%s) RETURNING id",
+            (chat_id, sender_id, content, msg_type, file_id, int(time.time()))
+        )
+        return c.fetchone()[0]
+
+def add_messages(rows: List[Tuple]):
+    """Пачка (chat_id, sender_id, content, msg_type, file_id, created_at) одним INSERT."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        psycopg2.extras.execute_values(
+            c, "INSERT INTO messages (chat_id, sender_id, content, msg_type, file_id, created_at) VALUES %s",
+            rows, page_size=1000
+        )
+
+def get_chat_messages(chat_id: int, limit: int = 100, before: Tuple = None) -> List[Dict]:
+    """Последние limit сообщений (старше курсора before = (created_at, id)) по возрастанию времени."""
+    # по убыванию ключа "after" — это более старые строки
+    rows = _fetch_page("SELECT * FROM messages WHERE chat_id=%s AND {where} ORDER BY {order}",
+                       "created_at, id", limit, before, None, [chat_id])
+    return rows[::-1]
+
+def get_all_chats_admin(limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Курсор — (created_at, id) чата."""
+    return _fetch_page("""
         SELECT c.*,
                us.name as sender_name, us.username as sender_username,
-               ut.name as target_name, ut.username as target_username,
-               (SELECT COUNT(*) FROM messages m WHERE m.chat_id=c.id) as msg_count,
-               (SELECT content FROM messages m WHERE m.chat_id=c.id ORDER BY created_at DESC LIMIT 1) as last_msg
+               ut.name as target_name, ut.username as target_username
         FROM chats c
         LEFT JOIN users us ON c.sender_id = us.user_id
         LEFT JOIN users ut ON c.target_id = ut.user_id
-        ORDER BY c.created_at DESC
-    """)
-    result = _row(c, one=False)
-    conn.close()
-    return result
+        WHERE {where} ORDER BY {order}
+    """, "c.created_at, c.id", limit, after, before)
 
 # ── Reports ────────────────────────────────────────────────────────────────────
 
 def add_report(chat_id: int, reporter_id: int, reported_id: int, reason: str = ""):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO reports (chat_id, reporter_id, reported_id, reason, created_at) VALUES (%s,%s,%s,%s,%s)",
-        (chat_id, reporter_id, reported_id, reason, int(time.time()))
-    )
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO reports (chat_id, reporter_id, reported_id, reason, created_at) VALUES (%s,%s,%s,%s,%s)",
+            (chat_id, reporter_id, reported_id, reason, int(time.time()))
+        )
 
-def get_reports(status: str = None) -> List[Dict]:
-    conn = get_conn()
-    c = conn.cursor()
+def get_reports(status: str = None, limit: int = None,
+                after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Курсор — (created_at, id) жалобы."""
     if status:
-        c.execute("""
+        return _fetch_page("""
             SELECT r.*, u.name as reported_name, u.username as reported_username
             FROM reports r LEFT JOIN users u ON r.reported_id = u.user_id
-            WHERE r.status=%s ORDER BY r.created_at DESC
-        """, (status,))
-    else:
-        c.execute("""
-            SELECT r.*, u.name as reported_name, u.username as reported_username
-            FROM reports r LEFT JOIN users u ON r.reported_id = u.user_id
-            ORDER BY r.created_at DESC
-        """)
-    result = _row(c, one=False)
-    conn.close()
-    return result
+            WHERE r.status=%s AND {where} ORDER BY {order}
+        """, "r.created_at, r.id", limit, after, before, (status,))
+    return _fetch_page("""
+        SELECT r.*, u.name as reported_name, u.username as reported_username
+        FROM reports r LEFT JOIN users u ON r.reported_id = u.user_id
+        WHERE {where} ORDER BY {order}
+    """, "r.created_at, r.id", limit, after, before)
+
+_REPORT_SQL = """
+    SELECT r.*, u.name as reported_name, u.username as reported_username
+    FROM reports r LEFT JOIN users u ON r.reported_id = u.user_id
+"""
+
+def get_report(report_id: int) -> Optional[Dict]:
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(_REPORT_SQL + " WHERE r.id=%s", (report_id,))
+        return _row(c)
+
+def get_open_reports(reported_id: int, limit: int = 10) -> List[Dict]:
+    """Открытые жалобы на пользователя, новые первыми."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(_REPORT_SQL + " WHERE r.reported_id=%s AND r.status='new' ORDER BY r.created_at DESC, r.id DESC LIMIT %s",
+                  (reported_id, limit))
+        return _row(c, one=False)
+
+# Очередь модерации (report_queue) ведут триггеры на reports, см. миграцию 13
+_QUEUE_SQL = """
+    SELECT q.*, u.name as reported_name, u.username as reported_username
+    FROM report_queue q LEFT JOIN users u ON q.reported_id = u.user_id
+"""
+
+def get_report_queue(limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Пользователи с открытыми жалобами, больше жалоб — выше; курсор — (open_count, last_at, reported_id)."""
+    return _fetch_page(_QUEUE_SQL + " WHERE {where} ORDER BY {order}",
+                       "q.open_count, q.last_at, q.reported_id", limit, after, before)
+
+def get_report_queue_entry(reported_id: int) -> Optional[Dict]:
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(_QUEUE_SQL + " WHERE q.reported_id=%s", (reported_id,))
+        return _row(c)
+
+def resolve_user_reports(reported_id: int) -> int:
+    """Закрывает все открытые жалобы на пользователя, возвращает их число."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE reports SET status='resolved' WHERE reported_id=%s AND status='new'", (reported_id,))
+        return c.rowcount
 
 def resolve_report(report_id: int):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("UPDATE reports SET status='resolved' WHERE id=%s", (report_id,))
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE reports SET status='resolved' WHERE id=%s", (report_id,))
 
 # ── Blocks ─────────────────────────────────────────────────────────────────────
 
 def block_user(blocker_id: int, blocked_id: int):
-    conn = get_conn()
-    c = conn.cursor()
     try:
-        c.execute(
-            "INSERT INTO blocks (blocker_id, blocked_id, created_at) VALUES (%s,%s,%s)",
-            (blocker_id, blocked_id, int(time.time()))
-        )
-        conn.commit()
+        with get_conn() as conn:
+            c = conn.cursor()
+            c.execute(
+                "INSERT INTO blocks (blocker_id, blocked_id, created_at) VALUES (%s,%s,%s)",
+                (blocker_id, blocked_id, int(time.time()))
+            )
+            _notify(c, "block", f"{blocker_id},{blocked_id}")
     except Exception:
-        conn.rollback()
-    conn.close()
+        pass
+
+def get_user_blocks(user_id: int) -> List[Dict]:
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT blocker_id, blocked_id FROM blocks WHERE blocker_id=%s OR blocked_id=%s",
+                  (user_id, user_id))
+        return _row(c, one=False)
 
 def is_blocked(blocker_id: int, blocked_id: int) -> bool:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT id FROM blocks WHERE blocker_id=%s AND blocked_id=%s", (blocker_id, blocked_id))
-    row = c.fetchone()
-    conn.close()
-    return row is not None
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id FROM blocks WHERE blocker_id=%s AND blocked_id=%s", (blocker_id, blocked_id))
+        return c.fetchone() is not None
+
+# ── Broadcasts ─────────────────────────────────────────────────────────────────
+# Задания рассылки (миграция 14); отправкой занимается broadcast.py.
+# Создание и смена статуса шлют "broadcast", чтобы задание подхватил процесс с рассылками.
+
+_RECIPIENTS_SQL = "FROM users WHERE registered=1 AND banned=0"
+
+def create_broadcast(admin_id: int, text: str, chat_id: int, message_id: int) -> Dict:
+    """Новое задание; total — число получателей на момент запуска."""
+    now = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(f"""
+            INSERT INTO broadcasts (admin_id, text, total, progress_chat_id, progress_message_id, created_at, updated_at)
+            SELECT %s, %s, count(*), %s, %s, %s, %s {_RECIPIENTS_SQL}
+            RETURNING *
+        """, (admin_id, text, chat_id, message_id, now, now))
+        row = _row(c)
+        _notify(c, "broadcast", row["id"])
+        return row
+
+def get_broadcast(broadcast_id: int) -> Optional[Dict]:
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM broadcasts WHERE id=%s", (broadcast_id,))
+        return _row(c)
+
+def get_broadcasts(limit: int = 5) -> List[Dict]:
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM broadcasts ORDER BY id DESC LIMIT %s", (limit,))
+        return _row(c, one=False)
+
+def get_running_broadcasts() -> List[Dict]:
+    """Задания, прерванные остановкой процесса, — их продолжают при старте."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM broadcasts WHERE status='running' ORDER BY id")
+        return _row(c, one=False)
+
+def get_broadcast_recipients(after_user_id: int, limit: int) -> List[int]:
+    """Следующая пачка получателей по возрастанию user_id."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT user_id {_RECIPIENTS_SQL} AND user_id > %s ORDER BY user_id LIMIT %s",
+                  (after_user_id, limit))
+        return [r[0] for r in c.fetchall()]
+
+def save_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, blocked: int, failed: int):
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            UPDATE broadcasts SET last_user_id=%s, sent=%s, blocked=%s, failed=%s, updated_at=%s WHERE id=%s
+        """, (last_user_id, sent, blocked, failed, int(time.time()), broadcast_id))
+
+def set_broadcast_status(broadcast_id: int, status: str) -> bool:
+    """running ⇄ paused, → done | cancelled; завершённое задание не меняется. False — если не изменилось."""
+    now = int(time.time())
+    finished = now if status in ("done", "cancelled") else None
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            UPDATE broadcasts SET status=%s, updated_at=%s, finished_at=%s
+            WHERE id=%s AND status IN ('running', 'paused')
+        """, (status, now, finished, broadcast_id))
+        changed = c.rowcount > 0
+        if changed:
+            _notify(c, "broadcast", broadcast_id)
+        return changed
+
+# ── FSM ────────────────────────────────────────────────────────────────────────
+# Состояния aiogram FSM (миграция 15); кэш и отложенная запись — в fsm_storage.py.
+
+def get_fsm_state(key: str) -> Optional[Dict]:
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT state, data, updated_at FROM fsm_states WHERE key=%s", (key,))
+        return _row(c)
+
+def save_fsm_states(rows: List[Tuple]):
+    """Пачка (key, state, data): пустые состояния удаляются, остальные пишутся upsert-ом."""
+    now = int(time.time())
+    keep = [(key, state, psycopg2.extras.Json(data), now) for key, state, data in rows if state is not None or data]
+    drop = [key for key, state, data in rows if state is None and not data]
+    with get_conn() as conn:
+        c = conn.cursor()
+        if keep:
+            psycopg2.extras.execute_values(c, """
+                INSERT INTO fsm_states (key, state, data, updated_at) VALUES %s
+                ON CONFLICT (key) DO UPDATE SET state=EXCLUDED.state, data=EXCLUDED.data, updated_at=EXCLUDED.updated_at
+            """, keep, page_size=1000)
+        if drop:
+            c.execute("DELETE FROM fsm_states WHERE key = ANY(%s)", (drop,))
+        c.execute("SELECT pg_notify(%s, p) FROM unnest(%s::text[]) p",
+                  (events.CHANNEL, [events.encode("fsm", key, applied=False) for key, _, _ in rows]))
+
+def delete_stale_fsm_states(before: int, limit: int = 1000) -> List[str]:
+    """Удаляет до limit состояний, не менявшихся с before, возвращает их ключи."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            DELETE FROM fsm_states WHERE key IN (
+                SELECT key FROM fsm_states WHERE updated_at < %s ORDER BY updated_at LIMIT %s
+            ) RETURNING key
+        """, (before, limit))
+        return [r[0] for r in c.fetchall()]
+
+# ── Stats ──────────────────────────────────────────────────────────────────────
+# Счётчики ведут триггеры (миграция 7), чтение — одна строка на ключ.
+
+_stats_cached = (0.0, None)  # (истекает, значение) — присваивание атомарно между потоками
+
+def get_stats() -> Dict[str, int]:
+    """users, profiles, chats, messages, reports (новые жалобы) — с кэшем на STATS_CACHE_TTL секунд."""
+    global _stats_cached
+    expires, value = _stats_cached
+    if value is not None and time.monotonic() < expires:
+        return dict(value)
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT key, value FROM stats")
+        value = dict(c.fetchall())
+    _stats_cached = (time.monotonic() + STATS_CACHE_TTL, value)
+    return dict(value)
@@ -0,0 +1,749 @@
+import json
+import asyncio
+import time
+import random
+import logging
+import asyncpg
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Tuple, FrozenSet
+
+import events
+from bans import BanList
+from cache import TTLCache, MISSING
+from config import CACHE_SIZE, CACHE_TTL, BLOCK_CACHE_TTL, BAN_SWEEP_INTERVAL, STATS_CACHE_TTL
+from feed_index import FeedIndex
+
+from database import (
+    DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_MAX_IDLE,
+)
+
+# Асинхронный двойник database.py: те же имена функций и формы результатов,
+# но на asyncpg со своим пулом, чтобы хендлеры не блокировали event loop.
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+
+feed = FeedIndex()
+_feed_dirty: Optional[set] = None  # user_id, изменённые во время перестройки индекса
+
+user_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+profile_cache = TTLCache(CACHE_SIZE, CACHE_TTL)  # user_id → активная анкета
+block_cache = TTLCache(CACHE_SIZE, BLOCK_CACHE_TTL)  # user_id → (кого заблокировал, кто заблокировал его)
+
+bans = BanList()
+_sweeper: Optional[asyncio.Task] = None
+
+# ── Pool ───────────────────────────────────────────────────────────────────────
+
+async def _init_conn(conn: asyncpg.Connection):
+    # json-колонки (media в анкетах, reasons в очереди жалоб) отдаём как Python-объекты, как psycopg2
+    for pg_type in ("json", "jsonb"):
+        await conn.set_type_codec(pg_type, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+async def init_pool() -> asyncpg.Pool:
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                DATABASE_URL,
+                min_size=DB_POOL_MIN,
+                max_size=max(DB_POOL_MAX, DB_POOL_MIN, 1),
+                max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+                init=_init_conn,
+            )
+    return _pool
+
+async def close_pool():
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+@asynccontextmanager
+async def get_conn():
+    pool = _pool or await init_pool()
+    async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        yield conn
+
+async def startup():
+    global _sweeper
+    await init_pool()
+    await load_bans()
+    await load_feed_index()
+    await events.start_listener(DATABASE_URL)
+    _sweeper = asyncio.create_task(_sweep_bans_forever())
+
+async def shutdown():
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        try:
+            await _sweeper
+        except asyncio.CancelledError:
+            pass
+        _sweeper = None
+    await events.stop_listener()
+    await close_pool()
+
+def pool_stats() -> Dict:
+    if _pool is None:
+        return {"size": 0, "idle": 0, "in_use": 0, "min": DB_POOL_MIN, "max": DB_POOL_MAX}
+    size, idle = _pool.get_size(), _pool.get_idle_size()
+    return {"size": size, "idle": idle, "in_use": size - idle,
+            "min": _pool.get_min_size(), "max": _pool.get_max_size()}
+
+async def _fetchrow(sql: str, *args) -> Optional[Dict]:
+    async with get_conn() as conn:
+        row = await conn.fetchrow(sql, *args)
+    return dict(row) if row else None
+
+async def _fetch(sql: str, *args) -> List[Dict]:
+    async with get_conn() as conn:
+        rows = await conn.fetch(sql, *args)
+    return [dict(r) for r in rows]
+
+async def _fetchval(sql: str, *args):
+    async with get_conn() as conn:
+        return await conn.fetchval(sql, *args)
+
+async def _execute(sql: str, *args) -> str:
+    async with get_conn() as conn:
+        return await conn.execute(sql, *args)
+
+def _keyset(key: str, after, before, n: int) -> Tuple[str, str, list]:
+    """Условие, ORDER BY и параметры keyset-страницы по убыванию key; плейсхолдеры с $n."""
+    cols = [c.strip() for c in key.split(",")]
+    cursor, op, direction = (before, ">", "ASC") if before else (after, "<", "DESC")
+    order = ", ".join(f"{c} {direction}" for c in cols)
+    if not cursor:
+        return "TRUE", order, []
+    qs = ", ".join(f"${n + i}" for i in range(len(cols)))
+    return f"({', '.join(cols)}) {op} ({qs})", order, list(cursor)
+
+async def _fetch_page(sql: str, key: str, limit: Optional[int], after, before, *args) -> List[Dict]:
+    """sql с {where} и {order}; свои параметры $1.., LIMIT и курсор добавляются следом."""
+    cond, order, cursor = _keyset(key, after, before, len(args) + 2)
+    rows = await _fetch(sql.format(where=cond, order=order) + f" LIMIT ${len(args) + 1}",
+                        *args, limit, *cursor)
+    return rows[::-1] if before else rows
+
+async def _notify(conn, kind: str, key):
+    await conn.execute("SELECT pg_notify($1, $2)", events.CHANNEL, events.encode(kind, key))
+
+# ── Feed index ─────────────────────────────────────────────────────────────────
+
+async def load_feed_index():
+    global feed, _feed_dirty
+    _feed_dirty = set()
+    new = FeedIndex()
+    try:
+        async with get_conn() as conn:
+            async with conn.transaction():
+                await new.load(conn.cursor("""
+                    SELECT p.user_id, p.id, u.interests_mask
+                    FROM profiles p JOIN users u ON p.user_id = u.user_id
+                    WHERE p.active=1 AND u.banned=0
+                    ORDER BY p.user_id, p.id
+                """, prefetch=10000))
+        feed = new
+    finally:
+        dirty, _feed_dirty = _feed_dirty, None
+    for user_id in dirty:
+        await _refresh_feed(user_id)
+    logging.info(f"📇 Индекс ленты: {len(feed)} анкет")
+
+async def _refresh_feed(user_id: int):
+    if _feed_dirty is not None:
+        _feed_dirty.add(user_id)
+    row = await _fetchrow("""
+        SELECT p.id, u.interests_mask
+        FROM users u JOIN profiles p ON p.user_id = u.user_id AND p.active=1
+        WHERE u.user_id=$1 AND u.banned=0
+        ORDER BY p.id DESC LIMIT 1
+    """, user_id)
+    if row:
+        feed.put(user_id, row["id"], row["interests_mask"])
+    else:
+        feed.remove(user_id)
+
+events.subscribe("user", lambda key: _refresh_feed(int(key)))
+events.subscribe("profile", lambda key: _refresh_feed(int(key)))
+events.subscribe("resync", lambda key: load_feed_index())
+
+# ── Cache ──────────────────────────────────────────────────────────────────────
+
+async def _cached(cache: TTLCache, key, loader):
+    value = cache.get(key)
+    if value is MISSING:
+        token = cache.token()
+        value = await loader()
+        cache.set(key, value, token)
+    return dict(value) if value else value
+
+def cache_stats() -> Dict:
+    return {"users": user_cache.stats(), "profiles": profile_cache.stats(), "blocks": block_cache.stats()}
+
+def _clear_caches(key=None):
+    user_cache.clear()
+    profile_cache.clear()
+    block_cache.clear()
+
+def _invalidate_blocks(key: str):
+    for user_id in key.split(","):
+        block_cache.invalidate(int(user_id))
+
+events.subscribe("user", lambda key: user_cache.invalidate(int(key)))
+events.subscribe("profile", lambda key: profile_cache.invalidate(int(key)))
+events.subscribe("likes", lambda key: profile_cache.invalidate(int(key)))  # изменился только счётчик лайков
+events.subscribe("block", _invalidate_blocks)
+events.subscribe("resync", _clear_caches)
+
+# ── Bans ───────────────────────────────────────────────────────────────────────
+
+async def load_bans():
+    rows = await get_banned_users()
+    bans.load((r["user_id"], r["ban_until"], r["ban_reason"]) for r in rows)
+    logging.info(f"🔒 Список банов: {len(bans)}")
+
+async def _refresh_ban(user_id: int):
+    row = await _fetchrow("SELECT banned, ban_until, ban_reason FROM users WHERE user_id=$1", user_id)
+    if row and row["banned"]:
+        bans.put(user_id, row["ban_until"], row["ban_reason"])
+    else:
+        bans.remove(user_id)
+
+async def _sweep_bans_forever():
+    while True:
+        await asyncio.sleep(BAN_SWEEP_INTERVAL)
+        try:
+            expired = await unban_expired()
+            if expired:
+                logging.info(f"🔓 Сняты истёкшие баны: {len(expired)}")
+        except Exception:
+            logging.exception("Ошибка зачистки банов")
+
+events.subscribe("user", lambda key: _refresh_ban(int(key)))
+events.subscribe("resync", lambda key: load_bans())
+
+# ── Users ──────────────────────────────────────────────────────────────────────
+
+async def get_user(user_id: int) -> Optional[Dict]:
+    return await _cached(user_cache, user_id,
+                         lambda: _fetchrow("SELECT * FROM users WHERE user_id=$1", user_id))
+
+async def upsert_user(user_id: int, **kwargs):
+    cols = ", ".join(["user_id", *kwargs])
+    qs = ", ".join(f"${i}" for i in range(1, len(kwargs) + 2))
+    sets = ", ".join(f"{k}=EXCLUDED.{k}" for k in kwargs)
+    on_conflict = f"DO UPDATE SET {sets}" if kwargs else "DO NOTHING"
+    async with get_conn() as conn:
+        async with conn.transaction():
+            await conn.execute(f"INSERT INTO users ({cols}) VALUES ({qs}) ON CONFLICT (user_id) {on_conflict}",
+                               user_id, *kwargs.values())
+            await _notify(conn, "user", user_id)
+    user_cache.invalidate(user_id)
+    if kwargs.keys() & {"banned", "ban_until", "ban_reason"}:
+        await _refresh_ban(user_id)
+    if "interests_mask" in kwargs or "banned" in kwargs:
+        await _refresh_feed(user_id)
+
+async def get_all_users(limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Зарегистрированные, новые первыми; курсор — (created_at, user_id)."""
+    return await _fetch_page(
+        "SELECT * FROM users WHERE registered=1 AND {where} ORDER BY {order}",
+        "created_at, user_id", limit, after, before
+    )
+
+# Выражение совпадает с индексом users_search_trgm_idx (миграция 10)
+_USER_SEARCH_TEXT = "lower(coalesce(name, '') || ' ' || coalesce(username, ''))"
+
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+async def search_users(query: str = "", banned: Optional[int] = None, gender: Optional[str] = None,
+                       created_from: Optional[int] = None, created_to: Optional[int] = None,
+                       limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Подстрока имени/username, префикс user_id и фильтры; порядок и курсор как у get_all_users."""
+    conds, args = ["registered=1"], []
+
+    def arg(value) -> str:
+        args.append(value)
+        return f"${len(args)}"
+
+    query = (query or "").strip().lstrip("@")
+    if query:
+        like = arg(f"%{_like_escape(query.lower())}%")
+        if query.isdigit():
+            conds.append(f"({_USER_SEARCH_TEXT} LIKE {like} OR user_id::text LIKE {arg(query + '%')})")
+        else:
+            conds.append(f"{_USER_SEARCH_TEXT} LIKE {like}")
+    if banned is not None:
+        conds.append(f"banned={arg(int(banned))}")
+    if gender:
+        conds.append(f"gender={arg(gender)}")
+    if created_from is not None:
+        conds.append(f"created_at >= {arg(created_from)}")
+    if created_to is not None:
+        conds.append(f"created_at < {arg(created_to)}")
+    return await _fetch_page(
+        f"SELECT * FROM users WHERE {' AND '.join(conds)} AND {{where}} ORDER BY {{order}}",
+        "created_at, user_id", limit, after, before, *args
+    )
+
+async def is_banned(user_id: int) -> bool:
+    if bans.ready:
+        return bans.is_banned(user_id)
+    user = await get_user(user_id)
+    if not user or not user.get("banned"):
+        return False
+    return user.get("ban_until") is None or time.time() < user["ban_until"]
+
+async def get_banned_users() -> List[Dict]:
+    return await _fetch("SELECT user_id, ban_until, ban_reason FROM users WHERE banned=1")
+
+async def unban_expired() -> List[int]:
+    """Снимает истёкшие временные баны, возвращает user_id."""
+    async with get_conn() as conn:
+        async with conn.transaction():
+            rows = await conn.fetch("""
+                UPDATE users SET banned=0, ban_until=NULL, ban_reason=NULL
+                WHERE banned=1 AND ban_until <= $1
+                RETURNING user_id
+            """, int(time.time()))
+            for r in rows:
+                await _notify(conn, "user", r["user_id"])
+    expired = [r["user_id"] for r in rows]
+    for user_id in expired:
+        user_cache.invalidate(user_id)
+        bans.remove(user_id)
+        await _refresh_feed(user_id)
+    return expired
+
+async def ban_user(user_id: int, duration_key: str, reason: str = ""):
+    from config import BAN_DURATIONS
+    _, seconds = BAN_DURATIONS[duration_key]
+    ban_until = int(time.time() + seconds) if seconds else None
+    await upsert_user(user_id, banned=1, ban_until=ban_until, ban_reason=reason)
+
+async def unban_user(user_id: int):
+    await upsert_user(user_id, banned=0, ban_until=None, ban_reason=None)
+
+# ── Profiles ───────────────────────────────────────────────────────────────────
+
+async def create_profile(user_id: int, description: str) -> int:
+    return await create_profile_with_media(user_id, description, [])
+
+async def create_profile_with_media(user_id: int, description: str, media: List[Tuple[str, str]]) -> int:
+    """Публикует анкету вместе с медиа [(file_id, media_type), ...] одной транзакцией."""
+    now = int(time.time())
+    async with get_conn() as conn:
+        async with conn.transaction():
+            await conn.execute("UPDATE profiles SET active=0 WHERE user_id=$1 AND active=1", user_id)
+            pid = await conn.fetchval(
+                "INSERT INTO profiles (user_id, description, created_at, active) VALUES ($1,$2,$3,1) RETURNING id",
+                user_id, description, now
+            )
+            if media:
+                await conn.execute("""
+                    INSERT INTO profile_media (profile_id, file_id, media_type, created_at)
+                    SELECT $1, m.file_id, m.media_type, $2
+                    FROM unnest($3::text[], $4::text[]) AS m(file_id, media_type)
+                """, pid, now, [f for f, _ in media], [t for _, t in media])
+            await _notify(conn, "profile", user_id)
+    profile_cache.invalidate(user_id)
+    await _refresh_feed(user_id)
+    return pid
+
+async def add_profile_media(profile_id: int, file_id: str, media_type: str):
+    await _execute(
+        "INSERT INTO profile_media (profile_id, file_id, media_type, created_at) VALUES ($1,$2,$3,$4)",
+        profile_id, file_id, media_type, int(time.time())
+    )
+
+async def get_profile_media(profile_id: int) -> List[Dict]:
+    return await _fetch("SELECT * FROM profile_media WHERE profile_id=$1 ORDER BY id", profile_id)
+
+async def get_profile(profile_id: int) -> Optional[Dict]:
+    return await _fetchrow("SELECT * FROM profiles WHERE id=$1", profile_id)
+
+async def get_active_profile(user_id: int) -> Optional[Dict]:
+    return await _cached(profile_cache, user_id,
+                         lambda: _fetchrow("SELECT * FROM profiles WHERE user_id=$1 AND active=1", user_id))
+
+async def delete_active_profile(user_id: int):
+    async with get_conn() as conn:
+        async with conn.transaction():
+            await conn.execute("UPDATE profiles SET active=0 WHERE user_id=$1 AND active=1", user_id)
+            await _notify(conn, "profile", user_id)
+    profile_cache.invalidate(user_id)
+    feed.remove(user_id)
+
+async def get_last_profile_time(user_id: int) -> int:
+    return await _fetchval("SELECT MAX(created_at) as t FROM profiles WHERE user_id=$1", user_id) or 0
+
+# Анкета с полями владельца и медиа одной строкой: media — json-массив {file_id, media_type}
+_PROFILE_FULL_SQL = """
+    SELECT p.*, u.name, u.age, u.gender, u.username, u.interests_mask,
+           COALESCE(m.media, '[]'::json) AS media
+    FROM profiles p
+    JOIN users u ON p.user_id = u.user_id
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object('file_id', pm.file_id, 'media_type', pm.media_type) ORDER BY pm.id) AS media
+        FROM profile_media pm WHERE pm.profile_id = p.id
+    ) m ON true
+"""
+
+async def get_profiles_full(profile_ids: List[int]) -> List[Dict]:
+    """Анкеты с полями владельца и медиа одним запросом, в порядке profile_ids."""
+    if not profile_ids:
+        return []
+    return await _fetch(_PROFILE_FULL_SQL + " WHERE p.id = ANY($1::int[]) ORDER BY array_position($1::int[], p.id)",
+                        list(profile_ids))
+
+_FEED_FILTERS = """
+          AND p.user_id != $1
+          AND u.banned = 0
+          AND (u.interests_mask & $4) <> 0
+          AND NOT EXISTS (SELECT 1 FROM blocks b WHERE b.blocker_id=$1 AND b.blocked_id=p.user_id)
+          AND NOT EXISTS (SELECT 1 FROM blocks b WHERE b.blocked_id=$1 AND b.blocker_id=p.user_id)
+"""
+_FEED_SQL = f"""
+    ({_PROFILE_FULL_SQL}
+     WHERE p.active=1 AND p.rand_key >= $2 {_FEED_FILTERS}
+     ORDER BY p.rand_key LIMIT $3)
+    UNION ALL
+    ({_PROFILE_FULL_SQL}
+     WHERE p.active=1 AND p.rand_key < $2 {_FEED_FILTERS}
+     ORDER BY p.rand_key LIMIT $3)
+    LIMIT $3
+"""
+
+# Кандидаты из in-memory индекса (блокировки уже исключены по block_cache),
+# в базу идёт только выборка строк по id
+_FEED_BY_IDS_SQL = f"""{_PROFILE_FULL_SQL}
+    WHERE p.id = ANY($2::int[]) AND p.user_id <> $1 AND p.active=1 AND u.banned = 0
+    ORDER BY array_position($2::int[], p.id)
+    LIMIT $3
+"""
+
+async def get_matching_profiles(viewer_id: int, interests_mask: int, limit: int = 2) -> List[Dict]:
+    if feed.ready:
+        blocked, blocked_by = await _blocks_of(viewer_id)
+        ids = feed.sample(viewer_id, interests_mask, limit * 3, exclude=blocked | blocked_by)
+        if not ids:
+            return []
+        return await _fetch(_FEED_BY_IDS_SQL, viewer_id, ids, limit)
+    return await _fetch(_FEED_SQL, viewer_id, random.random(), limit, interests_mask)
+
+async def like_profile(profile_id: int, liker_id: int) -> bool:
+    async with get_conn() as conn:
+        async with conn.transaction():
+            existing = await conn.fetchval(
+                "SELECT id FROM profile_likes WHERE profile_id=$1 AND liker_id=$2", profile_id, liker_id
+            )
+            if existing:
+                await conn.execute("DELETE FROM profile_likes WHERE profile_id=$1 AND liker_id=$2", profile_id, liker_id)
+                owner = await conn.fetchval(
+                    "UPDATE profiles SET likes = GREATEST(0, likes-1) WHERE id=$1 RETURNING user_id", profile_id
+                )
+                liked = False
+            else:
+                await conn.execute(
+                    "INSERT INTO profile_likes (profile_id, liker_id, created_at) VALUES ($1,$2,$3)",
+                    profile_id, liker_id, int(time.time())
+                )
+                owner = await conn.fetchval(
+                    "UPDATE profiles SET likes = likes+1 WHERE id=$1 RETURNING user_id", profile_id
+                )
+                liked = True
+            if owner is not None:
+                # анкета владельца закэширована в его воркере; "profile" пересчитал бы ещё и ленту
+                await _notify(conn, "likes", owner)
+    if owner is not None:
+        profile_cache.invalidate(owner)
+    return liked
+
+async def get_active_profiles_admin(limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Курсор — (created_at, id) анкеты."""
+    return await _fetch_page("""
+        SELECT p.*, u.name, u.age, u.gender, u.username, u.interests_mask
+        FROM profiles p JOIN users u ON p.user_id = u.user_id
+        WHERE p.active=1 AND {where} ORDER BY {order}
+    """, "p.created_at, p.id", limit, after, before)
+
+# ── Chats ──────────────────────────────────────────────────────────────────────
+
+async def create_chat(profile_id: int, sender_id: int, target_id: int) -> int:
+    async with get_conn() as conn:
+        chat_id = await conn.fetchval("""
+            WITH ins AS (
+                INSERT INTO chats (profile_id, sender_id, target_id, created_at) VALUES ($1,$2,$3,$4)
+                ON CONFLICT (profile_id, sender_id) DO NOTHING
+                RETURNING id
+            )
+            SELECT id FROM ins
+            UNION ALL
+            SELECT id FROM chats WHERE profile_id=$1 AND sender_id=$2
+            LIMIT 1
+        """, profile_id, sender_id, target_id, int(time.time()))
+        if chat_id is None:
+            # чат вставлен параллельной транзакцией, которую снимок запроса не видел
+            chat_id = await conn.fetchval(
+                "SELECT id FROM chats WHERE profile_id=$1 AND sender_id=$2", profile_id, sender_id
+            )
+        return chat_id
+
+async def get_chat(chat_id: int) -> Optional[Dict]:
+    return await _fetchrow("SELECT * FROM chats WHERE id=$1", chat_id)
+
+async def get_user_chats(user_id: int, limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Курсор — (id,)."""
+    return await _fetch_page(
+        "SELECT * FROM chats WHERE (sender_id=$1 OR target_id=$1) AND {where} ORDER BY {order}",
+        "id", limit, after, before, user_id
+    )
+
+async def add_message(chat_id: int, sender_id: int, content: str, msg_type: str = "text", file_id: str = None) -> int:
+    return await _fetchval(
+        "INSERT INTO messages (chat_id, sender_id, content, msg_type, file_id, created_at) VALUES ($1,$2,$3,$4,$5,$6) RETURNING id",
+        chat_id, sender_id, content, msg_type, file_id, int(time.time())
+    )
+
+async def add_messages(rows: List[Tuple]):
+    """Пачка (chat_id, sender_id, content, msg_type, file_id, created_at) одним COPY."""
+    async with get_conn() as conn:
+        await conn.copy_records_to_table(
+            "messages", records=rows,
+            columns=["chat_id", "sender_id", "content", "msg_type", "file_id", "created_at"]
+        )
+
+async def get_chat_messages(chat_id: int, limit: int = 100, before: Tuple = None) -> List[Dict]:
+    """Последние limit сообщений (старше курсора before = (created_at, id)) по возрастанию времени."""
+    # по убыванию ключа "after" — это более старые строки
+    rows = await _fetch_page("SELECT * FROM messages WHERE chat_id=$1 AND {where} ORDER BY {order}",
+                             "created_at, id", limit, before, None, chat_id)
+    return rows[::-1]
+
+async def get_all_chats_admin(limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Курсор — (created_at, id) чата."""
+    return await _fetch_page("""
+        SELECT c.*,
+               us.name as sender_name, us.username as sender_username,
+               ut.name as target_name, ut.username as target_username
+        FROM chats c
+        LEFT JOIN users us ON c.sender_id = us.user_id
+        LEFT JOIN users ut ON c.target_id = ut.user_id
+        WHERE {where} ORDER BY {order}
+    """, "c.created_at, c.id", limit, after, before)
+
+# ── Reports ────────────────────────────────────────────────────────────────────
+
+async def add_report(chat_id: int, reporter_id: int, reported_id: int, reason: str = ""):
+    await _execute(
+        "INSERT INTO reports (chat_id, reporter_id, reported_id, reason, created_at) VALUES ($1,$2,$3,$4,$5)",
+        chat_id, reporter_id, reported_id, reason, int(time.time())
+    )
+
+async def get_reports(status: str = None, limit: int = None,
+                      after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Курсор — (created_at, id) жалобы."""
+    if status:
+        return await _fetch_page("""
+            SELECT r.*, u.name as reported_name, u.username as reported_username
+            FROM reports r LEFT JOIN users u ON r.reported_id = u.user_id
+            WHERE r.status=$1 AND {where} ORDER BY {order}
+        """, "r.created_at, r.id", limit, after, before, status)
+    return await _fetch_page("""
+        SELECT r.*, u.name as reported_name, u.username as reported_username
+        FROM reports r LEFT JOIN users u ON r.reported_id = u.user_id
+        WHERE {where} ORDER BY {order}
+    """, "r.created_at, r.id", limit, after, before)
+
+_REPORT_SQL = """
+    SELECT r.*, u.name as reported_name, u.username as reported_username
+    FROM reports r LEFT JOIN users u ON r.reported_id = u.user_id
+"""
+
+async def get_report(report_id: int) -> Optional[Dict]:
+    return await _fetchrow(_REPORT_SQL + " WHERE r.id=$1", report_id)
+
+async def get_open_reports(reported_id: int, limit: int = 10) -> List[Dict]:
+    """Открытые жалобы на пользователя, новые первыми."""
+    return await _fetch(
+        _REPORT_SQL + " WHERE r.reported_id=$1 AND r.status='new' ORDER BY r.created_at DESC, r.id DESC LIMIT $2",
+        reported_id, limit
+    )
+
+# Очередь модерации (report_queue) ведут триггеры на reports, см. миграцию 13
+_QUEUE_SQL = """
+    SELECT q.*, u.name as reported_name, u.username as reported_username
+    FROM report_queue q LEFT JOIN users u ON q.reported_id = u.user_id
+"""
+
+async def get_report_queue(limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+    """Пользователи с открытыми жалобами, больше жалоб — выше; курсор — (open_count, last_at, reported_id)."""
+    return await _fetch_page(_QUEUE_SQL + " WHERE {where} ORDER BY {order}",
+                             "q.open_count, q.last_at, q.reported_id", limit, after, before)
+
+async def get_report_queue_entry(reported_id: int) -> Optional[Dict]:
+    return await _fetchrow(_QUEUE_SQL + " WHERE q.reported_id=$1", reported_id)
+
+async def resolve_user_reports(reported_id: int) -> int:
+    """Закрывает все открытые жалобы на пользователя, возвращает их число."""
+    status = await _execute("UPDATE reports SET status='resolved' WHERE reported_id=$1 AND status='new'", reported_id)
+    return int(status.split()[-1])
+
+async def resolve_report(report_id: int):
+    await _execute("UPDATE reports SET status='resolved' WHERE id=$1", report_id)
+
+# ── Blocks ─────────────────────────────────────────────────────────────────────
+
+async def block_user(blocker_id: int, blocked_id: int):
+    try:
+        async with get_conn() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "INSERT INTO blocks (blocker_id, blocked_id, created_at) VALUES ($1,$2,$3)",
+                    blocker_id, blocked_id, int(time.time())
+                )
+                await _notify(conn, "block", f"{blocker_id},{blocked_id}")
+    except asyncpg.UniqueViolationError:
+        pass
+    block_cache.invalidate(blocker_id)
+    block_cache.invalidate(blocked_id)
+
+async def get_user_blocks(user_id: int) -> List[Dict]:
+    return await _fetch(
+        "SELECT blocker_id, blocked_id FROM blocks WHERE blocker_id=$1 OR blocked_id=$1", user_id
+    )
+
+async def _blocks_of(user_id: int) -> Tuple[FrozenSet[int], FrozenSet[int]]:
+    """(кого заблокировал user_id, кто заблокировал user_id) — из block_cache, при промахе из базы."""
+    entry = block_cache.get(user_id)
+    if entry is MISSING:
+        token = block_cache.token()
+        rows = await get_user_blocks(user_id)
+        entry = (frozenset(r["blocked_id"] for r in rows if r["blocker_id"] == user_id),
+                 frozenset(r["blocker_id"] for r in rows if r["blocked_id"] == user_id))
+        block_cache.set(user_id, entry, token)
+    return entry
+
+async def is_blocked(blocker_id: int, blocked_id: int) -> bool:
+    blocked, _ = await _blocks_of(blocker_id)
+    return blocked_id in blocked
+
+# ── Broadcasts ─────────────────────────────────────────────────────────────────
+# Задания рассылки (миграция 14); отправкой занимается broadcast.py.
+# Создание и смена статуса шлют "broadcast", чтобы задание подхватил процесс с рассылками.
+
+_RECIPIENTS_SQL = "FROM users WHERE registered=1 AND banned=0"
+
+async def create_broadcast(admin_id: int, text: str, chat_id: int, message_id: int) -> Dict:
+    """Новое задание; total — число получателей на момент запуска."""
+    now = int(time.time())
+    async with get_conn() as conn:
+        async with conn.transaction():
+            row = await conn.fetchrow(f"""
+                INSERT INTO broadcasts (admin_id, text, total, progress_chat_id, progress_message_id, created_at, updated_at)
+                SELECT $1, $2, count(*), $3, $4, $5, $5 {_RECIPIENTS_SQL}
+                RETURNING *
+            """, admin_id, text, chat_id, message_id, now)
+            await _notify(conn, "broadcast", row["id"])
+    return dict(row)
+
+async def get_broadcast(broadcast_id: int) -> Optional[Dict]:
+    return await _fetchrow("SELECT * FROM broadcasts WHERE id=$1", broadcast_id)
+
+async def get_broadcasts(limit: int = 5) -> List[Dict]:
+    return await _fetch("SELECT * FROM broadcasts ORDER BY id DESC LIMIT $1", limit)
+
+async def get_running_broadcasts() -> List[Dict]:
+    """Задания, прерванные остановкой процесса, — их продолжают при старте."""
+    return await _fetch("SELECT * FROM broadcasts WHERE status='running' ORDER BY id")
+
+async def get_broadcast_recipients(after_user_id: int, limit: int) -> List[int]:
+    """Следующая пачка получателей по возрастанию user_id."""
+    rows = await _fetch(f"SELECT user_id {_RECIPIENTS_SQL} AND user_id > $1 ORDER BY user_id LIMIT $2",
+                        after_user_id, limit)
+    return [r["user_id"] for r in rows]
+
+async def save_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, blocked: int, failed: int):
+    await _execute("""
+        UPDATE broadcasts SET last_user_id=$2, sent=$3, blocked=$4, failed=$5, updated_at=$6 WHERE id=$1
+    """, broadcast_id, last_user_id, sent, blocked, failed, int(time.time()))
+
+async def set_broadcast_status(broadcast_id: int, status: str) -> bool:
+    """running ⇄ paused, → done | cancelled; завершённое задание не меняется. False — если не изменилось."""
+    now = int(time.time())
+    finished = now if status in ("done", "cancelled") else None
+    async with get_conn() as conn:
+        async with conn.transaction():
+            result = await conn.execute("""
+                UPDATE broadcasts SET status=$2, updated_at=$3, finished_at=$4
+                WHERE id=$1 AND status IN ('running', 'paused')
+            """, broadcast_id, status, now, finished)
+            changed = result != "UPDATE 0"
+            if changed:
+                await _notify(conn, "broadcast", broadcast_id)
+    return changed
+
+# ── FSM ────────────────────────────────────────────────────────────────────────
+# Состояния aiogram FSM (миграция 15); кэш и отложенная запись — в fsm_storage.py.
+
+async def get_fsm_state(key: str) -> Optional[Dict]:
+    return await _fetchrow("SELECT state, data, updated_at FROM fsm_states WHERE key=$1", key)
+
+async def save_fsm_states(rows: List[Tuple]):
+    """Пачка (key, state, data): пустые состояния удаляются, остальные пишутся upsert-ом.
+    Другие процессы получают "fsm" по каждому ключу и сбрасывают его из своего кэша."""
+    keep = [(key, state, data) for key, state, data in rows if state is not None or data]
+    drop = [key for key, state, data in rows if state is None and not data]
+    async with get_conn() as conn:
+        async with conn.transaction():
+            if keep:
+                await conn.execute("""
+                    INSERT INTO fsm_states (key, state, data, updated_at)
+                    SELECT * FROM unnest($1::text[], $2::text[], $3::jsonb[]), CAST($4 AS BIGINT)
+                    ON CONFLICT (key) DO UPDATE SET state=EXCLUDED.state, data=EXCLUDED.data, updated_at=EXCLUDED.updated_at
+                """, [r[0] for r in keep], [r[1] for r in keep], [r[2] for r in keep], int(time.time()))
+            if drop:
+                await conn.execute("DELETE FROM fsm_states WHERE key = ANY($1::text[])", drop)
+            await conn.execute("SELECT pg_notify($1, p) FROM unnest($2::text[]) p",
+                               events.CHANNEL, [events.encode("fsm", key) for key, _, _ in rows])
+
+async def delete_stale_fsm_states(before: int, limit: int = 1000) -> List[str]:
+    """Удаляет до limit состояний, не менявшихся с before, возвращает их ключи."""
+    rows = await _fetch("""
+        DELETE FROM fsm_states WHERE key IN (
+            SELECT key FROM fsm_states WHERE updated_at < $1 ORDER BY updated_at LIMIT $2
+        ) RETURNING key
+    """, before, limit)
+    return [r["key"] for r in rows]
+
+# ── Stats ──────────────────────────────────────────────────────────────────────
+
+_stats_cached = (0.0, None)  # (истекает, значение)
+_stats_epoch = 0                # растёт при каждом изменении счётчиков
+
+async def get_stats() -> Dict[str, int]:
+    """users, profiles, chats, messages, reports (новые жалобы) — с кэшем на STATS_CACHE_TTL секунд."""
+    global _stats_cached
+    expires, value = _stats_cached
+    if value is None or time.monotonic() >= expires:
+        epoch = _stats_epoch
+        rows = await _fetch("SELECT key, value FROM stats")
+        value = {r["key"]: r["value"] for r in rows}
+        # счётчики поменялись, пока шёл запрос, — результат может быть старым, не кэшируем
+        if epoch == _stats_epoch:
+            _stats_cached = (time.monotonic() + STATS_CACHE_TTL, value)
+    return dict(value)
+
+def _drop_stats_cache(key: str = ""):
+    global _stats_cached, _stats_epoch
+    _stats_epoch += 1
+    _stats_cached = (0.0, None)
+
+# триггеры stats шлют "stats:<key>" после каждого изменения счётчика
+events.subscribe("stats", _drop_stats_cache)
+events.subscribe("resync", _drop_stats_cache)
@@ -0,0 +1,86 @@
+import uuid
+import asyncio
+import logging
+from collections import defaultdict
+
+import asyncpg
+
+# Уведомления об изменениях между процессами через Postgres LISTEN/NOTIFY.
+# Запись в базу (из бота или веб-панели) делает pg_notify в той же транзакции,
+# процессы с in-memory кэшами слушают канал и обновляют свои структуры.
+# Полезная нагрузка: "<kind>:<key>:<origin>". Асинхронный слой сам обновляет кэши
+# своего процесса, поэтому его события помечены ORIGIN и этим процессом пропускаются;
+# синхронный слой кэшей не трогает и шлёт события без метки.
+
+CHANNEL = "beem_events"
+ORIGIN = uuid.uuid4().hex[:12]
+RECONNECT_DELAY = 5
+
+_subscribers = defaultdict(list)
+_tasks = set()
+_listener = None
+
+def encode(kind: str, key, applied: bool = True) -> str:
+    return f"{kind}:{key}:{ORIGIN if applied else '-'}"
+
+def subscribe(kind: str, callback):
+    """callback(key: str) — обычная функция или корутина. kind "resync" — после переподключения."""
+    _subscribers[kind].append(callback)
+
+async def dispatch(kind: str, key: str = ""):
+    for callback in _subscribers.get(kind, []):
+        try:
+            result = callback(key)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            logging.exception(f"events: ошибка обработчика {kind}:{key}")
+
+def _on_notify(conn, pid, channel, payload):
+    try:
+        kind, key, origin = payload.rsplit(":", 2)
+    except ValueError:
+        return
+    if origin == ORIGIN:
+        return
+    task = asyncio.get_running_loop().create_task(dispatch(kind, key))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+async def _listen_forever(dsn: str):
+    connected_before = False
+    while True:
+        try:
+            conn = await asyncpg.connect(dsn)
+        except (OSError, asyncpg.PostgresError) as e:
+            logging.warning(f"events: нет соединения для LISTEN ({e}), повтор через {RECONNECT_DELAY}с")
+            await asyncio.sleep(RECONNECT_DELAY)
+            continue
+        closed = asyncio.Event()
+        conn.add_termination_listener(lambda c: closed.set())
+        try:
+            await conn.add_listener(CHANNEL, _on_notify)
+            if connected_before:
+                # пока соединения не было, уведомления могли потеряться
+                await dispatch("resync")
+            connected_before = True
+            await closed.wait()
+        finally:
+            if not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(RECONNECT_DELAY)
+
+async def start_listener(dsn: str):
+    global _listener
+    if _listener is None:
+        _listener = asyncio.create_task(_listen_forever(dsn))
+
+async def stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
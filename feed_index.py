@@ -0,0 +1,116 @@
+import random
+from array import array
+from bisect import bisect_left
+from typing import List
+
+from config import INTERESTS
+
+_BITS = [tuple(i for i in range(len(INTERESTS)) if mask & (1 << i)) for mask in range(1 << len(INTERESTS))]
+_ALL = (1 << len(INTERESTS)) - 1
+
+class FeedIndex:
+    """Компактный индекс активных анкет незабаненных пользователей для ленты.
+
+    Хранится в плоских массивах, отсортированных по user_id (без dict на строку):
+    user_id → (profile_id, interests_mask), плюс по массиву user_id на каждый интерес.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._users = array("q")
+        self._profiles = array("i")
+        self._masks = array("I")
+        self._buckets = [array("q") for _ in INTERESTS]
+
+    def __len__(self):
+        return len(self._users)
+
+    def _find(self, user_id: int) -> int:
+        i = bisect_left(self._users, user_id)
+        return i if i < len(self._users) and self._users[i] == user_id else -1
+
+    @staticmethod
+    def _bits(mask: int):
+        return _BITS[mask & _ALL]
+
+    def _bucket_add(self, bit: int, user_id: int):
+        b = self._buckets[bit]
+        j = bisect_left(b, user_id)
+        if j == len(b) or b[j] != user_id:
+            b.insert(j, user_id)
+
+    def _bucket_remove(self, bit: int, user_id: int):
+        b = self._buckets[bit]
+        j = bisect_left(b, user_id)
+        if j < len(b) and b[j] == user_id:
+            del b[j]
+
+    async def load(self, rows):
+        """Строит индекс из (user_id, profile_id, interests_mask), отсортированных по user_id."""
+        async for user_id, profile_id, mask in rows:
+            self._append(user_id, profile_id, mask)
+        self.ready = True
+
+    def _append(self, user_id: int, profile_id: int, mask: int):
+        mask = mask or 0
+        if self._users and self._users[-1] >= user_id:
+            self.put(user_id, profile_id, mask)
+            return
+        self._users.append(user_id)
+        self._profiles.append(profile_id)
+        self._masks.append(mask)
+        buckets = self._buckets
+        for bit in _BITS[mask & _ALL]:
+            buckets[bit].append(user_id)
+
+    def put(self, user_id: int, profile_id: int, mask: int):
+        mask = mask or 0
+        i = bisect_left(self._users, user_id)
+        if i < len(self._users) and self._users[i] == user_id:
+            old = self._masks[i]
+            self._profiles[i] = profile_id
+            self._masks[i] = mask
+            for bit in self._bits(old & ~mask):
+                self._bucket_remove(bit, user_id)
+            for bit in self._bits(mask & ~old):
+                self._bucket_add(bit, user_id)
+            return
+        self._users.insert(i, user_id)
+        self._profiles.insert(i, profile_id)
+        self._masks.insert(i, mask)
+        for bit in self._bits(mask):
+            self._bucket_add(bit, user_id)
+
+    def remove(self, user_id: int):
+        i = self._find(user_id)
+        if i < 0:
+            return
+        for bit in self._bits(self._masks[i]):
+            self._bucket_remove(bit, user_id)
+        del self._users[i]
+        del self._profiles[i]
+        del self._masks[i]
+
+    def sample(self, viewer_id: int, mask: int, k: int, exclude=()) -> List[int]:
+        """До k случайных profile_id с общими интересами, равномерно по объединению корзин."""
+        buckets = [self._buckets[bit] for bit in self._bits(mask or 0) if self._buckets[bit]]
+        total = sum(len(b) for b in buckets)
+        result, seen = [], set()
+        attempts = 0
+        while total and len(result) < k and attempts < k * 20:
+            attempts += 1
+            r = random.randrange(total)
+            for b in buckets:
+                if r < len(b):
+                    user_id = b[r]
+                    break
+                r -= len(b)
+            if user_id == viewer_id or user_id in seen or user_id in exclude:
+                continue
+            i = self._find(user_id)
+            # анкета с n общими интересами лежит в n корзинах — принимаем с вероятностью 1/n
+            if random.randrange(bin(self._masks[i] & mask).count("1")):
+                continue
+            seen.add(user_id)
+            result.append(self._profiles[i])
+        return result
@@ -0,0 +1,217 @@
+import copy
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import events
+import database_async as db
+from config import FSM_STORAGE, FSM_FLUSH_INTERVAL, FSM_CACHE_SIZE, FSM_TTL, FSM_CLEANUP_INTERVAL
+
+# Хранилище aiogram FSM в Postgres (таблица fsm_states, миграция 15).
+# Чтение идёт из LRU-кэша процесса, промах — один SELECT по ключу; отсутствие
+# состояния тоже кэшируется, так что для большинства апдейтов в базу никто не ходит.
+# Запись меняет только кэш и помечает ключ грязным; фоновая задача раз в
+# FSM_FLUSH_INTERVAL пишет все грязные ключи одним upsert-ом — десять update_data
+# подряд при сборе анкеты превращаются в одну запись. При падении процесса теряется
+# не больше последнего интервала. Другие процессы получают событие "fsm" и сбрасывают
+# ключ из своего кэша; одновременная запись одного ключа из двух процессов не
+# согласуется — апдейты одного пользователя должны приходить в один процесс.
+
+MODES = ("postgres", "memory")
+CLEANUP_BATCH = 1000
+SHUTDOWN_RETRIES = 5
+
+if FSM_STORAGE not in MODES:
+    raise ValueError(f"FSM_STORAGE должен быть одним из {MODES}, а не {FSM_STORAGE!r}")
+
+Entry = Tuple[Optional[str], Dict[str, Any], float]  # (state, data, когда записано в базу)
+
+def storage_key(key: StorageKey) -> str:
+    # без ":" — ключ уходит в полезную нагрузку events
+    parts = (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+    return "/".join("" if part is None else str(part) for part in parts)
+
+class PgStorage(BaseStorage):
+    """BaseStorage на Postgres с кэшем чтения и отложенной пакетной записью."""
+
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE, flush_interval: float = FSM_FLUSH_INTERVAL,
+                 ttl: int = FSM_TTL):
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self._dirty = set()
+        self._epoch = 0
+        self._flush_lock = asyncio.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "flushed": 0, "batches": 0, "failures": 0}
+        events.subscribe("fsm", self._forget)
+        events.subscribe("resync", self._forget_all)
+
+    # ── Кэш ──────────────────────────────────────────────────────────────────
+
+    def _forget(self, key: str):
+        if key not in self._dirty:
+            self._entries.pop(key, None)
+        self._epoch += 1
+
+    def _forget_all(self, key: str = ""):
+        for k in [k for k in self._entries if k not in self._dirty]:
+            del self._entries[k]
+        self._epoch += 1
+
+    def _put(self, key: str, entry: Entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.cache_size:
+            oldest = next(iter(self._entries))
+            if oldest in self._dirty:
+                break  # несохранённое не вытесняем, кэш дочистится после flush
+            del self._entries[oldest]
+
+    async def _load(self, key: str) -> Entry:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            epoch = self._epoch
+            row = await db.get_fsm_state(key)
+            entry = self._entries.get(key)  # пока ждали базу, ключ могли записать
+            if entry is None:
+                entry = (row["state"], row["data"], row["updated_at"]) if row else (None, {}, time.time())
+                if epoch == self._epoch:
+                    self._put(key, entry)
+            return entry
+        self._stats["hits"] += 1
+        self._entries.move_to_end(key)
+        state, data, saved_at = entry
+        if (state is not None or data) and time.time() - saved_at > self.ttl / 2:
+            # состояние читают, но давно не меняли — перезаписываем, чтобы его не удалила очистка
+            self._write(key, state, data)
+        return entry
+
+    def _write(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        self._put(key, (state, data, time.time()))
+        self._dirty.add(key)
+        self._stats["writes"] += 1
+
+    # ── BaseStorage ──────────────────────────────────────────────────────────
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = storage_key(key)
+        _, data, _ = await self._load(k)
+        self._write(k, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(storage_key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        k = storage_key(key)
+        state, _, _ = await self._load(k)
+        self._write(k, state, copy.deepcopy(dict(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy((await self._load(storage_key(key)))[1])
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        k = storage_key(key)
+        state, current, _ = await self._load(k)
+        # закэшированный dict не меняем на месте: его может сейчас писать flush
+        current = {**current, **copy.deepcopy(dict(data))}
+        self._write(k, state, current)
+        return copy.deepcopy(current)
+
+    async def close(self) -> None:
+        # aiogram зовёт close() первым при остановке, раньше, чем доработают апдейты;
+        # окончательный сброс — в stop()
+        await self.flush()
+
+    # ── Запись и очистка ─────────────────────────────────────────────────────
+
+    async def flush(self) -> int:
+        """Пишет грязные ключи одной пачкой. При ошибке ключи остаются грязными."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            keys, self._dirty = self._dirty, set()
+            rows = [(k, *self._entries[k][:2]) for k in keys]
+            try:
+                await db.save_fsm_states(rows)
+            except BaseException:
+                self._dirty |= keys
+                self._stats["failures"] += 1
+                raise
+            self._stats["flushed"] += len(rows)
+            self._stats["batches"] += 1
+            return len(rows)
+
+    async def cleanup(self) -> int:
+        """Удаляет состояния, не менявшиеся ttl секунд."""
+        before = int(time.time()) - self.ttl
+        total = 0
+        while True:
+            keys = await db.delete_stale_fsm_states(before, CLEANUP_BATCH)
+            for k in keys:
+                if k not in self._dirty:
+                    self._entries.pop(k, None)
+            total += len(keys)
+            if len(keys) < CLEANUP_BATCH:
+                break
+        if total:
+            logging.info(f"🧹 FSM: удалено устаревших состояний: {total}")
+        return total
+
+    async def _run_forever(self):
+        next_cleanup = time.monotonic()
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.warning(f"💾 FSM: не удалось записать {len(self._dirty)} состояний ({e}), повтор")
+            if time.monotonic() >= next_cleanup and not self._stopping:
+                next_cleanup = time.monotonic() + FSM_CLEANUP_INTERVAL
+                try:
+                    await self.cleanup()
+                except Exception as e:
+                    logging.warning(f"🧹 FSM: очистка не удалась ({e})")
+
+    async def start(self):
+        """Запускает фоновую запись (dp.startup, после db.startup)."""
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        """Останавливает фоновую запись и сохраняет остаток (до закрытия пула)."""
+        if self._task is not None:
+            # без cancel(): прерванный посреди upsert запрос подвесил бы соединение пула
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        for attempt in range(SHUTDOWN_RETRIES):
+            try:
+                await self.flush()
+                break
+            except Exception as e:
+                logging.warning(f"💾 FSM: сброс при остановке не удался ({e}), попытка {attempt + 1}")
+                await asyncio.sleep(1)
+        if self._dirty:
+            logging.error(f"💾 FSM: потеряно {len(self._dirty)} состояний при остановке")
+
+    def stats(self) -> Dict:
+        total = self._stats["hits"] + self._stats["misses"]
+        return {"cached": len(self._entries), "dirty": len(self._dirty),
+                "hit_rate": round(self._stats["hits"] / total, 4) if total else 0.0, **self._stats}
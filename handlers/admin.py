@@ -1,15 +1,25 @@
 import time
+from html import escape
 from aiogram import Router, F, Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-import database as db
-from config import ADMIN_IDS, BAN_DURATIONS, INTERESTS_DISPLAY
-from keyboards import admin_ban_kb
+import broadcast
+import database_async as db
+import outbox
+from config import ADMIN_IDS, BAN_DURATIONS, REPORT_REASONS
+from interests import fmt_interests
+from keyboards import admin_ban_kb, broadcast_kb, pager_rows
+from middlewares import PriorityMiddleware
+from pagination import callback_cursor, make_page
 
 router = Router()
+# ответы админу и просмотр чатов уступают пересылке в чатах пользователей
+router.message.middleware(PriorityMiddleware(outbox.ADMIN))
+router.callback_query.middleware(PriorityMiddleware(outbox.ADMIN))
 
 def adm(user_id: int) -> bool:
     return user_id in ADMIN_IDS
@@ -21,61 +31,92 @@ class AdminFSM(StatesGroup):
 
 # ── Меню ──────────────────────────────────────────────────────────────────────
 
+FIND_LIMIT = 20
+
 @router.message(Command("admin"))
-async def admin_menu(message: Message):
+async def admin_menu(message: Message, command: CommandObject):
     if not adm(message.from_user.id): return
+    sub, _, query = (command.args or "").strip().partition(" ")
+    if sub == "find":
+        await admin_find(message, query.strip())
+        return
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-    users = db.get_all_users()
-    chats = db.get_all_chats_admin()
-    reports = db.get_reports("new")
-    profiles = db.get_active_profiles_admin()
+    stats = await db.get_stats()
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="👥 Пользователи", callback_data="adm:users"),
          InlineKeyboardButton(text="📋 Анкеты", callback_data="adm:profiles")],
         [InlineKeyboardButton(text="💬 Чаты", callback_data="adm:chats"),
-         InlineKeyboardButton(text=f"⚠️ Жалобы ({len(reports)})", callback_data="adm:reports")],
+         InlineKeyboardButton(text=f"⚠️ Жалобы ({stats['reports']})", callback_data="adm:reports")],
         [InlineKeyboardButton(text="📢 Рассылка", callback_data="adm:broadcast")],
     ])
     await message.answer(
         f"🔐 <b>Beem Admin</b>\n\n"
-        f"👥 Пользователей: <b>{len(users)}</b>\n"
-        f"📋 Активных анкет: <b>{len(profiles)}</b>\n"
-        f"💬 Чатов: <b>{len(chats)}</b>\n"
-        f"⚠️ Новых жалоб: <b>{len(reports)}</b>",
+        f"👥 Пользователей: <b>{stats['users']}</b>\n"
+        f"📋 Активных анкет: <b>{stats['profiles']}</b>\n"
+        f"💬 Чатов: <b>{stats['chats']}</b>\n"
+        f"⚠️ Новых жалоб: <b>{stats['reports']}</b>",
         parse_mode="HTML", reply_markup=kb
     )
 
 # ── Пользователи ──────────────────────────────────────────────────────────────
 
-@router.callback_query(F.data == "adm:users")
+@router.callback_query(F.data.startswith("adm:users"))
 async def adm_users(callback: CallbackQuery):
     if not adm(callback.from_user.id): return
-    users = db.get_all_users()
+    after, before = callback_cursor(callback.data)
+    users = make_page(await db.get_all_users(limit=21, after=after, before=before), 20,
+                      lambda u: (u["created_at"], u["user_id"]), after, before)
+    total = (await db.get_stats())["users"]
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
     rows = []
-    for u in users[:20]:
+    for u in users:
         ban_icon = "🔒 " if u.get("banned") else ""
         rows.append([InlineKeyboardButton(
             text=f"{ban_icon}{u['name']}, {u['age']}л | @{u.get('username') or '—'}",
             callback_data=f"adm:user:{u['user_id']}"
         )])
+    rows += pager_rows("adm:users", users)
     rows.append([InlineKeyboardButton(text="◀️ Назад", callback_data="adm:menu")])
     await callback.message.edit_text(
-        f"👥 <b>Пользователи ({len(users)})</b>",
+        f"👥 <b>Пользователи ({total})</b>",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=rows)
     )
     await callback.answer()
 
+async def admin_find(message: Message, query: str):
+    """/admin find <имя | @username | начало ID>"""
+    if not query:
+        await message.answer("🔎 Использование: <code>/admin find имя, @username или ID</code>", parse_mode="HTML")
+        return
+    users = await db.search_users(query, limit=FIND_LIMIT + 1)
+    if not users:
+        await message.answer(f"🔎 По запросу «{query}» никого не найдено.")
+        return
+    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+    rows = []
+    for u in users[:FIND_LIMIT]:
+        ban_icon = "🔒 " if u.get("banned") else ""
+        rows.append([InlineKeyboardButton(
+            text=f"{ban_icon}{u['name']}, {u['age']}л | @{u.get('username') or '—'}",
+            callback_data=f"adm:user:{u['user_id']}"
+        )])
+    more = f"\nПоказаны первые {FIND_LIMIT} — уточни запрос." if len(users) > FIND_LIMIT else ""
+    await message.answer(
+        f"🔎 <b>Поиск: {escape(query)}</b>{more}",
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=rows)
+    )
+
 @router.callback_query(F.data.startswith("adm:user:"))
 async def adm_user_detail(callback: CallbackQuery):
     if not adm(callback.from_user.id): return
     user_id = int(callback.data.split(":")[2])
-    u = db.get_user(user_id)
+    u = await db.get_user(user_id)
     if not u:
         await callback.answer("Не найден", show_alert=True)
         return
-    interests = ", ".join(INTERESTS_DISPLAY.get(i, i) for i in (u.get("interests") or "").split(",") if i)
+    interests = fmt_interests(u.get("interests_mask"))
     ban_status = "🔒 Заблокирован" if u.get("banned") else "✅ Активен"
     ban_until = ""
     if u.get("ban_until"):
@@ -103,9 +144,9 @@ async def adm_ban(callback: CallbackQuery, bot: Bot):
     _, user_id, duration = callback.data.split(":")
     user_id = int(user_id)
     label = BAN_DURATIONS[duration][0]
-    db.ban_user(user_id, duration, reason="Нарушение правил")
+    await db.ban_user(user_id, duration, reason="Нарушение правил")
     # Удалить анкету
-    db.delete_active_profile(user_id)
+    await db.delete_active_profile(user_id)
     try:
         await bot.send_message(user_id, f"🚫 Ты заблокирован на {label}.")
     except: pass
@@ -116,7 +157,7 @@ async def adm_ban(callback: CallbackQuery, bot: Bot):
 async def adm_unban(callback: CallbackQuery, bot: Bot):
     if not adm(callback.from_user.id): return
     user_id = int(callback.data.split(":")[1])
-    db.unban_user(user_id)
+    await db.unban_user(user_id)
     try:
         await bot.send_message(user_id, "✅ Ты разблокирован!")
     except: pass
@@ -125,20 +166,24 @@ async def adm_unban(callback: CallbackQuery, bot: Bot):
 
 # ── Анкеты ────────────────────────────────────────────────────────────────────
 
-@router.callback_query(F.data == "adm:profiles")
+@router.callback_query(F.data.startswith("adm:profiles"))
 async def adm_profiles(callback: CallbackQuery):
     if not adm(callback.from_user.id): return
-    profiles = db.get_active_profiles_admin()
+    after, before = callback_cursor(callback.data)
+    profiles = make_page(await db.get_active_profiles_admin(limit=16, after=after, before=before), 15,
+                         lambda p: (p["created_at"], p["id"]), after, before)
+    total = (await db.get_stats())["profiles"]
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
     rows = []
-    for p in profiles[:15]:
+    for p in profiles:
         rows.append([InlineKeyboardButton(
             text=f"{p['name']}, {p['age']}л — {p['description'][:30]}...",
             callback_data=f"adm:user:{p['user_id']}"
         )])
+    rows += pager_rows("adm:profiles", profiles)
     rows.append([InlineKeyboardButton(text="◀️ Назад", callback_data="adm:menu")])
     await callback.message.edit_text(
-        f"📋 <b>Активные анкеты ({len(profiles)})</b>",
+        f"📋 <b>Активные анкеты ({total})</b>",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=rows)
     )
@@ -146,22 +191,26 @@ async def adm_profiles(callback: CallbackQuery):
 
 # ── Чаты ─────────────────────────────────────────────────────────────────────
 
-@router.callback_query(F.data == "adm:chats")
+@router.callback_query(F.data.startswith("adm:chats"))
 async def adm_chats(callback: CallbackQuery):
     if not adm(callback.from_user.id): return
-    chats = db.get_all_chats_admin()
+    after, before = callback_cursor(callback.data)
+    chats = make_page(await db.get_all_chats_admin(limit=21, after=after, before=before), 20,
+                      lambda c: (c["created_at"], c["id"]), after, before)
+    total = (await db.get_stats())["chats"]
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
     rows = []
-    for c in chats[:20]:
+    for c in chats:
         sn = c.get("sender_name") or f"ID:{c['sender_id']}"
         tn = c.get("target_name") or f"ID:{c['target_id']}"
         rows.append([InlineKeyboardButton(
-            text=f"#{c['id']} {sn} → {tn} ({c.get('msg_count',0)} сооб.)",
+            text=f"#{c['id']} {sn} → {tn} ({c['message_count']} сооб.)",
             callback_data=f"adm:chat:{c['id']}"
         )])
+    rows += pager_rows("adm:chats", chats)
     rows.append([InlineKeyboardButton(text="◀️ Назад", callback_data="adm:menu")])
     await callback.message.edit_text(
-        f"💬 <b>Чаты ({len(chats)})</b>",
+        f"💬 <b>Чаты ({total})</b>",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=rows)
     )
@@ -171,21 +220,21 @@ async def adm_chats(callback: CallbackQuery):
 async def adm_chat_detail(callback: CallbackQuery, bot: Bot):
     if not adm(callback.from_user.id): return
     chat_id = int(callback.data.split(":")[2])
-    chat = db.get_chat(chat_id)
+    chat = await db.get_chat(chat_id)
     if not chat:
         await callback.answer("Не найден", show_alert=True)
         return
 
-    messages = db.get_chat_messages(chat_id, limit=50)
-    sender = db.get_user(chat["sender_id"])
-    target = db.get_user(chat["target_id"])
+    messages = await db.get_chat_messages(chat_id, limit=50)
+    sender = await db.get_user(chat["sender_id"])
+    target = await db.get_user(chat["target_id"])
     sn = sender["name"] if sender else f"ID:{chat['sender_id']}"
     tn = target["name"] if target else f"ID:{chat['target_id']}"
 
     await callback.message.answer(
         f"💬 <b>Чат #{chat_id}</b>\n"
         f"📨 {sn} (ID:{chat['sender_id']}) → 📬 {tn} (ID:{chat['target_id']})\n"
-        f"Сообщений: {len(messages)}\n"
+        f"Сообщений: {chat['message_count']}\n"
         f"──────────────────",
         parse_mode="HTML"
     )
@@ -234,25 +283,68 @@ async def adm_chat_detail(callback: CallbackQuery, bot: Bot):
 
 # ── Жалобы ────────────────────────────────────────────────────────────────────
 
-@router.callback_query(F.data == "adm:reports")
+def fmt_reasons(reasons: dict) -> str:
+    """{"spam": 3, "abuse": 1} → "💬 Спам ×3, 😡 Оскорбления ×1" (частые первыми)."""
+    items = sorted((reasons or {}).items(), key=lambda kv: -kv[1])
+    return ", ".join(f"{REPORT_REASONS.get(k, k or '—')} ×{n}" for k, n in items) or "—"
+
+def fmt_ts(ts) -> str:
+    return time.strftime("%d.%m.%Y %H:%M", time.localtime(ts)) if ts else "—"
+
+@router.callback_query(F.data.startswith("adm:reports"))
 async def adm_reports(callback: CallbackQuery):
     if not adm(callback.from_user.id): return
-    reports = db.get_reports("new")
+    after, before = callback_cursor(callback.data)
+    queue = make_page(await db.get_report_queue(limit=16, after=after, before=before), 15,
+                      lambda q: (q["open_count"], q["last_at"], q["reported_id"]), after, before)
+    total = (await db.get_stats())["reports"]
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-    if not reports:
+    if not queue:
         await callback.message.edit_text("✅ Новых жалоб нет!")
         await callback.answer()
         return
     rows = []
-    for r in reports[:15]:
-        name = r.get("reported_name") or f"ID:{r['reported_id']}"
+    for q in queue:
+        name = q.get("reported_name") or f"ID:{q['reported_id']}"
         rows.append([InlineKeyboardButton(
-            text=f"⚠️ На {name} | {r.get('reason','—')}",
-            callback_data=f"adm:report:{r['id']}"
+            text=f"⚠️ {name} — {q['open_count']} жалоб | {fmt_reasons(q['reasons'])}",
+            callback_data=f"adm:rq:{q['reported_id']}"
         )])
+    rows += pager_rows("adm:reports", queue)
     rows.append([InlineKeyboardButton(text="◀️ Назад", callback_data="adm:menu")])
     await callback.message.edit_text(
-        f"⚠️ <b>Жалобы ({len(reports)})</b>",
+        f"⚠️ <b>Жалобы ({total})</b>",
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=rows)
+    )
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("adm:rq:"))
+async def adm_report_group(callback: CallbackQuery):
+    """Все открытые жалобы на одного пользователя."""
+    if not adm(callback.from_user.id): return
+    reported_id = int(callback.data.split(":")[2])
+    q = await db.get_report_queue_entry(reported_id)
+    if not q:
+        await callback.answer("Открытых жалоб нет", show_alert=True)
+        return
+    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+    recent = await db.get_open_reports(reported_id, limit=5)
+    rows = [[InlineKeyboardButton(
+        text=f"#{r['id']} · {REPORT_REASONS.get(r['reason'], r['reason'] or '—')} · {fmt_ts(r['created_at'])}",
+        callback_data=f"adm:report:{r['id']}"
+    )] for r in recent]
+    rows += [
+        [InlineKeyboardButton(text="🔒 Забанить", callback_data=f"adm:user:{reported_id}"),
+         InlineKeyboardButton(text="✅ Закрыть все", callback_data=f"adm:resolveuser:{reported_id}")],
+        [InlineKeyboardButton(text="💬 Последний чат", callback_data=f"adm:chat:{q['last_chat_id']}")],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data="adm:reports")],
+    ]
+    await callback.message.edit_text(
+        f"⚠️ <b>{q.get('reported_name') or '—'}</b> (ID:{reported_id}) — {q['open_count']} жалоб\n\n"
+        f"Причины: {fmt_reasons(q['reasons'])}\n"
+        f"Первая: {fmt_ts(q['first_at'])}\n"
+        f"Последняя: {fmt_ts(q['last_at'])}",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=rows)
     )
@@ -262,24 +354,23 @@ async def adm_reports(callback: CallbackQuery):
 async def adm_report_detail(callback: CallbackQuery):
     if not adm(callback.from_user.id): return
     report_id = int(callback.data.split(":")[2])
-    reports = db.get_reports()
-    r = next((x for x in reports if x["id"] == report_id), None)
+    r = await db.get_report(report_id)
     if not r:
         await callback.answer("Не найдено", show_alert=True)
         return
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-    ts = time.strftime("%d.%m.%Y %H:%M", time.localtime(r["created_at"]))
     await callback.message.edit_text(
         f"⚠️ <b>Жалоба #{report_id}</b>\n\n"
         f"На: {r.get('reported_name')} (ID:{r['reported_id']})\n"
-        f"Причина: {r.get('reason', '—')}\n"
+        f"Причина: {REPORT_REASONS.get(r['reason'], r['reason'] or '—')}\n"
         f"Чат: #{r['chat_id']}\n"
-        f"Время: {ts}",
+        f"Время: {fmt_ts(r['created_at'])}",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🔒 Забанить", callback_data=f"adm:user:{r['reported_id']}"),
              InlineKeyboardButton(text="✅ Закрыть", callback_data=f"adm:resolvereport:{report_id}")],
             [InlineKeyboardButton(text="💬 Открыть чат", callback_data=f"adm:chat:{r['chat_id']}")],
+            [InlineKeyboardButton(text="◀️ Все жалобы на пользователя", callback_data=f"adm:rq:{r['reported_id']}")],
         ])
     )
     await callback.answer()
@@ -288,13 +379,35 @@ async def adm_report_detail(callback: CallbackQuery):
 async def adm_resolve_report(callback: CallbackQuery):
     if not adm(callback.from_user.id): return
     report_id = int(callback.data.split(":")[2])
-    db.resolve_report(report_id)
+    await db.resolve_report(report_id)
     await callback.answer("✅ Жалоба закрыта", show_alert=True)
     await callback.message.edit_text("✅ Жалоба закрыта.")
 
+@router.callback_query(F.data.startswith("adm:resolveuser:"))
+async def adm_resolve_user_reports(callback: CallbackQuery):
+    if not adm(callback.from_user.id): return
+    reported_id = int(callback.data.split(":")[2])
+    n = await db.resolve_user_reports(reported_id)
+    await callback.answer(f"✅ Закрыто жалоб: {n}", show_alert=True)
+    await callback.message.edit_text(f"✅ Жалобы на ID:{reported_id} закрыты ({n}).")
+
 # ── Рассылка ──────────────────────────────────────────────────────────────────
 
 @router.callback_query(F.data == "adm:broadcast")
+async def adm_broadcasts(callback: CallbackQuery):
+    if not adm(callback.from_user.id): return
+    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+    rows = [[InlineKeyboardButton(
+        text=f"#{b['id']} {broadcast.STATUS_LABELS.get(b['status'], b['status'])} — {b['text'][:30]}",
+        callback_data=f"adm:bc:show:{b['id']}"
+    )] for b in await db.get_broadcasts()]
+    rows.append([InlineKeyboardButton(text="✍️ Новая рассылка", callback_data="adm:bc:new")])
+    rows.append([InlineKeyboardButton(text="◀️ Меню", callback_data="adm:menu")])
+    await callback.message.edit_text("📢 <b>Рассылки</b>", parse_mode="HTML",
+                                     reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+    await callback.answer()
+
+@router.callback_query(F.data == "adm:bc:new")
 async def adm_broadcast_start(callback: CallbackQuery, state: FSMContext):
     if not adm(callback.from_user.id): return
     await callback.message.answer("📢 Напиши текст рассылки:")
@@ -302,17 +415,42 @@ async def adm_broadcast_start(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(AdminFSM.broadcast)
-async def adm_do_broadcast(message: Message, state: FSMContext, bot: Bot):
+async def adm_do_broadcast(message: Message, state: FSMContext):
     if not adm(message.from_user.id): return
+    if not message.text:
+        await message.answer("📢 Нужен текст — напиши сообщение для рассылки:")
+        return
     await state.clear()
-    users = db.get_all_users()
-    sent = failed = 0
-    for u in users:
-        try:
-            await bot.send_message(u["user_id"], f"📢 <b>Объявление от Beem:</b>\n\n{message.text}", parse_mode="HTML")
-            sent += 1
-        except: failed += 1
-    await message.answer(f"📢 Рассылка завершена:\n✅ Доставлено: {sent}\n❌ Ошибок: {failed}")
+    progress = await message.answer("📢 Рассылка запускается…")
+    job = await broadcast.create(message.from_user.id, message.html_text, progress.chat.id, progress.message_id)
+    await progress.edit_text(broadcast.fmt_progress(job), parse_mode="HTML", reply_markup=broadcast_kb(job))
+
+@router.callback_query(F.data.startswith("adm:bc:"))
+async def adm_broadcast_control(callback: CallbackQuery):
+    if not adm(callback.from_user.id): return
+    _, _, action, bid = callback.data.split(":")
+    bid = int(bid)
+    if action == "pause":
+        ok = await broadcast.pause(bid)
+    elif action == "resume":
+        ok = await broadcast.resume(bid)
+    elif action == "cancel":
+        ok = await broadcast.cancel(bid)
+    else:
+        ok = True
+    job = await db.get_broadcast(bid)
+    if not job:
+        await callback.answer("Рассылка не найдена", show_alert=True)
+        return
+    if ok:
+        await callback.answer()
+    else:
+        await callback.answer("⚠️ Статус уже изменился", show_alert=True)
+    try:
+        await callback.message.edit_text(broadcast.fmt_progress(job), parse_mode="HTML",
+                                         reply_markup=broadcast_kb(job))
+    except TelegramBadRequest:
+        pass  # прогресс не изменился
 
 @router.callback_query(F.data == "adm:menu")
 async def adm_back_menu(callback: CallbackQuery):
@@ -321,22 +459,19 @@ async def adm_back_menu(callback: CallbackQuery):
     await admin_menu.__wrapped__(callback.message) if hasattr(admin_menu, '__wrapped__') else None
     # Просто показываем меню заново
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-    users = db.get_all_users()
-    chats = db.get_all_chats_admin()
-    reports = db.get_reports("new")
-    profiles = db.get_active_profiles_admin()
+    stats = await db.get_stats()
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="👥 Пользователи", callback_data="adm:users"),
          InlineKeyboardButton(text="📋 Анкеты", callback_data="adm:profiles")],
         [InlineKeyboardButton(text="💬 Чаты", callback_data="adm:chats"),
-         InlineKeyboardButton(text=f"⚠️ Жалобы ({len(reports)})", callback_data="adm:reports")],
+         InlineKeyboardButton(text=f"⚠️ Жалобы ({stats['reports']})", callback_data="adm:reports")],
         [InlineKeyboardButton(text="📢 Рассылка", callback_data="adm:broadcast")],
     ])
     await callback.message.edit_text(
         f"🔐 <b>Beem Admin</b>\n\n"
-        f"👥 Пользователей: <b>{len(users)}</b>\n"
-        f"📋 Активных анкет: <b>{len(profiles)}</b>\n"
-        f"💬 Чатов: <b>{len(chats)}</b>\n"
-        f"⚠️ Новых жалоб: <b>{len(reports)}</b>",
+        f"👥 Пользователей: <b>{stats['users']}</b>\n"
+        f"📋 Активных анкет: <b>{stats['profiles']}</b>\n"
+        f"💬 Чатов: <b>{stats['chats']}</b>\n"
+        f"⚠️ Новых жалоб: <b>{stats['reports']}</b>",
         parse_mode="HTML", reply_markup=kb
     )
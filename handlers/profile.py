@@ -4,8 +4,9 @@ from aiogram.types import Message, CallbackQuery, InputMediaPhoto, InputMediaVid
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-import database as db
-from config import PROFILE_COOLDOWN, INTERESTS_DISPLAY
+import database_async as db
+from config import PROFILE_COOLDOWN
+from interests import labels
 from keyboards import main_kb, profile_view_kb
 
 router = Router()
@@ -16,17 +17,18 @@ class ProfileFSM(StatesGroup):
     collecting = State()  # Сбор медиа/текста для анкеты
 
 def profile_caption(user: dict, profile: dict) -> str:
-    interests = [INTERESTS_DISPLAY.get(i, i) for i in (user.get("interests") or "").split(",") if i]
     return (
         f"👤 <b>{user['name']}</b>, {user['age']} лет  {GENDER_MAP.get(user.get('gender'), '')}\n"
-        f"🎯 {' '.join(interests)}\n\n"
+        f"🎯 {' '.join(labels(user.get('interests_mask')))}\n\n"
         f"📝 {profile['description']}\n\n"
         f"❤️ {profile.get('likes', 0)} лайков"
     )
 
 async def send_profile(bot: Bot, chat_id: int, user: dict, profile: dict, show_actions: bool = True):
-    """Отправляет анкету с медиафайлами"""
-    media_list = db.get_profile_media(profile["id"])
+    """Отправляет анкету с медиафайлами (media берётся из строки get_profiles_full, если уже есть)"""
+    media_list = profile.get("media")
+    if media_list is None:
+        media_list = await db.get_profile_media(profile["id"])
     caption = profile_caption(user, profile)
     kb = profile_view_kb(profile["id"], user["user_id"], profile.get("likes", 0)) if show_actions else None
 
@@ -71,14 +73,11 @@ async def send_profile(bot: Bot, chat_id: int, user: dict, profile: dict, show_a
 
 @router.message(F.text == "➕ Добавить анкету")
 async def add_profile_start(message: Message, state: FSMContext):
-    user = db.get_user(message.from_user.id)
+    user = await db.get_user(message.from_user.id)
     if not user or not user.get("registered"):
         await message.answer("Сначала зарегистрируйся: /start")
         return
-    if db.is_banned(message.from_user.id):
-        await message.answer("🚫 Ты заблокирован.")
-        return
-    elapsed = time.time() - db.get_last_profile_time(message.from_user.id)
+    elapsed = time.time() - await db.get_last_profile_time(message.from_user.id)
     if elapsed < PROFILE_COOLDOWN:
         rem = int(PROFILE_COOLDOWN - elapsed)
         m, s = divmod(rem, 60)
@@ -108,12 +107,12 @@ async def publish_profile(message: Message, state: FSMContext, bot: Bot):
         await message.answer("Анкета пустая! Добавь хотя бы текст или медиа.")
         return
 
-    pid = db.create_profile(message.from_user.id, desc or "Загляни в мою анкету 👀")
-    for m in media:
-        db.add_profile_media(pid, m["file_id"], m["type"])
+    await db.create_profile_with_media(
+        message.from_user.id, desc or "Загляни в мою анкету 👀",
+        [(m["file_id"], m["type"]) for m in media]
+    )
 
     await state.clear()
-    profile = db.get_active_profile(message.from_user.id)
     await message.answer(
         "✅ Анкета опубликована! Другие пользователи уже могут её видеть.",
         reply_markup=main_kb(has_profile=True)
@@ -148,8 +147,8 @@ async def collect_profile_content(message: Message, state: FSMContext):
 
 @router.message(F.text == "📝 Моя анкета")
 async def my_profile(message: Message, bot: Bot):
-    user = db.get_user(message.from_user.id)
-    profile = db.get_active_profile(message.from_user.id)
+    user = await db.get_user(message.from_user.id)
+    profile = await db.get_active_profile(message.from_user.id)
     if not profile:
         await message.answer("У тебя нет активной анкеты.", reply_markup=main_kb(False))
         return
@@ -158,51 +157,39 @@ async def my_profile(message: Message, bot: Bot):
 
 @router.message(F.text == "🗑 Удалить анкету")
 async def del_profile(message: Message):
-    profile = db.get_active_profile(message.from_user.id)
+    profile = await db.get_active_profile(message.from_user.id)
     if not profile:
         await message.answer("У тебя нет активной анкеты.", reply_markup=main_kb(False))
         return
-    db.delete_active_profile(message.from_user.id)
+    await db.delete_active_profile(message.from_user.id)
     await message.answer("🗑 Анкета удалена.", reply_markup=main_kb(False))
 
 # ── Просмотр анкет ─────────────────────────────────────────────────────────────
 
 @router.message(F.text == "👥 Анкеты")
 async def browse_profiles(message: Message, bot: Bot):
-    if db.is_banned(message.from_user.id):
-        await message.answer("🚫 Ты заблокирован.")
-        return
-    user = db.get_user(message.from_user.id)
+    user = await db.get_user(message.from_user.id)
     if not user or not user.get("registered"):
         await message.answer("Сначала зарегистрируйся: /start")
         return
-    interests = [i for i in (user.get("interests") or "").split(",") if i]
-    profiles = db.get_matching_profiles(message.from_user.id, interests, limit=2)
+    profiles = await db.get_matching_profiles(message.from_user.id, user.get("interests_mask") or 0, limit=2)
     if not profiles:
         await message.answer("😔 Пока нет подходящих анкет. Попробуй позже или измени интересы в настройках!")
         return
+    # строки ленты уже содержат поля владельца и медиа — без запросов на каждую анкету
     for p in profiles:
-        p_user = db.get_user(p["user_id"])
-        if not p_user:
-            continue
-        await send_profile(bot, message.chat.id, p_user, p, show_actions=True)
+        await send_profile(bot, message.chat.id, p, p, show_actions=True)
 
 # ── Лайк ──────────────────────────────────────────────────────────────────────
 
 @router.callback_query(F.data.startswith("like:"))
 async def like_profile_cb(callback: CallbackQuery):
     profile_id = int(callback.data.split(":")[1])
-    liked = db.like_profile(profile_id, callback.from_user.id)
+    liked = await db.like_profile(profile_id, callback.from_user.id)
 
     # Обновить кнопку
-    conn = db.get_conn()
-    c = conn.cursor()
-    c.execute("SELECT * FROM profiles WHERE id=%s", (profile_id,))
-    cols = [d[0] for d in c.description]
-    row = c.fetchone()
-    conn.close()
-    if row:
-        p = dict(zip(cols, row))
+    p = await db.get_profile(profile_id)
+    if p:
         from keyboards import profile_view_kb
         try:
             await callback.message.edit_reply_markup(
@@ -4,19 +4,14 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import CommandStart
 
-import database as db
-from config import INTERESTS_DISPLAY
+import database_async as db
+from interests import fmt_interests, to_mask, from_mask
 from keyboards import main_kb, gender_kb, interests_kb, settings_kb
 
 router = Router()
 
 GENDER_MAP = {"male": "👦 Парень", "female": "👧 Девушка", "other": "⚧ Другое"}
 
-def fmt_interests(interests_str: str) -> str:
-    if not interests_str:
-        return "—"
-    return ", ".join(INTERESTS_DISPLAY.get(i, i) for i in interests_str.split(",") if i)
-
 # ── FSM ────────────────────────────────────────────────────────────────────────
 
 class Reg(StatesGroup):
@@ -36,14 +31,9 @@ class Sett(StatesGroup):
 @router.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
     await state.clear()
-    if db.is_banned(message.from_user.id):
-        user = db.get_user(message.from_user.id)
-        reason = user.get("ban_reason") or "нарушение правил"
-        await message.answer(f"🚫 Ты заблокирован.\nПричина: {reason}")
-        return
-    user = db.get_user(message.from_user.id)
+    user = await db.get_user(message.from_user.id)
     if user and user.get("registered"):
-        profile = db.get_active_profile(message.from_user.id)
+        profile = await db.get_active_profile(message.from_user.id)
         await message.answer(
             "👋 С возвращением в <b>Beem</b>!\n\nВыбери действие:",
             parse_mode="HTML",
@@ -96,19 +86,19 @@ async def reg_interests(callback: CallbackQuery, state: FSMContext):
         if not selected:
             await callback.answer("Выбери хотя бы один интерес!", show_alert=True)
             return
-        db.upsert_user(
+        await db.upsert_user(
             callback.from_user.id,
             username=callback.from_user.username or "",
             name=data["name"], age=data["age"],
-            gender=data["gender"], interests=",".join(selected),
-            registered=1, created_at=__import__("time").time()
+            gender=data["gender"], interests_mask=to_mask(selected),
+            registered=1, created_at=int(__import__("time").time())
         )
         await state.clear()
         await callback.message.edit_text(
             f"✅ Профиль создан!\n\n"
             f"👤 <b>{data['name']}</b>, {data['age']} лет\n"
             f"Пол: {GENDER_MAP.get(data['gender'])}\n"
-            f"Интересы: {fmt_interests(','.join(selected))}",
+            f"Интересы: {fmt_interests(to_mask(selected))}",
             parse_mode="HTML"
         )
         await callback.message.answer(
@@ -126,11 +116,11 @@ async def reg_interests(callback: CallbackQuery, state: FSMContext):
 
 @router.message(F.text == "⚙️ Настройки")
 async def cmd_settings(message: Message):
-    user = db.get_user(message.from_user.id)
+    user = await db.get_user(message.from_user.id)
     if not user or not user.get("registered"):
         await message.answer("Сначала пройди регистрацию: /start")
         return
-    interests = fmt_interests(user.get("interests", ""))
+    interests = fmt_interests(user.get("interests_mask"))
     await message.answer(
         f"⚙️ <b>Твой профиль</b>\n\n"
         f"👤 Имя: {user['name']}\n"
@@ -155,8 +145,8 @@ async def settings_action(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer("Выбери пол:", reply_markup=gender_kb("setgender"))
         await state.set_state(Sett.gender)
     elif action == "interests":
-        user = db.get_user(callback.from_user.id)
-        sel = user.get("interests", "").split(",") if user.get("interests") else []
+        user = await db.get_user(callback.from_user.id)
+        sel = from_mask(user.get("interests_mask"))
         await state.update_data(interests=sel)
         await callback.message.answer("Выбери интересы:", reply_markup=interests_kb(sel))
         await state.set_state(Sett.interests)
@@ -168,9 +158,9 @@ async def sett_name(message: Message, state: FSMContext):
     if len(name) < 2:
         await message.answer("Слишком коротко:")
         return
-    db.upsert_user(message.from_user.id, name=name)
+    await db.upsert_user(message.from_user.id, name=name)
     await state.clear()
-    profile = db.get_active_profile(message.from_user.id)
+    profile = await db.get_active_profile(message.from_user.id)
     await message.answer(f"✅ Имя изменено: <b>{name}</b>", parse_mode="HTML", reply_markup=main_kb(bool(profile)))
 
 @router.message(Sett.age)
@@ -181,17 +171,17 @@ async def sett_age(message: Message, state: FSMContext):
     except:
         await message.answer("Введи возраст (10–99):")
         return
-    db.upsert_user(message.from_user.id, age=age)
+    await db.upsert_user(message.from_user.id, age=age)
     await state.clear()
-    profile = db.get_active_profile(message.from_user.id)
+    profile = await db.get_active_profile(message.from_user.id)
     await message.answer(f"✅ Возраст изменён: {age}", reply_markup=main_kb(bool(profile)))
 
 @router.callback_query(Sett.gender, F.data.startswith("setgender:"))
 async def sett_gender(callback: CallbackQuery, state: FSMContext):
     gender = callback.data.split(":")[1]
-    db.upsert_user(callback.from_user.id, gender=gender)
+    await db.upsert_user(callback.from_user.id, gender=gender)
     await state.clear()
-    profile = db.get_active_profile(callback.from_user.id)
+    profile = await db.get_active_profile(callback.from_user.id)
     await callback.message.answer("✅ Пол обновлён!", reply_markup=main_kb(bool(profile)))
     await callback.answer()
 
@@ -204,9 +194,9 @@ async def sett_interests(callback: CallbackQuery, state: FSMContext):
         if not selected:
             await callback.answer("Выбери хотя бы один!", show_alert=True)
             return
-        db.upsert_user(callback.from_user.id, interests=",".join(selected))
+        await db.upsert_user(callback.from_user.id, interests_mask=to_mask(selected))
         await state.clear()
-        profile = db.get_active_profile(callback.from_user.id)
+        profile = await db.get_active_profile(callback.from_user.id)
         await callback.message.answer("✅ Интересы обновлены!", reply_markup=main_kb(bool(profile)))
     else:
         if key in selected: selected.remove(key)
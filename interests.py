@@ -0,0 +1,29 @@
+from typing import List, Tuple
+from config import INTERESTS
+
+# Интересы пользователя хранятся битовой маской: бит i — INTERESTS[i].
+# Подписи для всех 2^N масок считаются один раз при импорте.
+
+INTEREST_BITS = {key: 1 << i for i, (_, key) in enumerate(INTERESTS)}
+ALL_INTERESTS_MASK = (1 << len(INTERESTS)) - 1
+
+_LABELS = [
+    tuple(name for i, (name, _) in enumerate(INTERESTS) if mask & (1 << i))
+    for mask in range(ALL_INTERESTS_MASK + 1)
+]
+_DISPLAY = [", ".join(labels) or "—" for labels in _LABELS]
+
+def to_mask(keys) -> int:
+    mask = 0
+    for key in keys:
+        mask |= INTEREST_BITS.get(key, 0)
+    return mask
+
+def from_mask(mask: int) -> List[str]:
+    return [key for key, bit in INTEREST_BITS.items() if (mask or 0) & bit]
+
+def labels(mask: int) -> Tuple[str, ...]:
+    return _LABELS[(mask or 0) & ALL_INTERESTS_MASK]
+
+def fmt_interests(mask: int) -> str:
+    return _DISPLAY[(mask or 0) & ALL_INTERESTS_MASK]
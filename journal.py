@@ -0,0 +1,164 @@
+import time
+import asyncio
+import logging
+from typing import Optional
+
+import asyncpg
+
+import database_async as db
+from config import JOURNAL_MODE, JOURNAL_BATCH_SIZE, JOURNAL_FLUSH_INTERVAL, JOURNAL_MAX_BUFFER
+
+# Журнал сообщений чатов с отложенной записью: relay() кладёт строку в буфер,
+# фоновая задача сбрасывает буфер в messages одним COPY — по размеру пачки
+# или раз в JOURNAL_FLUSH_INTERVAL секунд.
+#
+# Режимы надёжности (JOURNAL_MODE):
+#   write_behind — append не ждёт базу; при падении процесса теряется
+#                  не больше последнего интервала;
+#   group_commit — append ждёт, пока его пачка будет записана (одна транзакция на пачку);
+#   sync         — каждое сообщение отдельным INSERT, как раньше.
+#
+# Если пачка не записалась из-за связи с базой, она возвращается в буфер и ждёт
+# следующего сброса. Если из-за данных (строку не принимает COPY, например NUL в
+# тексте), пачка пишется по одной строке, а битые выбрасываются — иначе одна строка
+# навсегда остановила бы журнал, а за ним, когда буфер заполнится, и пересылку.
+
+MODES = ("write_behind", "group_commit", "sync")
+SHUTDOWN_RETRIES = 5
+
+_buffer = []   # (chat_id, sender_id, content, msg_type, file_id, created_at)
+_waiters = []  # futures group_commit, по одному на строку буфера
+_flush_lock = asyncio.Lock()
+_wakeup: Optional[asyncio.Event] = None
+_task: Optional[asyncio.Task] = None
+_stopping = False
+_stats = {"flushed": 0, "batches": 0, "failures": 0, "dropped": 0}
+
+# ошибки связи и нагрузки на сервере: повтор той же пачки позже пройдёт
+_TRANSIENT = (asyncpg.InterfaceError, asyncpg.PostgresConnectionError, asyncpg.OperatorInterventionError,
+              asyncpg.InsufficientResourcesError, asyncpg.TransactionRollbackError)
+
+if JOURNAL_MODE not in MODES:
+    raise ValueError(f"JOURNAL_MODE должен быть одним из {MODES}, а не {JOURNAL_MODE!r}")
+
+async def append(chat_id: int, sender_id: int, content: str, msg_type: str = "text", file_id: str = None):
+    if JOURNAL_MODE == "sync" or _task is None:
+        await db.add_message(chat_id, sender_id, content, msg_type, file_id)
+        return
+    # база недоступна и буфер переполнен — притормаживаем отправителей, а не растём без предела
+    while len(_buffer) >= JOURNAL_MAX_BUFFER:
+        _wakeup.set()
+        await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+    _buffer.append((chat_id, sender_id, content, msg_type, file_id, int(time.time())))
+    waiter = None
+    if JOURNAL_MODE == "group_commit":
+        waiter = asyncio.get_running_loop().create_future()
+        _waiters.append(waiter)
+    if len(_buffer) >= JOURNAL_BATCH_SIZE:
+        _wakeup.set()
+    if waiter is not None:
+        await waiter
+
+def _is_data_error(e: BaseException) -> bool:
+    """Ошибка в самих строках: сколько ни повторяй, пачка не запишется."""
+    return isinstance(e, (asyncpg.PostgresError, TypeError, ValueError)) and not isinstance(e, _TRANSIENT)
+
+def _requeue(rows: list, waiters: list):
+    _buffer[:0] = rows
+    _waiters[:0] = [waiter for waiter in waiters if waiter is not None]
+    _stats["failures"] += 1
+
+def _resolve(waiter: Optional[asyncio.Future], error: BaseException = None):
+    if waiter is None or waiter.done():
+        return
+    if error is None:
+        waiter.set_result(None)
+    else:
+        waiter.set_exception(error)
+
+async def _flush_rows(rows: list, waiters: list) -> int:
+    """Пачка с битыми данными: пишет строки по одной и выбрасывает те, что не принимает база."""
+    written = 0
+    for i, (row, waiter) in enumerate(zip(rows, waiters)):
+        try:
+            await db.add_messages([row])
+        except BaseException as e:
+            if not _is_data_error(e):
+                _requeue(rows[i:], waiters[i:])
+                raise
+            _stats["dropped"] += 1
+            logging.error(f"📝 Журнал: сообщение в чат {row[0]} от {row[1]} не записано и выброшено ({e!r})")
+            _resolve(waiter, e)
+            continue
+        written += 1
+        _resolve(waiter)
+    return written
+
+async def flush() -> int:
+    """Записывает буфер в базу. При ошибке связи строки возвращаются в начало буфера."""
+    global _buffer, _waiters
+    async with _flush_lock:
+        if not _buffer:
+            return 0
+        rows, waiters = _buffer, _waiters
+        _buffer, _waiters = [], []
+        if len(waiters) != len(rows):
+            waiters = [None] * len(rows)  # write_behind: никто не ждёт
+        try:
+            await db.add_messages(rows)
+            written = len(rows)
+            for waiter in waiters:
+                _resolve(waiter)
+        except BaseException as e:
+            if not _is_data_error(e):
+                _requeue(rows, waiters)
+                raise
+            written = await _flush_rows(rows, waiters)
+        _stats["flushed"] += written
+        _stats["batches"] += 1
+        return written
+
+async def _flush_forever():
+    while not _stopping:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), JOURNAL_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            await flush()
+        except Exception as e:
+            logging.warning(f"📝 Журнал: не удалось записать {len(_buffer)} сообщений ({e}), повтор")
+
+async def start():
+    global _task, _wakeup, _stopping
+    if _task is None and JOURNAL_MODE != "sync":
+        _stopping = False
+        _wakeup = asyncio.Event()
+        _task = asyncio.create_task(_flush_forever())
+
+async def stop():
+    """Останавливает фоновую запись и дописывает остаток буфера (до закрытия пула)."""
+    global _task, _stopping
+    if _task is None:
+        return
+    # без cancel(): прерванный на середине COPY оставляет соединение пула в подвешенном состоянии
+    _stopping = True
+    _wakeup.set()
+    await _task
+    _task = None
+    for attempt in range(SHUTDOWN_RETRIES):
+        try:
+            await flush()
+            break
+        except Exception as e:
+            logging.warning(f"📝 Журнал: сброс при остановке не удался ({e}), попытка {attempt + 1}")
+            await asyncio.sleep(1)
+    if _buffer:
+        logging.error(f"📝 Журнал: потеряно {len(_buffer)} сообщений при остановке")
+        for waiter in _waiters:
+            if not waiter.done():
+                waiter.set_exception(RuntimeError("журнал остановлен"))
+
+def stats() -> dict:
+    return {"mode": JOURNAL_MODE, "buffered": len(_buffer), **_stats}
@@ -2,7 +2,7 @@ from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton,
     InlineKeyboardMarkup, InlineKeyboardButton
 )
-from config import INTERESTS, INTERESTS_DISPLAY
+from config import INTERESTS, INTERESTS_DISPLAY, REPORT_REASONS
 
 def main_kb(has_profile: bool = False) -> ReplyKeyboardMarkup:
     rows = [
@@ -43,13 +43,8 @@ def chat_kb(chat_id: int) -> InlineKeyboardMarkup:
     ])
 
 def report_reason_kb(chat_id: int) -> InlineKeyboardMarkup:
-    reasons = [
-        ("🔞 Нежелательный контент", "nsfw"),
-        ("💬 Спам", "spam"),
-        ("😡 Оскорбления", "abuse"),
-        ("🤖 Бот/скам", "scam"),
-    ]
-    rows = [[InlineKeyboardButton(text=r[0], callback_data=f"reportreason:{chat_id}:{r[1]}")] for r in reasons]
+    rows = [[InlineKeyboardButton(text=label, callback_data=f"reportreason:{chat_id}:{key}")]
+            for key, label in REPORT_REASONS.items()]
     rows.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
@@ -70,12 +65,37 @@ def admin_ban_kb(user_id: int) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="✅ Разбанить", callback_data=f"unban:{user_id}")],
     ])
 
-def my_chats_kb(chats: list, user_id: int) -> InlineKeyboardMarkup:
+def pager_rows(prefix: str, page) -> list:
+    """Ряд кнопок ◀️/▶️ для pagination.Page (или пусто); callback_data — "<prefix>:b|a:<курсор>"."""
+    row = []
+    if page.prev:
+        row.append(InlineKeyboardButton(text="◀️", callback_data=f"{prefix}:b:{page.prev}"))
+    if page.next:
+        row.append(InlineKeyboardButton(text="▶️ Ещё", callback_data=f"{prefix}:a:{page.next}"))
+    return [row] if row else []
+
+def my_chats_kb(chats, user_id: int) -> InlineKeyboardMarkup:
     rows = []
-    for c in chats[:15]:
+    for c in chats:
         role = "📨" if c["sender_id"] == user_id else "📬"
         rows.append([InlineKeyboardButton(
             text=f"{role} Чат #{c['id']}",
             callback_data=f"openchatid:{c['id']}"
         )])
+    rows += pager_rows("mychats", chats)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def broadcast_kb(broadcast: dict) -> InlineKeyboardMarkup:
+    """Управление рассылкой в зависимости от её статуса."""
+    bid, status = broadcast["id"], broadcast["status"]
+    row = []
+    if status == "running":
+        row.append(InlineKeyboardButton(text="⏸ Пауза", callback_data=f"adm:bc:pause:{bid}"))
+    elif status == "paused":
+        row.append(InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"adm:bc:resume:{bid}"))
+    if status in ("running", "paused"):
+        row.append(InlineKeyboardButton(text="⛔ Отменить", callback_data=f"adm:bc:cancel:{bid}"))
+    rows = [row] if row else []
+    rows.append([InlineKeyboardButton(text="🔄 Обновить", callback_data=f"adm:bc:show:{bid}"),
+                 InlineKeyboardButton(text="◀️ Рассылки", callback_data="adm:broadcast")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
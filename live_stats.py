@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import events
+import database_async as db
+from config import LIVE_STATS_INTERVAL
+
+# Один продюсер живой статистики на процесс: просыпается по уведомлениям "stats"
+# от триггеров счётчиков, раз в LIVE_STATS_INTERVAL читает таблицу stats и
+# раздаёт подписчикам (SSE-соединениям дашборда) только изменившиеся счётчики.
+# Сколько бы вкладок ни было открыто, в базу идёт не больше одного запроса за интервал.
+
+QUEUE_SIZE = 16
+
+_clients = set()                     # asyncio.Queue на каждое соединение
+_changed: Optional[asyncio.Event] = None
+_task: Optional[asyncio.Task] = None
+_last: Dict[str, int] = {}
+_stopping = False
+
+def _mark(key: str = ""):
+    if _changed is not None:
+        _changed.set()
+
+events.subscribe("stats", _mark)
+events.subscribe("resync", _mark)
+
+def _close(queue: asyncio.Queue):
+    _clients.discard(queue)
+    if queue.full():
+        queue.get_nowait()  # освобождаем место под сигнал закрытия
+    queue.put_nowait(None)
+
+def _publish(message):
+    for queue in list(_clients):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # клиент не успевает читать — закрываем, EventSource переподключится и получит снимок
+            _close(queue)
+
+async def _produce_forever():
+    global _last
+    while not _stopping:
+        await _changed.wait()
+        await asyncio.sleep(LIVE_STATS_INTERVAL)  # копим изменения за интервал
+        _changed.clear()
+        if _stopping or not _clients:
+            continue
+        try:
+            stats = await db.get_stats()
+        except Exception:
+            logging.exception("live_stats: не удалось прочитать счётчики")
+            _changed.set()
+            continue
+        delta = {k: v for k, v in stats.items() if _last.get(k) != v}
+        _last = stats
+        if delta:
+            _publish(delta)
+
+async def snapshot() -> Dict[str, int]:
+    """Все счётчики для нового соединения; первый снимок становится точкой отсчёта дельт."""
+    global _last
+    stats = await db.get_stats()
+    if not _last:
+        _last = stats
+    return stats
+
+@asynccontextmanager
+async def subscribe():
+    """Очередь изменений счётчиков (dict) для одного соединения; None — соединение пора закрыть."""
+    queue = asyncio.Queue(QUEUE_SIZE)
+    _clients.add(queue)
+    try:
+        yield queue
+    finally:
+        _clients.discard(queue)
+
+async def start():
+    global _changed, _task, _stopping
+    if _task is None:
+        _stopping = False
+        _changed = asyncio.Event()
+        _task = asyncio.create_task(_produce_forever())
+
+async def stop():
+    """Останавливает продюсер и закрывает все подписки."""
+    global _task, _stopping
+    for queue in list(_clients):
+        _close(queue)
+    if _task is not None:
+        # флаг вместо cancel(): отмена посреди запроса к пулу может потеряться
+        _stopping = True
+        _changed.set()
+        await _task
+        _task = None
@@ -1,23 +1,21 @@
-import threading
+import asyncio
 import logging
 import database as db
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
-# Init DB
+# Init DB (миграции через синхронный слой, дальше он не нужен)
 db.init_db()
+db.pool.closeall()
 logging.info("✅ База данных инициализирована")
 
-# Run web panel in background thread
-def start_web():
-    from web import run_web
-    run_web()
+from config import BOT_WORKERS
 
-t = threading.Thread(target=start_web, daemon=True)
-t.start()
-logging.info("✅ Веб-панель запущена на порту 5000")
-
-# Run bot (blocking)
 logging.info("✅ Запуск бота...")
-import subprocess
-subprocess.run(["python", "bot.py"])
+if BOT_WORKERS > 1:
+    # ingress с панелью и рассылками + BOT_WORKERS процессов bot.py, апдейты делятся по user_id
+    from workers import main
+else:
+    # бот и веб-панель — один процесс, один event loop
+    from bot import main
+asyncio.run(main())
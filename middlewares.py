@@ -0,0 +1,47 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import ADMIN_IDS
+import database_async as db
+import outbox
+
+BANNED_TEXT = "🚫 Ты заблокирован.\nПричина: {reason}"
+
+class BanMiddleware(BaseMiddleware):
+    """Отбрасывает апдейты забаненных пользователей по списку банов в памяти — без запросов в базу."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id in ADMIN_IDS:
+            return await handler(event, data)
+        ban = db.bans.get(user.id)
+        if ban is None:
+            return await handler(event, data)
+        text = BANNED_TEXT.format(reason=ban[1] or "нарушение правил")
+        if event.message is not None and event.message.chat.type == "private":
+            await event.message.answer(text)
+        elif event.callback_query is not None:
+            await event.callback_query.answer(text, show_alert=True)
+        return None
+
+class PriorityMiddleware(BaseMiddleware):
+    """Отправки из хендлеров роутера идут через outbox с приоритетом level."""
+
+    def __init__(self, level: int):
+        self.level = level
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        with outbox.priority(self.level):
+            return await handler(event, data)
@@ -0,0 +1,700 @@
+import sys
+import json
+import time
+import inspect
+import logging
+import psycopg2
+import psycopg2.extensions
+
+import database as db
+
+# Версионированные миграции схемы. Каждая миграция — (версия, имя, [SQL]),
+# применяется в своей транзакции и записывается в schema_migrations.
+# Новые миграции только добавляются в конец списка, старые не редактируются.
+
+def _stats_triggers(table: str, key: str, cond: str = None) -> list:
+    """Триггеры счётчика stats[key] — число строк table, удовлетворяющих cond."""
+    args = f"'{key}'" + (f", '{cond}'" if cond else "")
+    refs = {"INSERT": "NEW TABLE AS new_rows",
+            "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+            "DELETE": "OLD TABLE AS old_rows"}
+    # без условия UPDATE не меняет число строк
+    ops = ("INSERT", "UPDATE", "DELETE") if cond else ("INSERT", "DELETE")
+    return [
+        f"""CREATE TRIGGER {table}_stats_{op.lower()} AFTER {op} ON {table}
+            REFERENCING {refs[op]} FOR EACH STATEMENT EXECUTE FUNCTION stats_count({args})"""
+        for op in ops
+    ]
+
+MIGRATIONS = [
+    (1, "base schema", [
+        """CREATE TABLE IF NOT EXISTS users (
+            user_id     BIGINT PRIMARY KEY,
+            username    TEXT,
+            name        TEXT,
+            age         INTEGER,
+            gender      TEXT,
+            interests   TEXT,
+            search_gender TEXT DEFAULT 'any',
+            registered  INTEGER DEFAULT 0,
+            banned      INTEGER DEFAULT 0,
+            ban_until   BIGINT,
+            ban_reason  TEXT,
+            created_at  BIGINT DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS profiles (
+            id          SERIAL PRIMARY KEY,
+            user_id     BIGINT,
+            description TEXT,
+            created_at  BIGINT,
+            active      INTEGER DEFAULT 1,
+            likes       INTEGER DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS profile_likes (
+            id          SERIAL PRIMARY KEY,
+            profile_id  INTEGER,
+            liker_id    BIGINT,
+            created_at  BIGINT,
+            UNIQUE(profile_id, liker_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS profile_media (
+            id          SERIAL PRIMARY KEY,
+            profile_id  INTEGER,
+            file_id     TEXT,
+            media_type  TEXT,
+            created_at  BIGINT
+        )""",
+        """CREATE TABLE IF NOT EXISTS chats (
+            id          SERIAL PRIMARY KEY,
+            profile_id  INTEGER,
+            sender_id   BIGINT,
+            target_id   BIGINT,
+            created_at  BIGINT
+        )""",
+        """CREATE TABLE IF NOT EXISTS messages (
+            id          SERIAL PRIMARY KEY,
+            chat_id     INTEGER,
+            sender_id   BIGINT,
+            content     TEXT,
+            msg_type    TEXT DEFAULT 'text',
+            file_id     TEXT,
+            created_at  BIGINT
+        )""",
+        """CREATE TABLE IF NOT EXISTS reports (
+            id          SERIAL PRIMARY KEY,
+            chat_id     INTEGER,
+            reporter_id BIGINT,
+            reported_id BIGINT,
+            reason      TEXT,
+            status      TEXT DEFAULT 'new',
+            created_at  BIGINT
+        )""",
+        """CREATE TABLE IF NOT EXISTS blocks (
+            id          SERIAL PRIMARY KEY,
+            blocker_id  BIGINT,
+            blocked_id  BIGINT,
+            created_at  BIGINT,
+            UNIQUE(blocker_id, blocked_id)
+        )""",
+    ]),
+    (2, "hot path indexes", [
+        "CREATE INDEX IF NOT EXISTS profiles_user_active_idx ON profiles (user_id, active)",
+        "CREATE INDEX IF NOT EXISTS profile_media_profile_idx ON profile_media (profile_id, id)",
+        "CREATE INDEX IF NOT EXISTS messages_chat_created_idx ON messages (chat_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS chats_sender_idx ON chats (sender_id)",
+        "CREATE INDEX IF NOT EXISTS chats_target_idx ON chats (target_id)",
+        "CREATE INDEX IF NOT EXISTS chats_profile_sender_idx ON chats (profile_id, sender_id)",
+        "CREATE INDEX IF NOT EXISTS reports_status_created_idx ON reports (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS blocks_blocked_idx ON blocks (blocked_id)",
+    ]),
+    (3, "random feed sampling key", [
+        "ALTER TABLE profiles ADD COLUMN IF NOT EXISTS rand_key DOUBLE PRECISION NOT NULL DEFAULT random()",
+        "CREATE INDEX IF NOT EXISTS profiles_active_rand_idx ON profiles (rand_key) WHERE active=1",
+    ]),
+    (4, "interests bitmask", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS interests_mask INTEGER NOT NULL DEFAULT 0",
+        # бит i = позиция ключа в config.INTERESTS на момент миграции
+        """UPDATE users u SET interests_mask = COALESCE((
+            SELECT bit_or(1 << (array_position(keys, k) - 1))
+            FROM unnest(string_to_array(u.interests, ',')) AS k,
+                 (SELECT ARRAY['games','flirt','adult','anime','talk',
+                               'music','movies','travel','photo','sport']::text[] AS keys) AS ks
+            WHERE array_position(keys, k) IS NOT NULL
+        ), 0)
+        WHERE u.interests IS NOT NULL AND u.interests <> ''""",
+        "ALTER TABLE users DROP COLUMN IF EXISTS interests",
+    ]),
+    (5, "banned users index", [
+        # список банов при старте бота и зачистка истёкших
+        "CREATE INDEX IF NOT EXISTS users_banned_until_idx ON users (ban_until) WHERE banned=1",
+    ]),
+    (6, "unique chat per profile and sender", [
+        # дубли чатов из-за гонки SELECT → INSERT: сообщения и жалобы переносим в самый ранний
+        """CREATE TEMP TABLE chat_dups ON COMMIT DROP AS
+           SELECT id, keep FROM (
+               SELECT id, min(id) OVER (PARTITION BY profile_id, sender_id) AS keep FROM chats
+           ) d WHERE id <> keep""",
+        "UPDATE messages m SET chat_id = d.keep FROM chat_dups d WHERE m.chat_id = d.id",
+        "UPDATE reports r SET chat_id = d.keep FROM chat_dups d WHERE r.chat_id = d.id",
+        "DELETE FROM chats c USING chat_dups d WHERE c.id = d.id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS chats_profile_sender_key ON chats (profile_id, sender_id)",
+        "DROP INDEX IF EXISTS chats_profile_sender_idx",
+    ]),
+    (7, "stats counters", [
+        """CREATE TABLE IF NOT EXISTS stats (
+            key         TEXT PRIMARY KEY,
+            value       BIGINT NOT NULL DEFAULT 0
+        )""",
+        # statement-level: пачка сообщений из журнала — одно обновление счётчика, а не по строке.
+        # TG_ARGV: ключ в stats и условие, при котором строка учитывается
+        """CREATE OR REPLACE FUNCTION stats_count() RETURNS trigger AS $$
+        DECLARE
+            cond  TEXT := coalesce(TG_ARGV[1], 'true');
+            delta BIGINT := 0;
+            n     BIGINT;
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                EXECUTE format('SELECT count(*) FROM new_rows WHERE %s', cond) INTO n;
+                delta := delta + n;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                EXECUTE format('SELECT count(*) FROM old_rows WHERE %s', cond) INTO n;
+                delta := delta - n;
+            END IF;
+            IF delta <> 0 THEN
+                UPDATE stats SET value = value + delta WHERE key = TG_ARGV[0];
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+        *_stats_triggers("users", "users", "registered=1"),
+        *_stats_triggers("profiles", "profiles", "active=1"),
+        *_stats_triggers("chats", "chats"),
+        *_stats_triggers("messages", "messages"),
+        *_stats_triggers("reports", "reports", "status=''new''"),
+        # CREATE TRIGGER держит блокировку таблиц до конца транзакции — счёт не разойдётся с записью
+        """INSERT INTO stats (key, value)
+           SELECT 'users', count(*) FROM users WHERE registered=1
+           UNION ALL SELECT 'profiles', count(*) FROM profiles WHERE active=1
+           UNION ALL SELECT 'chats', count(*) FROM chats
+           UNION ALL SELECT 'messages', count(*) FROM messages
+           UNION ALL SELECT 'reports', count(*) FROM reports WHERE status='new'
+           ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value""",
+    ]),
+    (8, "chat summary columns", [
+        """ALTER TABLE chats
+               ADD COLUMN IF NOT EXISTS message_count        INTEGER NOT NULL DEFAULT 0,
+               ADD COLUMN IF NOT EXISTS last_message_at      BIGINT,
+               ADD COLUMN IF NOT EXISTS last_message_preview TEXT,
+               ADD COLUMN IF NOT EXISTS last_sender_id       BIGINT""",
+        # одна пачка вставок — одно обновление на чат; последнее — по (created_at, id)
+        """CREATE OR REPLACE FUNCTION chats_summary_insert() RETURNS trigger AS $$
+        BEGIN
+            UPDATE chats c SET
+                message_count = c.message_count + n.cnt,
+                last_message_at = CASE WHEN n.created_at >= coalesce(c.last_message_at, 0)
+                                       THEN n.created_at ELSE c.last_message_at END,
+                last_message_preview = CASE WHEN n.created_at >= coalesce(c.last_message_at, 0)
+                                            THEN n.preview ELSE c.last_message_preview END,
+                last_sender_id = CASE WHEN n.created_at >= coalesce(c.last_message_at, 0)
+                                      THEN n.sender_id ELSE c.last_sender_id END
+            FROM (
+                SELECT DISTINCT ON (chat_id) chat_id, created_at, sender_id, left(content, 100) AS preview,
+                       count(*) OVER (PARTITION BY chat_id) AS cnt
+                FROM new_rows
+                ORDER BY chat_id, created_at DESC, id DESC
+            ) n
+            WHERE c.id = n.chat_id;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+        # удаление сообщений — редкая админская операция, пересчитываем затронутые чаты целиком
+        """CREATE OR REPLACE FUNCTION chats_summary_delete() RETURNS trigger AS $$
+        BEGIN
+            UPDATE chats c SET
+                message_count = (SELECT count(*) FROM messages m WHERE m.chat_id = c.id),
+                last_message_at = l.created_at,
+                last_message_preview = left(l.content, 100),
+                last_sender_id = l.sender_id
+            FROM (SELECT DISTINCT chat_id FROM old_rows) d
+            LEFT JOIN LATERAL (
+                SELECT created_at, content, sender_id FROM messages m
+                WHERE m.chat_id = d.chat_id ORDER BY created_at DESC, id DESC LIMIT 1
+            ) l ON true
+            WHERE c.id = d.chat_id;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+        """CREATE TRIGGER messages_chat_summary_insert AFTER INSERT ON messages
+           REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION chats_summary_insert()""",
+        """CREATE TRIGGER messages_chat_summary_delete AFTER DELETE ON messages
+           REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION chats_summary_delete()""",
+        # CREATE TRIGGER блокирует вставки в messages до конца транзакции — бэкфилл не разойдётся
+        """UPDATE chats c SET
+               message_count = s.cnt,
+               last_message_at = s.created_at,
+               last_message_preview = left(s.content, 100),
+               last_sender_id = s.sender_id
+           FROM (
+               SELECT DISTINCT ON (chat_id) chat_id, created_at, content, sender_id,
+                      count(*) OVER (PARTITION BY chat_id) AS cnt
+               FROM messages
+               ORDER BY chat_id, created_at DESC, id DESC
+           ) s
+           WHERE c.id = s.chat_id""",
+    ]),
+    (9, "keyset pagination indexes", [
+        # списки в админке листаются по (created_at, id) — страница читается прямо из индекса
+        "CREATE INDEX IF NOT EXISTS users_registered_created_idx ON users (created_at, user_id) WHERE registered=1",
+        "CREATE INDEX IF NOT EXISTS profiles_active_created_idx ON profiles (created_at, id) WHERE active=1",
+        "CREATE INDEX IF NOT EXISTS chats_created_idx ON chats (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS reports_created_idx ON reports (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS reports_status_created_id_idx ON reports (status, created_at, id)",
+        "DROP INDEX IF EXISTS reports_status_created_idx",
+        # чаты пользователя по id: (sender_id, id) и (target_id, id) вместо одиночных
+        "CREATE INDEX IF NOT EXISTS chats_sender_id_idx ON chats (sender_id, id)",
+        "CREATE INDEX IF NOT EXISTS chats_target_id_idx ON chats (target_id, id)",
+        "DROP INDEX IF EXISTS chats_sender_idx",
+        "DROP INDEX IF EXISTS chats_target_idx",
+    ]),
+    (10, "user search indexes", [
+        # поиск в админке: подстрока имени/username через trigram GIN (выражение совпадает с
+        # database._USER_SEARCH_TEXT), префикс user_id — через btree по тексту.
+        # Без pg_trgm на сервере миграция проходит, поиск по имени работает без индекса.
+        """DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            END IF;
+            IF EXISTS (SELECT 1 FROM pg_opclass WHERE opcname = 'gin_trgm_ops' AND pg_opclass_is_visible(oid)) THEN
+                CREATE INDEX IF NOT EXISTS users_search_trgm_idx ON users
+                    USING gin ((lower(coalesce(name, '') || ' ' || coalesce(username, ''))) gin_trgm_ops);
+            ELSE
+                RAISE WARNING 'pg_trgm недоступен: поиск пользователей по имени без индекса';
+            END IF;
+        END $$""",
+        "CREATE INDEX IF NOT EXISTS users_id_text_idx ON users ((user_id::text) text_pattern_ops)",
+    ]),
+    (11, "stats change notifications", [
+        # как в миграции 7, плюс уведомление "stats:<key>" в канал events (живой дашборд).
+        # Одинаковые NOTIFY в транзакции Postgres схлопывает, доставка — после COMMIT
+        """CREATE OR REPLACE FUNCTION stats_count() RETURNS trigger AS $$
+        DECLARE
+            cond  TEXT := coalesce(TG_ARGV[1], 'true');
+            delta BIGINT := 0;
+            n     BIGINT;
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                EXECUTE format('SELECT count(*) FROM new_rows WHERE %s', cond) INTO n;
+                delta := delta + n;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                EXECUTE format('SELECT count(*) FROM old_rows WHERE %s', cond) INTO n;
+                delta := delta - n;
+            END IF;
+            IF delta <> 0 THEN
+                UPDATE stats SET value = value + delta WHERE key = TG_ARGV[0];
+                PERFORM pg_notify('beem_events', 'stats:' || TG_ARGV[0] || ':-');
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+    ]),
+    (12, "message transcript cursor index", [
+        # переписка листается по (created_at, id) — id различает сообщения одной секунды
+        "CREATE INDEX IF NOT EXISTS messages_chat_created_id_idx ON messages (chat_id, created_at, id)",
+        "DROP INDEX IF EXISTS messages_chat_created_idx",
+    ]),
+    (13, "report queue", [
+        # очередь модерации: строка на пользователя с открытыми жалобами
+        """CREATE TABLE IF NOT EXISTS report_queue (
+            reported_id     BIGINT PRIMARY KEY,
+            open_count      INTEGER NOT NULL,
+            first_at        BIGINT,
+            last_at         BIGINT,
+            last_report_id  INTEGER,
+            last_chat_id    INTEGER,
+            reasons         JSONB NOT NULL DEFAULT '{}'
+        )""",
+        "CREATE INDEX IF NOT EXISTS report_queue_order_idx ON report_queue (open_count, last_at, reported_id)",
+        "CREATE INDEX IF NOT EXISTS reports_open_reported_idx ON reports (reported_id, created_at, id) WHERE status='new'",
+        # пересчёт строк очереди только для затронутых пользователей — по частичному индексу открытых жалоб
+        """CREATE OR REPLACE FUNCTION report_queue_sync(ids BIGINT[]) RETURNS void AS $$
+            DELETE FROM report_queue q
+            WHERE q.reported_id = ANY(ids)
+              AND NOT EXISTS (SELECT 1 FROM reports r WHERE r.reported_id = q.reported_id AND r.status = 'new');
+            INSERT INTO report_queue (reported_id, open_count, first_at, last_at, last_report_id, last_chat_id, reasons)
+            SELECT g.reported_id, g.cnt, g.first_at, g.last_at, l.id, l.chat_id, rs.reasons
+            FROM (
+                SELECT reported_id, count(*) AS cnt, min(created_at) AS first_at, max(created_at) AS last_at
+                FROM reports WHERE reported_id = ANY(ids) AND status = 'new'
+                GROUP BY reported_id
+            ) g
+            CROSS JOIN LATERAL (
+                SELECT r.id, r.chat_id FROM reports r
+                WHERE r.reported_id = g.reported_id AND r.status = 'new'
+                ORDER BY r.created_at DESC, r.id DESC LIMIT 1
+            ) l
+            CROSS JOIN LATERAL (
+                SELECT jsonb_object_agg(reason, n) AS reasons FROM (
+                    SELECT coalesce(r.reason, '') AS reason, count(*) AS n FROM reports r
+                    WHERE r.reported_id = g.reported_id AND r.status = 'new'
+                    GROUP BY 1
+                ) x
+            ) rs
+            ON CONFLICT (reported_id) DO UPDATE SET
+                open_count = EXCLUDED.open_count, first_at = EXCLUDED.first_at, last_at = EXCLUDED.last_at,
+                last_report_id = EXCLUDED.last_report_id, last_chat_id = EXCLUDED.last_chat_id,
+                reasons = EXCLUDED.reasons;
+        $$ LANGUAGE sql""",
+        """CREATE OR REPLACE FUNCTION report_queue_refresh() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM report_queue_sync(ARRAY(SELECT DISTINCT reported_id FROM new_rows));
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM report_queue_sync(ARRAY(SELECT DISTINCT reported_id FROM old_rows));
+            ELSE
+                PERFORM report_queue_sync(ARRAY(SELECT reported_id FROM new_rows
+                                                UNION SELECT reported_id FROM old_rows));
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+        """CREATE TRIGGER reports_queue_insert AFTER INSERT ON reports
+           REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION report_queue_refresh()""",
+        """CREATE TRIGGER reports_queue_update AFTER UPDATE ON reports
+           REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION report_queue_refresh()""",
+        """CREATE TRIGGER reports_queue_delete AFTER DELETE ON reports
+           REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION report_queue_refresh()""",
+        "SELECT report_queue_sync(ARRAY(SELECT DISTINCT reported_id FROM reports WHERE status = 'new'))",
+    ]),
+    (14, "broadcast jobs", [
+        # рассылка идёт по users в порядке user_id; last_user_id — до кого включительно уже отправлено
+        """CREATE TABLE IF NOT EXISTS broadcasts (
+            id                  SERIAL PRIMARY KEY,
+            admin_id            BIGINT NOT NULL,
+            text                TEXT NOT NULL,
+            status              TEXT NOT NULL DEFAULT 'running',
+            last_user_id        BIGINT NOT NULL DEFAULT 0,
+            total               INTEGER NOT NULL DEFAULT 0,
+            sent                INTEGER NOT NULL DEFAULT 0,
+            blocked             INTEGER NOT NULL DEFAULT 0,
+            failed              INTEGER NOT NULL DEFAULT 0,
+            progress_chat_id    BIGINT,
+            progress_message_id BIGINT,
+            created_at          BIGINT,
+            updated_at          BIGINT,
+            finished_at         BIGINT
+        )""",
+        "CREATE INDEX IF NOT EXISTS broadcasts_running_idx ON broadcasts (id) WHERE status='running'",
+    ]),
+    (15, "fsm storage", [
+        # состояния aiogram FSM; key — StorageKey в виде "bot/chat/user/thread/business/destiny"
+        """CREATE TABLE IF NOT EXISTS fsm_states (
+            key         TEXT PRIMARY KEY,
+            state       TEXT,
+            data        JSONB NOT NULL DEFAULT '{}',
+            updated_at  BIGINT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS fsm_states_updated_idx ON fsm_states (updated_at)",
+    ]),
+    (16, "report queue per-user lock", [
+        # две транзакции с жалобами на одного пользователя пересчитывали его строку каждая
+        # по своему снимку, и последняя затирала жалобу первой. Теперь пересчёт сначала
+        # берёт advisory-блокировки до конца транзакции и лишь затем читает reports:
+        # функция VOLATILE, так что каждый её запрос видит всё, что успел закоммитить
+        # державший блокировку. Обычный запрос блокирует очередь разделяемо и своих
+        # пользователей по одному (в порядке ключей — без взаимоблокировок); массовый
+        # (больше 32 пользователей) — всю очередь целиком, чтобы не исчерпать таблицу блокировок.
+        """CREATE OR REPLACE FUNCTION report_queue_sync(ids BIGINT[]) RETURNS void AS $$
+            SELECT CASE WHEN cardinality(ids) > 32
+                        THEN pg_advisory_xact_lock(hashtext('beem_report_queue'))
+                        ELSE pg_advisory_xact_lock_shared(hashtext('beem_report_queue')) END;
+            SELECT pg_advisory_xact_lock(hashtext('beem_report_queue'), k)
+            FROM (SELECT DISTINCT hashint8(id) AS k FROM unnest(ids) id ORDER BY 1) s
+            WHERE cardinality(ids) <= 32;
+            DELETE FROM report_queue q
+            WHERE q.reported_id = ANY(ids)
+              AND NOT EXISTS (SELECT 1 FROM reports r WHERE r.reported_id = q.reported_id AND r.status = 'new');
+            INSERT INTO report_queue (reported_id, open_count, first_at, last_at, last_report_id, last_chat_id, reasons)
+            SELECT g.reported_id, g.cnt, g.first_at, g.last_at, l.id, l.chat_id, rs.reasons
+            FROM (
+                SELECT reported_id, count(*) AS cnt, min(created_at) AS first_at, max(created_at) AS last_at
+                FROM reports WHERE reported_id = ANY(ids) AND status = 'new'
+                GROUP BY reported_id
+            ) g
+            CROSS JOIN LATERAL (
+                SELECT r.id, r.chat_id FROM reports r
+                WHERE r.reported_id = g.reported_id AND r.status = 'new'
+                ORDER BY r.created_at DESC, r.id DESC LIMIT 1
+            ) l
+            CROSS JOIN LATERAL (
+                SELECT jsonb_object_agg(reason, n) AS reasons FROM (
+                    SELECT coalesce(r.reason, '') AS reason, count(*) AS n FROM reports r
+                    WHERE r.reported_id = g.reported_id AND r.status = 'new'
+                    GROUP BY 1
+                ) x
+            ) rs
+            ON CONFLICT (reported_id) DO UPDATE SET
+                open_count = EXCLUDED.open_count, first_at = EXCLUDED.first_at, last_at = EXCLUDED.last_at,
+                last_report_id = EXCLUDED.last_report_id, last_chat_id = EXCLUDED.last_chat_id,
+                reasons = EXCLUDED.reasons;
+        $$ LANGUAGE sql VOLATILE""",
+    ]),
+]
+
+def _ensure_table(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+        version     INTEGER PRIMARY KEY,
+        name        TEXT,
+        applied_at  BIGINT
+    )""")
+
+def applied_versions() -> set:
+    with db.get_conn() as conn:
+        c = conn.cursor()
+        _ensure_table(c)
+        c.execute("SELECT version FROM schema_migrations")
+        return {r[0] for r in c.fetchall()}
+
+def migrate() -> list:
+    """Применяет все ещё не применённые миграции, возвращает их версии."""
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        with db.get_conn() as conn:
+            c = conn.cursor()
+            # один мигратор за раз, даже если стартуют несколько процессов
+            c.execute("SELECT pg_advisory_xact_lock(hashtext('beem_schema_migrations'))")
+            _ensure_table(c)
+            c.execute("SELECT 1 FROM schema_migrations WHERE version=%s", (version,))
+            if c.fetchone():
+                continue
+            for sql in statements:
+                c.execute(sql)
+            c.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s,%s,%s)",
+                (version, name, int(time.time()))
+            )
+        logging.info(f"🗄 Миграция {version} применена: {name}")
+        applied.append(version)
+    return applied
+
+# ── Check mode ─────────────────────────────────────────────────────────────────
+# Разворачивает схему во временной схеме Postgres, наполняет её данными,
+# вызывает каждую функцию database.py и делает EXPLAIN всех её запросов,
+# а также запросов database_async, у которых нет двойника в database.py.
+# Если запрос из горячего пути планируется через Seq Scan — проверка падает.
+
+CHECK_SCHEMA = "beem_explain_check"
+
+_traced = []
+
+class _TracingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        _traced.append(self.mogrify(query, vars).decode())
+        return super().execute(query, vars)
+
+SEED_SQL = [
+    """INSERT INTO users (user_id, username, name, age, gender, interests_mask, registered, banned, created_at)
+       SELECT g, 'user' || g, 'Name ' || g, 18 + g % 40,
+              (ARRAY['male','female','other'])[1 + g % 3],
+              (ARRAY[33, 2, 24, 192, 768])[1 + g % 5],
+              1, (g % 50 = 0)::int, 1700000000 + g
+       FROM generate_series(1, 20000) g""",
+    """INSERT INTO profiles (user_id, description, created_at, active, likes)
+       SELECT 1 + g % 20000, 'profile ' || g, 1700000000 + g, (g > 60000)::int, g % 7
+       FROM generate_series(1, 80000) g""",
+    """INSERT INTO profile_media (profile_id, file_id, media_type, created_at)
+       SELECT 1 + g % 80000, 'file' || g, (ARRAY['photo','video','voice'])[1 + g % 3], 1700000000 + g
+       FROM generate_series(1, 80000) g""",
+    """INSERT INTO profile_likes (profile_id, liker_id, created_at)
+       SELECT 1 + g % 80000, 1 + (g * 7) % 20000, 1700000000 + g
+       FROM generate_series(1, 20000) g
+       ON CONFLICT DO NOTHING""",
+    """INSERT INTO chats (profile_id, sender_id, target_id, created_at)
+       SELECT 1 + g % 80000, 1 + g % 20000, 1 + (g * 13) % 20000, 1700000000 + g
+       FROM generate_series(1, 40000) g""",
+    """INSERT INTO messages (chat_id, sender_id, content, msg_type, created_at)
+       SELECT 1 + g % 40000, 1 + g % 20000, 'message ' || g, 'text', 1700000000 + g
+       FROM generate_series(1, 200000) g""",
+    """INSERT INTO reports (chat_id, reporter_id, reported_id, reason, status, created_at)
+       SELECT 1 + g % 40000, 1 + g % 20000, 1 + (g * 3) % 20000, 'spam',
+              CASE WHEN g % 10 = 0 THEN 'new' ELSE 'resolved' END, 1700000000 + g
+       FROM generate_series(1, 20000) g""",
+    """INSERT INTO broadcasts (admin_id, text, status, last_user_id, total, sent, created_at, updated_at, finished_at)
+       SELECT 1, 'broadcast ' || g, CASE WHEN g % 500 = 0 THEN 'running' ELSE 'done' END,
+              20000, 20000, 19000, 1700000000 + g, 1700000000 + g, 1700000000 + g
+       FROM generate_series(1, 5000) g""",
+    """INSERT INTO fsm_states (key, state, data, updated_at)
+       SELECT '1/' || g || '/' || g || '///default', 'Reg:name', '{"name": "x"}', 1700000000 + g
+       FROM generate_series(1, 20000) g""",
+    """INSERT INTO blocks (blocker_id, blocked_id, created_at)
+       SELECT 1 + g % 20000, 1 + (g * 11) % 20000, 1700000000 + g
+       FROM generate_series(1, 20000) g
+       ON CONFLICT DO NOTHING""",
+]
+
+# Функции, которые по своей природе читают таблицу целиком (админские списки),
+# и функции, которые не ходят в базу.
+CHECK_FULL_SCAN_OK = {
+    "get_stats",  # stats — несколько строк
+    "create_broadcast",  # считает получателей один раз при запуске рассылки
+}
+CHECK_SKIP = {"get_conn", "pool_stats", "init_db"}
+
+def _workload():
+    return [
+        ("get_user", lambda: db.get_user(42)),
+        ("upsert_user", lambda: db.upsert_user(42, name="Checked")),
+        ("get_all_users", lambda: db.get_all_users(limit=51, after=(1700010000, 10000))),
+        ("search_users", lambda: db.search_users("name 1234", limit=51)),
+        ("search_users", lambda: db.search_users("1234", banned=0, gender="female", limit=51,
+                                                 after=(1700019000, 19000))),
+        ("search_users", lambda: db.search_users("@user_77", created_from=1700010000, created_to=1700012000,
+                                                 limit=51)),
+        ("is_banned", lambda: db.is_banned(50)),
+        ("ban_user", lambda: db.ban_user(43, "1h", "check")),
+        ("unban_user", lambda: db.unban_user(43)),
+        ("get_banned_users", lambda: db.get_banned_users()),
+        ("unban_expired", lambda: db.unban_expired()),
+        ("create_profile", lambda: db.create_profile(44, "check")),
+        ("add_profile_media", lambda: db.add_profile_media(1, "file", "photo")),
+        ("create_profile_with_media", lambda: db.create_profile_with_media(
+            59, "check", [("file1", "photo"), ("file2", "video")])),
+        ("get_profile_media", lambda: db.get_profile_media(70001)),
+        ("get_profiles_full", lambda: db.get_profiles_full(list(range(69951, 70001)))),
+        ("get_profile", lambda: db.get_profile(70001)),
+        ("get_active_profile", lambda: db.get_active_profile(45)),
+        ("delete_active_profile", lambda: db.delete_active_profile(46)),
+        ("get_last_profile_time", lambda: db.get_last_profile_time(47)),
+        ("get_matching_profiles", lambda: db.get_matching_profiles(48, 33)),
+        ("like_profile", lambda: db.like_profile(70002, 49)),
+        ("get_active_profiles_admin", lambda: db.get_active_profiles_admin(limit=51, before=(1700070000, 70000))),
+        ("create_chat", lambda: db.create_chat(70003, 51, 52)),
+        ("get_chat", lambda: db.get_chat(100)),
+        ("get_user_chats", lambda: db.get_user_chats(53, limit=16, after=(30000,))),
+        ("add_message", lambda: db.add_message(100, 54, "check")),
+        ("add_messages", lambda: db.add_messages([(100, 54, "a", "text", None, 0), (101, 55, "b", "text", None, 0)])),
+        ("get_chat_messages", lambda: db.get_chat_messages(100, limit=50)),
+        ("get_chat_messages", lambda: db.get_chat_messages(100, limit=51, before=(1700100000, 100000))),
+        ("get_all_chats_admin", lambda: db.get_all_chats_admin(limit=51, after=(1700020000, 20000))),
+        ("add_report", lambda: db.add_report(100, 55, 56, "spam")),
+        ("get_reports", lambda: db.get_reports("new", limit=16, after=(1700010000, 10000))),
+        ("get_stats", lambda: db.get_stats()),
+        ("resolve_report", lambda: db.resolve_report(100)),
+        ("get_report", lambda: db.get_report(100)),
+        ("get_open_reports", lambda: db.get_open_reports(56)),
+        ("get_report_queue", lambda: db.get_report_queue(limit=16, after=(1, 1700010000, 10000))),
+        ("get_report_queue_entry", lambda: db.get_report_queue_entry(56)),
+        ("resolve_user_reports", lambda: db.resolve_user_reports(57)),
+        ("create_broadcast", lambda: db.create_broadcast(1, "check", 1, 1)),
+        ("get_broadcast", lambda: db.get_broadcast(1)),
+        ("get_broadcasts", lambda: db.get_broadcasts()),
+        ("get_running_broadcasts", lambda: db.get_running_broadcasts()),
+        ("get_broadcast_recipients", lambda: db.get_broadcast_recipients(10000, 500)),
+        ("save_broadcast_progress", lambda: db.save_broadcast_progress(1, 10500, 490, 8, 2)),
+        ("set_broadcast_status", lambda: db.set_broadcast_status(1, "paused")),
+        ("get_fsm_state", lambda: db.get_fsm_state("1/42/42///default")),
+        ("save_fsm_states", lambda: db.save_fsm_states([("1/42/42///default", "Reg:age", {"name": "x"}),
+                                                        ("1/43/43///default", None, {})])),
+        ("delete_stale_fsm_states", lambda: db.delete_stale_fsm_states(1700000100)),
+        ("block_user", lambda: db.block_user(57, 58)),
+        ("is_blocked", lambda: db.is_blocked(57, 58)),
+        ("get_user_blocks", lambda: db.get_user_blocks(57)),
+    ]
+
+# Запросы, которые бот выполняет только через asyncpg (параметры $1…): EXPLAIN идёт
+# через PREPARE / EXECUTE с примерными аргументами
+def _async_workload():
+    import database_async as adb
+    return [
+        ("get_matching_profiles (feed index)", adb._FEED_BY_IDS_SQL, (48, list(range(60001, 60031)), 2)),
+        ("get_matching_profiles (async)", adb._FEED_SQL, (48, 0.5, 2, 33)),
+    ]
+
+def _seq_scans(plan: dict) -> list:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    for sub in plan.get("Plans", []):
+        found.extend(_seq_scans(sub))
+    return found
+
+def _explain(ac, name: str, query: str, full_scan_ok: set, args: tuple = None, shown: str = None) -> bool:
+    """EXPLAIN одного запроса; False — Seq Scan там, где его быть не должно."""
+    ac.execute("EXPLAIN (FORMAT JSON) " + query, args)
+    plan = ac.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scans = _seq_scans(plan[0]["Plan"])
+    if not scans:
+        return True
+    tag = "seq scan (ok)" if name in full_scan_ok else "SEQ SCAN"
+    print(f"{tag:14} {name}: {', '.join(scans)}\n    {' '.join((shown or query).split())[:200]}")
+    return name in full_scan_ok
+
+def check() -> bool:
+    """EXPLAIN всех запросов database.py и запросов только database_async на наполненной временной схеме."""
+    ok = True
+    admin = psycopg2.connect(db.DATABASE_URL)
+    admin.autocommit = True
+    ac = admin.cursor()
+    ac.execute(f"DROP SCHEMA IF EXISTS {CHECK_SCHEMA} CASCADE")
+    ac.execute(f"CREATE SCHEMA {CHECK_SCHEMA}")
+    ac.execute(f"SET search_path TO {CHECK_SCHEMA}")
+    original_pool = db.pool
+    db.pool = db.ConnectionPool(db.DATABASE_URL, 1, 2, cursor_factory=_TracingCursor,
+                                options=f"-c search_path={CHECK_SCHEMA}")
+    try:
+        migrate()
+        for sql in SEED_SQL:
+            ac.execute(sql)
+        ac.execute("ANALYZE")
+
+        full_scan_ok = set(CHECK_FULL_SCAN_OK)
+        ac.execute("SELECT to_regclass('users_search_trgm_idx')")
+        if ac.fetchone()[0] is None:
+            print("⚠️ pg_trgm недоступен: search_users проверяется без trigram-индекса")
+            full_scan_ok.add("search_users")
+
+        functions = {name for name, obj in inspect.getmembers(db, inspect.isfunction)
+                     if obj.__module__ == db.__name__ and not name.startswith("_")}
+        covered = set()
+        for name, call in _workload():
+            covered.add(name)
+            _traced.clear()
+            call()
+            for query in list(_traced):
+                head = query.lstrip().split(None, 1)[0].upper()
+                if head not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+                    continue
+                if not _explain(ac, name, query, full_scan_ok):
+                    ok = False
+
+        for name, sql, args in _async_workload():
+            ac.execute(f"PREPARE beem_check AS {sql}")
+            try:
+                placeholders = ", ".join(["%s"] * len(args))
+                if not _explain(ac, name, f"EXECUTE beem_check ({placeholders})", full_scan_ok, args, sql):
+                    ok = False
+            finally:
+                ac.execute("DEALLOCATE beem_check")
+
+        missing = functions - covered - CHECK_SKIP
+        for name in sorted(missing):
+            print(f"{'NOT CHECKED':14} {name}: добавь вызов в migrations._workload()")
+            ok = False
+    finally:
+        db.pool.closeall()
+        db.pool = original_pool
+        ac.execute("SET search_path TO DEFAULT")
+        ac.execute(f"DROP SCHEMA IF EXISTS {CHECK_SCHEMA} CASCADE")
+        admin.close()
+    print("✅ EXPLAIN check passed" if ok else "❌ EXPLAIN check failed")
+    return ok
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if "--check" in sys.argv:
+        sys.exit(0 if check() else 1)
+    if "--status" in sys.argv:
+        done = applied_versions()
+        for version, name, _ in MIGRATIONS:
+            print(f"{'✅' if version in done else '⏳'} {version:3} {name}")
+        sys.exit(0)
+    migrate()
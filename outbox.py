@@ -0,0 +1,283 @@
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+import statistics
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from config import BOT_WORKERS, OUTBOX_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_RETRIES
+
+# Единая очередь исходящих сообщений: middleware сессии бота, через которое проходят
+# все вызовы Bot API. Отправки и правки сообщений (send*, copy*, forward*, edit*) ждут
+# токен сначала своего чата (OUTBOX_CHAT_RATE в секунду, FIFO — порядок сообщений
+# в чате сохраняется), затем общий (OUTBOX_RATE на бота). Общие токены выдаются по
+# приоритету: CHAT (пересылка в чатах и ответы пользователям) → ADMIN → BROADCAST,
+# так что рассылка забирает только то, что осталось от живого трафика.
+# Ответ 429 ставит на паузу чат (у рассылки — весь бот: её сообщения идут в разные
+# чаты, значит упёрлись в общий лимит) и повторяет вызов до OUTBOX_RETRIES раз.
+# Приоритет задаётся контекстом: `with outbox.priority(outbox.ADMIN): ...` или
+# PriorityMiddleware на роутере. При BOT_WORKERS > 1 общий лимит делится поровну
+# между ingress и воркерами — каждый процесс считает свои токены сам.
+
+CHAT, ADMIN, BROADCAST = 0, 1, 2
+LEVELS = {CHAT: "chat", ADMIN: "admin", BROADCAST: "broadcast"}
+LIMITED = ("send", "copy", "forward", "edit")
+UNLIMITED = {"sendChatAction"}
+SAMPLES = 1000
+CHAT_GC_EVERY = 1000  # раз в столько отправок выбрасываем бакеты простаивающих чатов
+
+_context: ContextVar[Tuple[int, Optional[asyncio.Event]]] = ContextVar("outbox", default=(CHAT, None))
+
+class Halted(Exception):
+    """Отправку отменили (halt) раньше первой попытки — сообщение точно не ушло."""
+
+@contextmanager
+def priority(level: int, halt: Optional[asyncio.Event] = None):
+    """Отправки внутри блока идут с приоритетом level; выставленный halt снимает их с очереди."""
+    token = _context.set((level, halt))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+async def sleep(seconds: float, stop: Optional[asyncio.Event] = None) -> bool:
+    """Спит seconds; True — если раньше выставили stop. Общий для outbox, рассылок и воркеров."""
+    if stop is None:
+        await asyncio.sleep(seconds)
+        return False
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+class TokenBucket:
+    """rate токенов в секунду с запасом не больше burst; pause() останавливает выдачу на время."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._stamp = time.monotonic()
+        self._resume_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+        # после паузы копим токены заново, а не отдаём накопленное пачкой
+        self._tokens = 0
+        self._stamp = self._resume_at
+
+    def paused_for(self) -> float:
+        return max(0.0, self._resume_at - time.monotonic())
+
+    def take(self, consume: bool = True) -> float:
+        """Берёт токен: 0 — взят (consume=False — только проверить), иначе сколько секунд ждать."""
+        now = time.monotonic()
+        if now < self._resume_at:
+            return self._resume_at - now
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        if self._tokens >= 1:
+            if consume:
+                self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def idle(self) -> bool:
+        """Никто не ждёт и запас восстановился бы полностью — бакет можно выбросить."""
+        now = time.monotonic()
+        return (not self._lock.locked() and now >= self._resume_at
+                and self._tokens + (now - self._stamp) * self.rate >= self.burst)
+
+    async def _ready(self, stop: Optional[asyncio.Event]) -> bool:
+        while stop is None or not stop.is_set():
+            delay = self.take(consume=False)
+            if not delay:
+                return True
+            await sleep(delay, stop)
+        return False
+
+    async def acquire(self, stop: Optional[asyncio.Event] = None) -> bool:
+        """Ждёт свой токен (в порядке очереди); False — если за это время выставили stop."""
+        async with self._lock:
+            if not await self._ready(stop):
+                return False
+            self.take()
+            return True
+
+class PriorityBucket(TokenBucket):
+    """Токены выдаются ждущим по приоритету, внутри приоритета — по очереди."""
+
+    def __init__(self, rate: float, burst: float):
+        super().__init__(rate, burst)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []  # куча (level, номер, future)
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+
+    def waiting(self, level: int) -> int:
+        return sum(1 for lvl, _, future in self._waiters if lvl == level and not future.done())
+
+    async def acquire_at(self, level: int, stop: Optional[asyncio.Event] = None) -> bool:
+        if not self._waiters and not self.take():
+            return True
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(self._seq), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        try:
+            if stop is None:
+                await future
+                return True
+            stopped = asyncio.ensure_future(stop.wait())
+            try:
+                await asyncio.wait({future, stopped}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stopped.cancel()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        if future.done():
+            return True
+        future.cancel()  # насос пропустит отменённое место
+        return False
+
+    async def _run(self):
+        while self._waiters:
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)  # ждавший ушёл (stop или отмена задачи)
+                continue
+            delay = self.take()
+            if delay:
+                # пока спим, может прийти более срочный — поэтому выдаём после сна, а не до
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                self._tokens += 1
+            else:
+                future.set_result(None)
+
+class Outbox(BaseRequestMiddleware):
+    """Middleware сессии: лимиты, приоритеты и повтор после 429 для всех отправок бота."""
+
+    def __init__(self, rate: float, chat_rate: float = OUTBOX_CHAT_RATE, chat_burst: float = OUTBOX_CHAT_BURST,
+                 retries: int = OUTBOX_RETRIES):
+        self.bucket = PriorityBucket(rate, max(1.0, rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.retries = retries
+        self._chats: Dict[int, TokenBucket] = {}
+        self._chat_waiting = {level: 0 for level in LEVELS}
+        self._calls = 0
+        self._stats = {level: {"sent": 0, "retry_after": 0, "errors": 0, "halted": 0} for level in LEVELS}
+        self._latency = {level: deque(maxlen=SAMPLES) for level in LEVELS}  # мс от вызова до ответа
+        self._wait = {level: deque(maxlen=SAMPLES) for level in LEVELS}     # мс ожидания токенов
+
+    def _chat(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        self._calls += 1
+        if self._calls % CHAT_GC_EVERY == 0:
+            for key in [k for k, b in self._chats.items() if b.idle() and k != chat_id]:
+                del self._chats[key]
+        return bucket
+
+    async def _acquire(self, level: int, chat_id, halt: Optional[asyncio.Event]) -> bool:
+        if chat_id is None:
+            return await self.bucket.acquire_at(level, halt)
+        chat = self._chat(chat_id)
+        self._chat_waiting[level] += 1
+        try:
+            # токен чата списываем только после общего: иначе, пока ждём общий, интервал
+            # между сообщениями в чат съёживается и Telegram отвечает 429
+            async with chat._lock:
+                if not await chat._ready(halt) or not await self.bucket.acquire_at(level, halt):
+                    return False
+                chat.take()
+                return True
+        finally:
+            self._chat_waiting[level] -= 1
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        if not name.startswith(LIMITED) or name in UNLIMITED:
+            return await make_request(bot, method)
+        level, halt = _context.get()
+        chat_id = getattr(method, "chat_id", None)
+        stats = self._stats[level]
+        started = time.monotonic()
+        last_error: Optional[TelegramRetryAfter] = None
+        for attempt in range(self.retries + 1):
+            waiting = time.monotonic()
+            if not await self._acquire(level, chat_id, halt):
+                stats["halted"] += 1
+                if last_error is not None:
+                    raise last_error
+                raise Halted()
+            self._wait[level].append((time.monotonic() - waiting) * 1000)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                stats["retry_after"] += 1
+                last_error = e
+                if chat_id is not None:
+                    self._chat(chat_id).pause(e.retry_after)
+                if level == BROADCAST or chat_id is None:
+                    self.bucket.pause(e.retry_after)
+                logging.warning(f"📮 {name} → {chat_id}: лимит Telegram, пауза {e.retry_after} с")
+                continue
+            except Exception:
+                stats["errors"] += 1
+                raise
+            stats["sent"] += 1
+            self._latency[level].append((time.monotonic() - started) * 1000)
+            return response
+        stats["errors"] += 1
+        raise last_error
+
+    def stats(self) -> Dict:
+        classes = {}
+        for level, label in LEVELS.items():
+            classes[label] = {
+                "queued": self._chat_waiting[level] + self.bucket.waiting(level),
+                **self._stats[level],
+                "wait_ms": _percentiles(self._wait[level]),
+                "latency_ms": _percentiles(self._latency[level]),
+            }
+        return {"rate": self.bucket.rate, "chats": len(self._chats),
+                "paused_for": round(self.bucket.paused_for(), 1), "classes": classes}
+
+def _percentiles(samples) -> Dict:
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0}
+    ordered = sorted(samples)
+    return {"p50": round(statistics.median(ordered), 1),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1)}
+
+# один на процесс: при BOT_WORKERS > 1 отправляют ingress (рассылки) и каждый воркер
+_processes = BOT_WORKERS + 1 if BOT_WORKERS > 1 else 1
+outbox = Outbox(OUTBOX_RATE / _processes)
+
+def paused_for() -> float:
+    """Сколько ещё секунд бот стоит на общей паузе после 429."""
+    return outbox.bucket.paused_for()
+
+def stats() -> Dict:
+    return outbox.stats()
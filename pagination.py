@@ -0,0 +1,50 @@
+from typing import Callable, List, Optional, Tuple
+
+# Keyset-пагинация списков: курсор — ключ сортировки граничной строки,
+# страница читается по индексу от курсора, без OFFSET и без загрузки всей таблицы.
+# Списки отсортированы по убыванию ключа; after — следующая (более старая) страница,
+# before — предыдущая.
+
+def encode_cursor(key: Tuple) -> str:
+    return "_".join(str(v) for v in key)
+
+def decode_cursor(value: Optional[str]) -> Optional[Tuple[int, ...]]:
+    if not value:
+        return None
+    try:
+        return tuple(int(v) for v in value.split("_"))
+    except ValueError:
+        return None
+
+def callback_cursor(data: str) -> Tuple[Optional[Tuple], Optional[Tuple]]:
+    """(after, before) из callback_data вида "<prefix>:a:<курсор>" / "<prefix>:b:<курсор>"."""
+    parts = data.rsplit(":", 2)
+    if len(parts) < 3 or parts[1] not in ("a", "b"):
+        return None, None
+    cursor = decode_cursor(parts[2])
+    return (cursor, None) if parts[1] == "a" else (None, cursor)
+
+class Page:
+    """Строки страницы и курсоры соседних страниц (None — дальше ничего нет)."""
+
+    def __init__(self, items: List, next: Optional[str] = None, prev: Optional[str] = None):
+        self.items = items
+        self.next = next
+        self.prev = prev
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+def make_page(rows: List, limit: int, key: Callable, after=None, before=None) -> Page:
+    """rows — результат запроса с limit + 1, уже в порядке показа."""
+    more = len(rows) > limit
+    if before:
+        items = rows[-limit:] if more else rows
+        return Page(items, next=encode_cursor(key(items[-1])) if items else encode_cursor(before),
+                    prev=encode_cursor(key(items[0])) if more else None)
+    items = rows[:limit]
+    return Page(items, next=encode_cursor(key(items[-1])) if more else None,
+                prev=encode_cursor(key(items[0])) if after and items else None)
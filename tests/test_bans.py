@@ -0,0 +1,42 @@
+from bans import BanList
+
+NOW = 1_700_000_000
+
+def test_load_replaces_contents():
+    bans = BanList()
+    assert not bans.ready
+    bans.put(1, None)
+    bans.load([(2, None, "spam"), (3, NOW + 60, None)])
+    assert bans.ready
+    assert len(bans) == 2
+    assert bans.get(1) is None
+    assert bans.get(2) == (None, "spam")
+
+def test_permanent_ban_never_expires():
+    bans = BanList()
+    bans.put(1, None, "forever")
+    assert bans.get(1, now=NOW * 10) == (None, "forever")
+
+def test_temporary_ban_expires_on_read():
+    bans = BanList()
+    bans.put(1, NOW + 60, "1h")
+    assert bans.get(1, now=NOW) == (NOW + 60, "1h")
+    assert bans.get(1, now=NOW + 59) is not None
+    assert bans.get(1, now=NOW + 60) is None
+    assert len(bans) == 1  # из памяти запись уберёт зачистка, а не чтение
+
+def test_is_banned_uses_current_time():
+    bans = BanList()
+    bans.put(1, 1, "давно истёк")
+    bans.put(2, None)
+    assert not bans.is_banned(1)
+    assert bans.is_banned(2)
+    assert not bans.is_banned(3)
+
+def test_remove():
+    bans = BanList()
+    bans.put(1, None)
+    bans.remove(1)
+    bans.remove(1)
+    assert bans.get(1) is None
+    assert len(bans) == 0
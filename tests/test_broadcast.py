@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import broadcast
+from broadcast import Broadcast
+
+def _job():
+    return {"id": 1, "text": "hi", "sent": 0, "blocked": 0, "failed": 0}
+
+def _run_batch(monkeypatch, user_ids, deliver, concurrency=3):
+    monkeypatch.setattr(broadcast, "BROADCAST_CONCURRENCY", concurrency)
+
+    async def run():
+        job = Broadcast(None, _job())
+        job._deliver = lambda user_id: deliver(job, user_id)
+        done = await job._send_batch(user_ids)
+        return job, done
+
+    return asyncio.run(run())
+
+def test_whole_batch_is_counted(monkeypatch):
+    outcomes = {1: "sent", 2: "blocked", 3: "sent", 4: "failed", 5: "sent"}
+
+    async def deliver(job, user_id):
+        await asyncio.sleep(0)
+        return outcomes[user_id]
+
+    job, done = _run_batch(monkeypatch, list(outcomes), deliver)
+    assert done == 5
+    assert (job.job["sent"], job.job["blocked"], job.job["failed"]) == (3, 1, 1)
+
+def test_recipients_are_taken_in_order(monkeypatch):
+    started = []
+
+    async def deliver(job, user_id):
+        started.append(user_id)
+        await asyncio.sleep(0.01 * (user_id % 3))
+        return "sent"
+
+    job, done = _run_batch(monkeypatch, list(range(1, 11)), deliver)
+    assert started == list(range(1, 11))
+    assert done == 10
+
+@pytest.mark.parametrize("concurrency", [3, 8])
+def test_gap_stops_counters_at_cursor(monkeypatch, concurrency):
+    # halt снял с очереди получателя 2, а 1 и 3 (другие чаты) уже отправлены:
+    # курсор встанет после 1, значит и считать можно только 1 — 3 пройдёт заново
+    delivered = []
+
+    async def deliver(job, user_id):
+        if user_id == 2:
+            await asyncio.sleep(0.005)
+            job.halt.set()
+            return None
+        await asyncio.sleep(0.01)
+        delivered.append(user_id)
+        return "sent"
+
+    job, done = _run_batch(monkeypatch, [1, 2, 3, 4, 5], deliver, concurrency)
+    assert 3 in delivered
+    assert done == 1
+    assert (job.job["sent"], job.job["blocked"], job.job["failed"]) == (1, 0, 0)
+
+def test_halt_before_start(monkeypatch):
+    async def deliver(job, user_id):
+        return "sent"
+
+    async def run():
+        monkeypatch.setattr(broadcast, "BROADCAST_CONCURRENCY", 3)
+        job = Broadcast(None, _job())
+        job._deliver = lambda user_id: deliver(job, user_id)
+        job.halt.set()
+        return job, await job._send_batch([1, 2, 3])
+
+    job, done = asyncio.run(run())
+    assert done == 0
+    assert job.job["sent"] == 0
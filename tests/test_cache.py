@@ -0,0 +1,66 @@
+import pytest
+
+import cache
+from cache import MISSING, TTLCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+def test_lru_eviction():
+    c = TTLCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1  # a теперь свежее b
+    c.set("c", 3)
+    assert c.get("b") is MISSING
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+    assert c.evictions == 1
+    assert len(c) == 2
+
+def test_ttl_expiry(clock):
+    c = TTLCache(maxsize=10, ttl=5)
+    c.set("a", 1)
+    clock[0] += 4.9
+    assert c.get("a") == 1
+    clock[0] += 0.2
+    assert c.get("a") is MISSING
+    assert len(c) == 0
+
+def test_none_is_a_value():
+    c = TTLCache(maxsize=10, ttl=60)
+    c.set("a", None)
+    assert c.get("a") is None
+    assert c.stats()["hits"] == 1
+
+def test_invalidate_between_token_and_set_drops_stale_value():
+    c = TTLCache(maxsize=10, ttl=60)
+    token = c.token()  # читаем из базы...
+    c.invalidate("a")  # ...а тем временем запись изменилась
+    c.set("a", "stale", token)
+    assert c.get("a") is MISSING
+    c.set("a", "fresh", c.token())
+    assert c.get("a") == "fresh"
+
+def test_clear_also_invalidates_tokens():
+    c = TTLCache(maxsize=10, ttl=60)
+    token = c.token()
+    c.clear()
+    c.set("a", "stale", token)
+    assert c.get("a") is MISSING
+
+def test_set_without_token_always_writes():
+    c = TTLCache(maxsize=10, ttl=60)
+    c.invalidate("a")
+    c.set("a", 1)
+    assert c.get("a") == 1
+
+def test_stats():
+    c = TTLCache(maxsize=10, ttl=60)
+    c.set("a", 1)
+    c.get("a")
+    c.get("b")
+    assert c.stats() == {"size": 1, "maxsize": 10, "hits": 1, "misses": 1, "hit_rate": 0.5, "evictions": 0}
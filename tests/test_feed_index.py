@@ -0,0 +1,60 @@
+import asyncio
+import random
+
+from feed_index import FeedIndex
+from interests import to_mask
+
+GAMES = to_mask(["games"])
+ANIME = to_mask(["anime"])
+MUSIC = to_mask(["music"])
+
+async def _rows(rows):
+    for row in rows:
+        yield row
+
+def _index(rows) -> FeedIndex:
+    index = FeedIndex()
+    asyncio.run(index.load(_rows(rows)))
+    return index
+
+def test_load_out_of_order_rows():
+    index = _index([(3, 30, GAMES), (1, 10, GAMES), (2, 20, ANIME), (3, 31, GAMES)])
+    assert index.ready
+    assert len(index) == 3
+    assert sorted(index.sample(0, GAMES | ANIME, 10)) == [10, 20, 31]
+
+def test_sample_only_shared_interests_without_duplicates():
+    random.seed(1)
+    index = _index([(1, 10, GAMES), (2, 20, GAMES | ANIME), (3, 30, MUSIC)])
+    for _ in range(50):
+        ids = index.sample(0, GAMES, 5)
+        assert sorted(ids) == [10, 20]
+    assert index.sample(0, 0, 5) == []
+
+def test_sample_excludes_viewer_and_blocked():
+    random.seed(2)
+    index = _index([(u, u * 10, GAMES) for u in range(1, 11)])
+    for _ in range(50):
+        ids = index.sample(5, GAMES, 20, exclude={2, 7})
+        assert sorted(ids) == [10, 30, 40, 60, 80, 90, 100]
+
+def test_sample_is_limited_to_k():
+    index = _index([(u, u, GAMES) for u in range(1, 101)])
+    assert len(index.sample(0, GAMES, 3)) == 3
+
+def test_put_moves_profile_between_buckets():
+    index = _index([(1, 10, GAMES)])
+    index.put(1, 11, ANIME)
+    assert len(index) == 1
+    assert index.sample(0, GAMES, 5) == []
+    assert index.sample(0, ANIME, 5) == [11]
+    index.put(2, 20, GAMES)
+    assert index.sample(0, GAMES, 5) == [20]
+
+def test_remove():
+    index = _index([(1, 10, GAMES | ANIME), (2, 20, GAMES)])
+    index.remove(1)
+    index.remove(42)  # нет в индексе — ничего не происходит
+    assert len(index) == 1
+    assert index.sample(0, ANIME, 5) == []
+    assert index.sample(0, GAMES | ANIME, 5) == [20]
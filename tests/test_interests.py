@@ -0,0 +1,26 @@
+from config import INTERESTS
+from interests import ALL_INTERESTS_MASK, fmt_interests, from_mask, labels, to_mask
+
+KEYS = [key for _, key in INTERESTS]
+
+def test_bit_is_position_in_config():
+    for i, key in enumerate(KEYS):
+        assert to_mask([key]) == 1 << i
+
+def test_round_trip_keeps_config_order():
+    assert from_mask(to_mask(["sport", "games", "anime"])) == ["games", "anime", "sport"]
+    assert from_mask(to_mask(KEYS)) == KEYS
+    assert to_mask(KEYS) == ALL_INTERESTS_MASK
+
+def test_unknown_keys_and_empty_mask():
+    assert to_mask(["games", "nope", ""]) == to_mask(["games"])
+    assert to_mask([]) == 0
+    assert from_mask(0) == []
+    assert from_mask(None) == []
+
+def test_labels_and_display():
+    mask = to_mask(["games", "music"])
+    assert labels(mask) == (INTERESTS[0][0], INTERESTS[5][0])
+    assert fmt_interests(mask) == f"{INTERESTS[0][0]}, {INTERESTS[5][0]}"
+    assert fmt_interests(0) == "—"
+    assert fmt_interests(None) == "—"
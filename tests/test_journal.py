@@ -0,0 +1,64 @@
+import asyncio
+
+import asyncpg
+import pytest
+
+import journal
+
+def _row(content: str) -> tuple:
+    return (1, 2, content, "text", None, 0)
+
+class FakeDb:
+    """add_messages, который не принимает NUL в тексте и умеет «терять связь»."""
+
+    def __init__(self):
+        self.rows = []
+        self.offline = False
+
+    async def add_messages(self, rows):
+        if self.offline:
+            raise asyncpg.exceptions.ConnectionDoesNotExistError("connection was closed")
+        if any("\x00" in row[2] for row in rows):
+            raise asyncpg.exceptions.CharacterNotInRepertoireError("invalid byte sequence")
+        self.rows.extend(rows)
+
+@pytest.fixture
+def fake(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(journal.db, "add_messages", db.add_messages)
+    monkeypatch.setattr(journal, "_buffer", [])
+    monkeypatch.setattr(journal, "_waiters", [])
+    monkeypatch.setattr(journal, "_stats", {"flushed": 0, "batches": 0, "failures": 0, "dropped": 0})
+    return db
+
+def test_bad_row_is_dropped_and_the_rest_written(fake):
+    journal._buffer.extend([_row("a"), _row("b\x00"), _row("c")])
+    assert asyncio.run(journal.flush()) == 2
+    assert [row[2] for row in fake.rows] == ["a", "c"]
+    assert journal._buffer == []
+    assert journal._stats["dropped"] == 1
+
+def test_bad_row_fails_only_its_waiter(fake):
+    async def run():
+        loop = asyncio.get_running_loop()
+        waiters = [loop.create_future() for _ in range(3)]
+        journal._buffer.extend([_row("a"), _row("b\x00"), _row("c")])
+        journal._waiters.extend(waiters)
+        await journal.flush()
+        return waiters
+
+    waiters = asyncio.run(run())
+    assert waiters[0].result() is None
+    assert isinstance(waiters[1].exception(), asyncpg.exceptions.CharacterNotInRepertoireError)
+    assert waiters[2].result() is None
+
+def test_connection_error_requeues_batch(fake):
+    fake.offline = True
+    journal._buffer.extend([_row("a"), _row("b")])
+    with pytest.raises(asyncpg.exceptions.ConnectionDoesNotExistError):
+        asyncio.run(journal.flush())
+    assert [row[2] for row in journal._buffer] == ["a", "b"]
+    assert journal._stats["failures"] == 1
+    fake.offline = False
+    assert asyncio.run(journal.flush()) == 2
+    assert journal._buffer == []
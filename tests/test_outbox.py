@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendChatAction, SendMessage
+
+import outbox
+from outbox import ADMIN, BROADCAST, CHAT, Outbox, PriorityBucket, TokenBucket
+
+def test_bucket_burst_then_wait():
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert 0 < bucket.take() <= 0.1
+
+def test_bucket_check_does_not_consume():
+    bucket = TokenBucket(rate=10, burst=1)
+    assert bucket.take(consume=False) == 0
+    assert bucket.take() == 0
+    assert bucket.take(consume=False) > 0
+
+def test_bucket_pause_drops_saved_tokens():
+    bucket = TokenBucket(rate=10, burst=5)
+    bucket.pause(2)
+    assert 1.9 < bucket.take() <= 2
+    assert 1.9 < bucket.paused_for() <= 2
+    assert not bucket.idle()
+
+def test_acquire_respects_stop():
+    async def run():
+        bucket = TokenBucket(rate=0.1, burst=1)
+        assert await bucket.acquire()
+        stop = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.05, stop.set)
+        return await bucket.acquire(stop)
+
+    assert asyncio.run(run()) is False
+
+def test_priority_order():
+    order = []
+
+    async def waiter(bucket, level, name):
+        assert await bucket.acquire_at(level)
+        order.append(name)
+
+    async def run():
+        bucket = PriorityBucket(rate=50, burst=1)
+        assert await bucket.acquire_at(BROADCAST)  # запас кончился — дальше очередь
+        await asyncio.gather(waiter(bucket, BROADCAST, "b1"), waiter(bucket, ADMIN, "a"),
+                             waiter(bucket, BROADCAST, "b2"), waiter(bucket, CHAT, "c"))
+
+    asyncio.run(run())
+    assert order == ["c", "a", "b1", "b2"]
+
+def test_halted_waiter_gives_up_its_place():
+    async def run():
+        bucket = PriorityBucket(rate=20, burst=1)
+        assert await bucket.acquire_at(CHAT)
+        halt = asyncio.Event()
+        halted = asyncio.create_task(bucket.acquire_at(CHAT, halt))
+        later = asyncio.create_task(bucket.acquire_at(BROADCAST))
+        await asyncio.sleep(0)
+        halt.set()
+        assert await halted is False
+        assert await asyncio.wait_for(later, 1) is True
+        assert bucket.waiting(CHAT) == 0
+
+    asyncio.run(run())
+
+class FakeApi:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls = []
+
+    async def __call__(self, bot, method):
+        self.calls.append(method.__api_method__)
+        if self.failures:
+            self.failures -= 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+        return True
+
+def _send(box: Outbox, api: FakeApi, method, level: int = CHAT, halt: asyncio.Event = None):
+    async def run():
+        with outbox.priority(level, halt):
+            return await box(api, None, method)
+
+    return asyncio.run(run())
+
+def test_retry_after_is_retried():
+    box, api = Outbox(100, retries=3), FakeApi(failures=2)
+    assert _send(box, api, SendMessage(chat_id=1, text="hi")) is True
+    assert api.calls == ["sendMessage"] * 3
+    stats = box.stats()["classes"]["chat"]
+    assert (stats["sent"], stats["retry_after"], stats["errors"]) == (1, 2, 0)
+
+def test_retries_exhausted_raise():
+    box, api = Outbox(100, retries=1), FakeApi(failures=5)
+    with pytest.raises(TelegramRetryAfter):
+        _send(box, api, SendMessage(chat_id=1, text="hi"))
+    assert len(api.calls) == 2
+
+def test_halt_before_first_attempt():
+    halt = asyncio.Event()
+    halt.set()
+    box, api = Outbox(100), FakeApi()
+    with pytest.raises(outbox.Halted):
+        _send(box, api, SendMessage(chat_id=1, text="hi"), BROADCAST, halt)
+    assert api.calls == []
+    assert box.stats()["classes"]["broadcast"]["halted"] == 1
+
+def test_chat_actions_are_not_limited():
+    box, api = Outbox(100), FakeApi()
+    box.bucket.pause(60)
+    assert _send(box, api, SendChatAction(chat_id=1, action="typing")) is True
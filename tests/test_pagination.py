@@ -0,0 +1,66 @@
+from pagination import callback_cursor, decode_cursor, encode_cursor, make_page
+
+def key(row):
+    return (row, row * 10)
+
+def test_cursor_round_trip():
+    assert encode_cursor((1700000000, 42)) == "1700000000_42"
+    assert decode_cursor("1700000000_42") == (1700000000, 42)
+    assert decode_cursor(encode_cursor((-5,))) == (-5,)
+
+def test_bad_cursor_is_ignored():
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+    assert decode_cursor("12_abc") is None
+
+def test_callback_cursor():
+    assert callback_cursor("adm:users:a:10_1") == ((10, 1), None)
+    assert callback_cursor("adm:users:b:10_1") == (None, (10, 1))
+    assert callback_cursor("adm:users") == (None, None)
+    assert callback_cursor("adm:users:x:10_1") == (None, None)
+
+def test_first_page():
+    page = make_page([9, 8, 7, 6], 3, key)  # запрошено limit + 1
+    assert page.items == [9, 8, 7]
+    assert page.next == encode_cursor(key(7))
+    assert page.prev is None
+
+def test_only_page():
+    page = make_page([9, 8], 3, key)
+    assert list(page) == [9, 8]
+    assert page.next is None and page.prev is None
+
+def test_next_page():
+    page = make_page([6, 5, 4, 3], 3, key, after=key(7))
+    assert page.items == [6, 5, 4]
+    assert page.next == encode_cursor(key(4))
+    assert page.prev == encode_cursor(key(6))
+
+def test_last_page():
+    page = make_page([3, 2], 3, key, after=key(4))
+    assert page.items == [3, 2]
+    assert page.next is None
+    assert page.prev == encode_cursor(key(3))
+
+def test_empty_page_after_cursor():
+    page = make_page([], 3, key, after=key(1))
+    assert len(page) == 0
+    assert page.next is None and page.prev is None
+
+def test_previous_page():
+    # before: строки уже развёрнуты в порядок показа, лишняя — самая дальняя от курсора
+    page = make_page([10, 9, 8, 7], 3, key, before=key(6))
+    assert page.items == [9, 8, 7]
+    assert page.next == encode_cursor(key(7))
+    assert page.prev == encode_cursor(key(9))
+
+def test_previous_page_reaches_start():
+    page = make_page([8, 7], 3, key, before=key(6))
+    assert page.items == [8, 7]
+    assert page.next == encode_cursor(key(7))
+    assert page.prev is None
+
+def test_empty_previous_page_keeps_way_back():
+    page = make_page([], 3, key, before=key(6))
+    assert page.next == encode_cursor(key(6))
+    assert page.prev is None
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+import webhook
+from config import WEBHOOK_QUEUE_SIZE
+
+def _message(update_id: int, user_id: int) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": "hi",
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "x"},
+    }}
+
+def test_route_key_sender():
+    assert webhook.route_key(_message(1, 42)) == 42
+    assert webhook.route_key({"update_id": 2, "callback_query": {"id": "q", "from": {"id": 43}}}) == 43
+
+def test_route_key_event_user_and_chat():
+    assert webhook.route_key({"update_id": 3, "message_reaction": {"user": {"id": 44}, "chat": {"id": -1}}}) == 44
+    assert webhook.route_key({"update_id": 4, "channel_post": {"chat": {"id": -100}}}) == -100
+
+def test_route_key_falls_back_to_update_id():
+    assert webhook.route_key({"update_id": 5, "poll": {"id": "p", "question": "?"}}) == 5
+    assert webhook.route_key({"update_id": 6}) == 6
+    assert webhook.route_key({}) == 0
+
+def test_route_key_of_malformed_update_is_int():
+    assert webhook.route_key({"update_id": "x", "message": {"from": {"id": "y"}, "chat": 1}}) == 0
+
+@pytest.fixture
+def lanes(monkeypatch):
+    queues = [asyncio.Queue() for _ in range(4)]
+    monkeypatch.setattr(webhook, "_lanes", queues)
+    monkeypatch.setattr(webhook, "_pending", 0)
+    return queues
+
+def _drain(queues):
+    return [[queue.get_nowait().update_id for _ in range(queue.qsize())] for queue in queues]
+
+def test_enqueue_keeps_user_order_in_one_lane(lanes):
+    assert webhook._enqueue([_message(1, 5), _message(2, 6), _message(3, 5)])
+    assert webhook._pending == 3
+    assert _drain(lanes)[5 % 4] == [1, 3]
+
+def test_enqueue_over_limit_takes_nothing(lanes, monkeypatch):
+    monkeypatch.setattr(webhook, "_pending", WEBHOOK_QUEUE_SIZE - 1)
+    assert not webhook._enqueue([_message(1, 5), _message(2, 6)])
+    assert webhook._pending == WEBHOOK_QUEUE_SIZE - 1
+    assert all(queue.empty() for queue in lanes)
+    assert webhook._enqueue([_message(3, 5)])
+
+def test_enqueue_invalid_update_takes_nothing(lanes):
+    with pytest.raises(ValidationError):
+        webhook._enqueue([_message(1, 5), {"update_id": "x", "message": {"chat": 1}}])
+    assert webhook._pending == 0
+    assert all(queue.empty() for queue in lanes)
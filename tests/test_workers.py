@@ -0,0 +1,47 @@
+from collections import Counter
+
+import pytest
+
+import workers
+from config import WEBHOOK_CONCURRENCY
+
+def test_shard_is_stable_and_in_range():
+    for key in (0, 1, 42, -1001234567890, 2 ** 40):
+        assert 0 <= workers.shard(key, 4) < 4
+        assert workers.shard(key, 4) == workers.shard(key, 4)
+
+def test_shard_spreads_users_evenly():
+    counts = Counter(workers.shard(user_id, 4) for user_id in range(100_000, 120_000))
+    assert len(counts) == 4
+    assert max(counts.values()) < 1.1 * min(counts.values())
+
+def test_worker_gets_all_webhook_lanes():
+    # key % N с общими делителями N и WEBHOOK_CONCURRENCY отдал бы воркеру лишь часть полос
+    for n in (2, 4, 8):
+        lanes = {key % WEBHOOK_CONCURRENCY for key in range(10_000) if workers.shard(key, n) == 0}
+        assert len(lanes) == WEBHOOK_CONCURRENCY
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = [workers.Worker(i) for i in range(3)]
+    monkeypatch.setattr(workers, "_workers", pool)
+    return pool
+
+def _update(user_id: int) -> dict:
+    return {"update_id": user_id, "message": {"from": {"id": user_id}}}
+
+def test_accept_routes_by_user(pool):
+    assert workers._accept([_update(7), _update(8), _update(7)])
+    for worker in pool:
+        ids = [worker.queue.get_nowait()["update_id"] for _ in range(worker.queue.qsize())]
+        expected = [7, 7] if worker is pool[workers.shard(7, 3)] else []
+        assert [i for i in ids if i == 7] == expected
+
+def test_accept_is_all_or_nothing(pool):
+    full = pool[workers.shard(7, 3)]
+    for _ in range(full.queue.maxsize - 1):
+        full.queue.put_nowait({})
+    assert not workers._accept([_update(8), _update(7), _update(7)])
+    assert full.queue.qsize() == full.queue.maxsize - 1
+    assert sum(worker.queue.qsize() for worker in pool) == full.queue.maxsize - 1
+    assert workers._accept([_update(7)])
@@ -1,183 +1,330 @@
-from flask import Flask, render_template, request, redirect, session, url_for, jsonify, abort
-import database as db
-import time
 import os
-from config import ADMIN_PASSWORD, ADMIN_SECRET, INTERESTS_DISPLAY, BAN_DURATIONS
+import json
+import asyncio
+import time
+import hmac
+import base64
+import hashlib
+import logging
+from aiohttp import web
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 
-app = Flask(__name__)
-app.secret_key = ADMIN_SECRET
+import database_async as db
+import live_stats
+import outbox
+import webhook
+from config import (
+    ADMIN_PASSWORD, ADMIN_SECRET, BAN_DURATIONS, BOT_MODE, LIVE_STATS_HEARTBEAT, REPORT_REASONS, WEBHOOK_PATH,
+)
+from interests import fmt_interests
+from pagination import decode_cursor, encode_cursor, make_page
+
+# Веб-панель работает в том же event loop, что и бот: общий пул asyncpg и кэши,
+# запросы обрабатываются конкурентно, без отдельного потока и процесса.
 
 GENDER_MAP = {"male": "Парень", "female": "Девушка", "other": "Другое"}
 SGENDER_MAP = {"male": "Парней", "female": "Девушек", "any": "Всех"}
+PAGE_SIZE = 50
+SESSION_COOKIE = "beem_session"
+SESSION_MAX_AGE = 30 * 86400
+
+templates = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")),
+    autoescape=select_autoescape(["html"]),
+)
+routes = web.RouteTableDef()
+_runner = None
 
 def fmt_time(ts):
     if not ts: return "—"
     return time.strftime("%d.%m.%Y %H:%M", time.localtime(ts))
 
-def fmt_interests(s):
-    if not s: return "—"
-    return ", ".join(INTERESTS_DISPLAY.get(i, i) for i in s.split(",") if i)
+def parse_date(value, days=0):
+    """YYYY-MM-DD из формы → unix-время начала дня (+days), None если пусто или не дата."""
+    try:
+        return int(time.mktime(time.strptime(value, "%Y-%m-%d"))) + days * 86400
+    except (TypeError, ValueError):
+        return None
+
+def render(request: web.Request, name: str, **ctx) -> web.Response:
+    html = templates.get_template(name).render(request=request, **ctx)
+    return web.Response(text=html, content_type="text/html")
+
+async def paged(request: web.Request, fetch, key, **kw):
+    """Страница списка по ?after= / ?before= из query string."""
+    after = decode_cursor(request.query.get("after"))
+    before = decode_cursor(request.query.get("before"))
+    rows = await fetch(limit=PAGE_SIZE + 1, after=after, before=before, **kw)
+    return make_page(rows, PAGE_SIZE, key, after, before)
+
+# ── Session ────────────────────────────────────────────────────────────────────
+# Сессия — подписанная HMAC кука: base64(json).подпись, без хранения на сервере.
+
+def _sign(payload: str) -> str:
+    return hmac.new(ADMIN_SECRET.encode(), payload.encode(), hashlib.sha256).hexdigest()
 
-def require_login(f):
-    from functools import wraps
-    @wraps(f)
-    def wrap(*a, **kw):
-        if not session.get("admin"): return redirect(url_for("login"))
-        return f(*a, **kw)
-    return wrap
+def load_session(request: web.Request) -> dict:
+    raw = request.cookies.get(SESSION_COOKIE, "")
+    payload, _, sig = raw.rpartition(".")
+    if not payload or not hmac.compare_digest(_sign(payload), sig):
+        return {}
+    try:
+        data = json.loads(base64.urlsafe_b64decode(payload))
+    except ValueError:
+        return {}
+    if data.get("t", 0) + SESSION_MAX_AGE < time.time():
+        return {}
+    return data
+
+def save_session(response: web.StreamResponse, data: dict):
+    payload = base64.urlsafe_b64encode(json.dumps({**data, "t": int(time.time())}).encode()).decode()
+    response.set_cookie(SESSION_COOKIE, f"{payload}.{_sign(payload)}",
+                        max_age=SESSION_MAX_AGE, httponly=True, samesite="Lax")
+
+PUBLIC_PATHS = {"/login", WEBHOOK_PATH}  # webhook проверяет свой секрет сам
+
+@web.middleware
+async def require_login(request: web.Request, handler):
+    if request.path not in PUBLIC_PATHS and not load_session(request).get("admin"):
+        raise web.HTTPFound("/login")
+    return await handler(request)
 
 # ── Auth ───────────────────────────────────────────────────────────────────────
 
-@app.route("/login", methods=["GET", "POST"])
-def login():
+@routes.route("*", "/login")
+async def login(request: web.Request):
     error = None
     if request.method == "POST":
-        if request.form.get("password") == ADMIN_PASSWORD:
-            session["admin"] = True
-            return redirect(url_for("dashboard"))
+        form = await request.post()
+        if hmac.compare_digest(form.get("password", "").encode(), ADMIN_PASSWORD.encode()):
+            response = web.HTTPFound("/")
+            save_session(response, {"admin": True})
+            raise response
         error = "Неверный пароль"
-    return render_template("login.html", error=error)
+    return render(request, "login.html", error=error)
 
-@app.route("/logout")
-def logout():
-    session.clear()
-    return redirect(url_for("login"))
+@routes.get("/logout")
+async def logout(request: web.Request):
+    response = web.HTTPFound("/login")
+    response.del_cookie(SESSION_COOKIE)
+    raise response
 
 # ── Dashboard ──────────────────────────────────────────────────────────────────
 
-@app.route("/")
-@require_login
-def dashboard():
-    users = db.get_all_users()
-    chats = db.get_all_chats_admin()
-    profiles = db.get_active_profiles_admin()
-    reports = db.get_reports("new")
-    conn = db.get_conn()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM messages")
-    msg_count = c.fetchone()[0]
-    conn.close()
-    return render_template("dashboard.html",
-        users_count=len(users), chats_count=len(chats),
-        profiles_count=len(profiles), reports_count=len(reports),
-        messages_count=msg_count
+@routes.get("/")
+async def dashboard(request: web.Request):
+    stats = await db.get_stats()
+    return render(request, "dashboard.html",
+        users_count=stats["users"], chats_count=stats["chats"],
+        profiles_count=stats["profiles"], reports_count=stats["reports"],
+        messages_count=stats["messages"]
     )
 
-@app.route("/api/stats")
-@require_login
-def api_stats():
-    users = db.get_all_users()
-    chats = db.get_all_chats_admin()
-    profiles = db.get_active_profiles_admin()
-    reports = db.get_reports("new")
-    conn = db.get_conn()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM messages")
-    msg_count = c.fetchone()[0]
-    conn.close()
-    return jsonify(users=len(users), chats=len(chats),
-                   profiles=len(profiles), reports=len(reports), messages=msg_count)
+@routes.get("/api/stats")
+async def api_stats(request: web.Request):
+    return web.json_response(await db.get_stats())
+
+@routes.get("/api/stats/stream")
+async def api_stats_stream(request: web.Request):
+    """SSE: сначала снимок всех счётчиков, дальше — только изменившиеся (event: stats)."""
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # nginx/прокси не должны буферизовать поток
+    })
+    await response.prepare(request)
+
+    async def send(counters: dict):
+        await response.write(f"event: stats\ndata: {json.dumps(counters)}\n\n".encode())
+
+    # подписка до снимка — изменения между ними не потеряются
+    async with live_stats.subscribe() as queue:
+        try:
+            await response.write(b"retry: 5000\n\n")
+            await send(await live_stats.snapshot())
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), LIVE_STATS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    await response.write(b": ping\n\n")
+                    continue
+                if message is None:
+                    break
+                await send(message)
+        except ConnectionResetError:
+            pass  # вкладку закрыли
+    return response
+
+@routes.get("/api/pool")
+async def api_pool(request: web.Request):
+    return web.json_response(db.pool_stats())
+
+@routes.get("/api/webhook")
+async def api_webhook(request: web.Request):
+    return web.json_response(webhook.stats())
+
+@routes.get("/api/outbox")
+async def api_outbox(request: web.Request):
+    return web.json_response(outbox.stats())
 
 # ── Users ──────────────────────────────────────────────────────────────────────
 
-@app.route("/users")
-@require_login
-def users():
-    all_users = db.get_all_users()
+@routes.get("/users")
+async def users(request: web.Request):
+    f = {k: request.query.get(k, "").strip() for k in ("q", "banned", "gender", "from", "to")}
+    all_users = await paged(request, db.search_users, lambda u: (u["created_at"], u["user_id"]),
+                            query=f["q"],
+                            banned=int(f["banned"]) if f["banned"] in ("0", "1") else None,
+                            gender=f["gender"] if f["gender"] in GENDER_MAP else None,
+                            created_from=parse_date(f["from"]),
+                            created_to=parse_date(f["to"], days=1))
     for u in all_users:
         u["gender_display"] = GENDER_MAP.get(u.get("gender"), "—")
-        u["interests_display"] = fmt_interests(u.get("interests"))
+        u["interests_display"] = fmt_interests(u.get("interests_mask"))
         u["created_display"] = fmt_time(u.get("created_at"))
         u["ban_display"] = "🔒 Забанен" if u.get("banned") else "✅ Активен"
         u["ban_until_display"] = fmt_time(u.get("ban_until")) if u.get("ban_until") else "—"
-    return render_template("users.html", users=all_users)
+    return render(request, "users.html", users=all_users, total=(await db.get_stats())["users"],
+                  filters=f, gender_map=GENDER_MAP)
 
-@app.route("/user/<int:user_id>")
-@require_login
-def user_detail(user_id):
-    u = db.get_user(user_id)
-    if not u: abort(404)
+@routes.get(r"/user/{user_id:\d+}")
+async def user_detail(request: web.Request):
+    user_id = int(request.match_info["user_id"])
+    u = await db.get_user(user_id)
+    if not u: raise web.HTTPNotFound()
     u["gender_display"] = GENDER_MAP.get(u.get("gender"), "—")
-    u["interests_display"] = fmt_interests(u.get("interests"))
+    u["interests_display"] = fmt_interests(u.get("interests_mask"))
     u["created_display"] = fmt_time(u.get("created_at"))
     u["ban_until_display"] = fmt_time(u.get("ban_until")) if u.get("ban_until") else "Навсегда"
-    chats = db.get_user_chats(user_id)
-    profile = db.get_active_profile(user_id)
-    return render_template("user_detail.html", u=u, chats=chats, profile=profile,
-                           ban_durations=BAN_DURATIONS, fmt_time=fmt_time)
-
-@app.route("/user/<int:user_id>/ban", methods=["POST"])
-@require_login
-def ban_user(user_id):
-    duration = request.form.get("duration", "24h")
-    reason = request.form.get("reason", "Нарушение правил")
-    db.ban_user(user_id, duration, reason)
-    db.delete_active_profile(user_id)
-    return redirect(url_for("user_detail", user_id=user_id))
-
-@app.route("/user/<int:user_id>/unban", methods=["POST"])
-@require_login
-def unban_user(user_id):
-    db.unban_user(user_id)
-    return redirect(url_for("user_detail", user_id=user_id))
+    chats = await db.get_user_chats(user_id)
+    profile = await db.get_active_profile(user_id)
+    return render(request, "user_detail.html", u=u, chats=chats, profile=profile,
+                  ban_durations=BAN_DURATIONS, fmt_time=fmt_time)
+
+@routes.post(r"/user/{user_id:\d+}/ban")
+async def ban_user(request: web.Request):
+    user_id = int(request.match_info["user_id"])
+    form = await request.post()
+    await db.ban_user(user_id, form.get("duration", "24h"), form.get("reason", "Нарушение правил"))
+    await db.delete_active_profile(user_id)
+    raise web.HTTPFound(f"/user/{user_id}")
+
+@routes.post(r"/user/{user_id:\d+}/unban")
+async def unban_user(request: web.Request):
+    user_id = int(request.match_info["user_id"])
+    await db.unban_user(user_id)
+    raise web.HTTPFound(f"/user/{user_id}")
 
 # ── Profiles ───────────────────────────────────────────────────────────────────
 
-@app.route("/profiles")
-@require_login
-def profiles():
-    all_profiles = db.get_active_profiles_admin()
+@routes.get("/profiles")
+async def profiles(request: web.Request):
+    all_profiles = await paged(request, db.get_active_profiles_admin, lambda p: (p["created_at"], p["id"]))
+    all_profiles.items = await db.get_profiles_full([p["id"] for p in all_profiles])
     for p in all_profiles:
-        p["interests_display"] = fmt_interests(p.get("interests"))
+        p["interests_display"] = fmt_interests(p.get("interests_mask"))
         p["created_display"] = fmt_time(p.get("created_at"))
         p["gender_display"] = GENDER_MAP.get(p.get("gender"), "—")
-        p["media"] = db.get_profile_media(p["id"])
-    return render_template("profiles.html", profiles=all_profiles)
+    return render(request, "profiles.html", profiles=all_profiles, total=(await db.get_stats())["profiles"])
 
 # ── Chats ──────────────────────────────────────────────────────────────────────
 
-@app.route("/chats")
-@require_login
-def chats():
-    all_chats = db.get_all_chats_admin()
+@routes.get("/chats")
+async def chats(request: web.Request):
+    all_chats = await paged(request, db.get_all_chats_admin, lambda c: (c["created_at"], c["id"]))
     for c in all_chats:
         c["created_display"] = fmt_time(c.get("created_at"))
-    return render_template("chats.html", chats=all_chats)
-
-@app.route("/chat/<int:chat_id>")
-@require_login
-def chat_detail(chat_id):
-    chat = db.get_chat(chat_id)
-    if not chat: abort(404)
-    messages = db.get_chat_messages(chat_id, limit=500)
-    sender = db.get_user(chat["sender_id"])
-    target = db.get_user(chat["target_id"])
-    for m in messages:
-        m["time_display"] = fmt_time(m.get("created_at"))
-        m["is_sender"] = m["sender_id"] == chat["sender_id"]
-    return render_template("chat_detail.html",
-        chat=chat, messages=messages,
+    return render(request, "chats.html", chats=all_chats, total=(await db.get_stats())["chats"])
+
+TRANSCRIPT_PAGE = 50
+
+def transcript_page(chat: dict, rows: list) -> dict:
+    """Страница переписки для JSON: rows — до TRANSCRIPT_PAGE + 1 сообщений по возрастанию времени."""
+    more = len(rows) > TRANSCRIPT_PAGE
+    rows = rows[-TRANSCRIPT_PAGE:]
+    return {
+        "messages": [{
+            "id": m["id"], "created_at": m["created_at"], "msg_type": m["msg_type"],
+            "content": m["content"], "file_id": m["file_id"],
+            "is_sender": m["sender_id"] == chat["sender_id"],
+        } for m in rows],
+        # курсор на самое старое сообщение страницы — следующий запрос вернёт то, что раньше него
+        "next": encode_cursor((rows[0]["created_at"], rows[0]["id"])) if more else None,
+    }
+
+@routes.get(r"/chat/{chat_id:\d+}")
+async def chat_detail(request: web.Request):
+    chat_id = int(request.match_info["chat_id"])
+    chat = await db.get_chat(chat_id)
+    if not chat: raise web.HTTPNotFound()
+    rows = await db.get_chat_messages(chat_id, limit=TRANSCRIPT_PAGE + 1)
+    sender = await db.get_user(chat["sender_id"])
+    target = await db.get_user(chat["target_id"])
+    return render(request, "chat_detail.html",
+        chat=chat, transcript=transcript_page(chat, rows),
         sender=sender, target=target,
         sender_name=sender["name"] if sender else f"ID:{chat['sender_id']}",
         target_name=target["name"] if target else f"ID:{chat['target_id']}"
     )
 
+@routes.get(r"/api/chat/{chat_id:\d+}/messages")
+async def api_chat_messages(request: web.Request):
+    """Более старые сообщения: ?before=<курсор из "next"> → {"messages": [...], "next": ...}."""
+    chat_id = int(request.match_info["chat_id"])
+    chat = await db.get_chat(chat_id)
+    if not chat: raise web.HTTPNotFound()
+    before = decode_cursor(request.query.get("before"))
+    rows = await db.get_chat_messages(chat_id, limit=TRANSCRIPT_PAGE + 1, before=before)
+    return web.json_response(transcript_page(chat, rows))
+
 # ── Reports ────────────────────────────────────────────────────────────────────
 
-@app.route("/reports")
-@require_login
-def reports():
-    all_reports = db.get_reports()
-    for r in all_reports:
-        r["created_display"] = fmt_time(r.get("created_at"))
-    return render_template("reports.html", reports=all_reports)
-
-@app.route("/report/<int:report_id>/resolve", methods=["POST"])
-@require_login
-def resolve_report(report_id):
-    db.resolve_report(report_id)
-    return redirect(url_for("reports"))
-
-def run_web():
+@routes.get("/reports")
+async def reports(request: web.Request):
+    queue = await paged(request, db.get_report_queue, lambda q: (q["open_count"], q["last_at"], q["reported_id"]))
+    for q in queue:
+        q["first_display"] = fmt_time(q.get("first_at"))
+        q["last_display"] = fmt_time(q.get("last_at"))
+        q["reasons_sorted"] = sorted((q.get("reasons") or {}).items(), key=lambda kv: -kv[1])
+    return render(request, "reports.html", queue=queue, new_count=(await db.get_stats())["reports"],
+                  reason_labels=REPORT_REASONS)
+
+@routes.post(r"/report/{report_id:\d+}/resolve")
+async def resolve_report(request: web.Request):
+    await db.resolve_report(int(request.match_info["report_id"]))
+    raise web.HTTPFound("/reports")
+
+@routes.post(r"/reports/user/{user_id:\d+}/resolve")
+async def resolve_user_reports(request: web.Request):
+    await db.resolve_user_reports(int(request.match_info["user_id"]))
+    raise web.HTTPFound("/reports")
+
+# ── App ────────────────────────────────────────────────────────────────────────
+
+async def _close_streams(app: web.Application):
+    # открытые SSE-соединения иначе держали бы остановку до таймаута
+    await live_stats.stop()
+
+def create_app() -> web.Application:
+    app = web.Application(middlewares=[require_login])
+    app.add_routes(routes)
+    if BOT_MODE == "webhook":
+        app.router.add_post(WEBHOOK_PATH, webhook.handle)
+    app.on_shutdown.append(_close_streams)
+    return app
+
+async def start():
+    """Поднимает панель на PORT в текущем event loop (dp.startup)."""
+    global _runner
     port = int(os.getenv("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=False, use_reloader=False)
+    _runner = web.AppRunner(create_app(), access_log=None)
+    await _runner.setup()
+    await live_stats.start()
+    await web.TCPSite(_runner, "0.0.0.0", port).start()
+    logging.info(f"✅ Веб-панель запущена на порту {port}")
+
+async def stop():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,198 @@
+import os
+import hmac
+import signal
+import asyncio
+import logging
+from typing import Callable, List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from pydantic import ValidationError
+
+from config import (
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_CONCURRENCY, WEBHOOK_QUEUE_SIZE, WORKER_SOCKET,
+)
+
+# Webhook-режим (BOT_MODE=webhook): Telegram присылает апдейты POST-ом на WEBHOOK_PATH
+# веб-сервера панели. Запрос с неверным секретом отклоняется, верный апдейт кладётся
+# в очередь и сразу получает 200, а обрабатывают очередь WEBHOOK_CONCURRENCY воркеров.
+# Если очередь полна — отвечаем 503, и Telegram сам доставит апдейт позже.
+# При остановке сервер перестаёт принимать запросы, воркеры дорабатывают очередь;
+# webhook не снимается, так что апдейты за время рестарта ждут на стороне Telegram.
+# Очередь разбита на полосы по пользователю: апдейты одного пользователя обрабатываются
+# строго по порядку, разных — параллельно. Тот же обработчик принимает пачки апдейтов
+# (JSON-массив) от ingress шардированного режима на unix-сокете воркера (workers.py).
+
+MODES = ("polling", "webhook")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+PARENT_CHECK_INTERVAL = 5
+
+_lanes: List[asyncio.Queue] = []
+_workers: List[asyncio.Task] = []
+_pending = 0  # принято, но ещё не обработано
+_sink: Optional[Callable[[List[dict]], bool]] = None  # куда идут принятые апдейты
+_dp: Optional[Dispatcher] = None
+_bot: Optional[Bot] = None
+_server: Optional[web.AppRunner] = None
+_watchdog: Optional[asyncio.Task] = None
+_stats = {"accepted": 0, "rejected": 0, "busy": 0, "processed": 0, "errors": 0}
+
+if BOT_MODE not in MODES:
+    raise ValueError(f"BOT_MODE должен быть одним из {MODES}, а не {BOT_MODE!r}")
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise ValueError("Для BOT_MODE=webhook нужен WEBHOOK_URL (или RAILWAY_PUBLIC_DOMAIN)")
+
+def route_key(data: dict) -> int:
+    """Кому принадлежит апдейт: id пользователя (from / user события), иначе чата, иначе update_id."""
+    for field, event in data.items():
+        if field == "update_id" or not isinstance(event, dict):
+            continue
+        for owner in (event.get("from"), event.get("user"), event.get("chat")):
+            if isinstance(owner, dict) and isinstance(owner.get("id"), int):
+                return owner["id"]
+        break
+    # битый апдейт не должен ронять раздачу по полосам: его отклонит валидация (400)
+    update_id = data.get("update_id")
+    return update_id if isinstance(update_id, int) else 0
+
+def set_sink(sink: Optional[Callable[[List[dict]], bool]]):
+    """sink(updates) -> False, если принять некуда (ответим 503). Ingress подставляет сюда раздачу воркерам."""
+    global _sink
+    _sink = sink
+
+async def handle(request: web.Request):
+    secret = request.headers.get(SECRET_HEADER, "")
+    if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+        _stats["rejected"] += 1
+        raise web.HTTPUnauthorized()
+    if _sink is None:
+        raise web.HTTPServiceUnavailable()
+    try:
+        data = await request.json()
+        updates = data if isinstance(data, list) else [data]
+        if not all(isinstance(update, dict) for update in updates):
+            raise ValueError("апдейт должен быть объектом")
+        accepted = _sink(updates)
+    except (ValueError, ValidationError):
+        raise web.HTTPBadRequest()
+    if not accepted:
+        _stats["busy"] += 1
+        raise web.HTTPServiceUnavailable()
+    _stats["accepted"] += len(updates)
+    return web.Response()
+
+def _enqueue(updates: List[dict]) -> bool:
+    """Кладёт пачку в полосы целиком или не кладёт ничего — частично принятую пачку повторили бы."""
+    global _pending
+    if _pending + len(updates) > WEBHOOK_QUEUE_SIZE:
+        return False
+    parsed = [(route_key(data) % len(_lanes), Update.model_validate(data, context={"bot": _bot}))
+              for data in updates]
+    for lane, update in parsed:
+        _lanes[lane].put_nowait(update)
+    _pending += len(parsed)
+    return True
+
+async def _work(lane: asyncio.Queue):
+    global _pending
+    while True:
+        update = await lane.get()
+        if update is None:
+            return
+        try:
+            await _dp.feed_update(_bot, update)
+            _stats["processed"] += 1
+        except Exception:
+            _stats["errors"] += 1
+            logging.exception(f"Ошибка обработки апдейта {update.update_id}")
+        finally:
+            _pending -= 1
+
+def _start_lanes(bot: Bot, dispatcher: Dispatcher):
+    global _lanes, _workers, _dp, _bot
+    _dp, _bot = dispatcher, bot
+    _lanes = [asyncio.Queue() for _ in range(WEBHOOK_CONCURRENCY)]
+    _workers = [asyncio.create_task(_work(lane)) for lane in _lanes]
+    set_sink(_enqueue)
+
+async def register(bot: Bot, allowed_updates: List[str]):
+    """setWebhook на WEBHOOK_URL + WEBHOOK_PATH с секретом."""
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=allowed_updates,
+    )
+    logging.info(f"✅ Webhook: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+async def start(bot: Bot, dispatcher: Dispatcher):
+    """Запускает воркеры и регистрирует webhook (dp.startup, после web.start)."""
+    _start_lanes(bot, dispatcher)
+    await register(bot, dispatcher.resolve_used_update_types())
+    logging.info(f"✅ Webhook: воркеров {WEBHOOK_CONCURRENCY}")
+
+async def stop():
+    """Дорабатывает принятые апдейты (после web.stop — новых запросов уже нет, до закрытия пула)."""
+    global _workers
+    if not _workers:
+        return
+    set_sink(None)
+    for lane in _lanes:
+        lane.put_nowait(None)  # встаёт в полосу за уже принятыми апдейтами
+    await asyncio.gather(*_workers)
+    _workers = []
+
+# ── Воркер шардированного режима ─────────────────────────────────────────────
+
+async def _watch_parent(parent: int):
+    # ingress убит без SIGTERM воркерам (SIGKILL, OOM) — не остаёмся сиротой
+    while os.getppid() == parent:
+        await asyncio.sleep(PARENT_CHECK_INTERVAL)
+    logging.warning("Ingress пропал, воркер останавливается")
+    os.kill(os.getpid(), signal.SIGTERM)
+
+async def start_worker(bot: Bot, dispatcher: Dispatcher):
+    """Принимает апдейты от ingress на unix-сокете WORKER_SOCKET (dp.startup воркера)."""
+    global _server, _watchdog
+    _start_lanes(bot, dispatcher)
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    _server = web.AppRunner(app, access_log=None)
+    await _server.setup()
+    if os.path.exists(WORKER_SOCKET):
+        os.unlink(WORKER_SOCKET)  # сокет от упавшего предшественника
+    await web.UnixSite(_server, WORKER_SOCKET).start()
+    _watchdog = asyncio.create_task(_watch_parent(os.getppid()))
+
+async def stop_worker():
+    """Перестаёт принимать апдейты и дорабатывает принятые."""
+    global _server, _watchdog
+    if _watchdog is not None:
+        _watchdog.cancel()
+        _watchdog = None
+    if _server is not None:
+        await _server.cleanup()
+        _server = None
+        if os.path.exists(WORKER_SOCKET):
+            os.unlink(WORKER_SOCKET)
+    await stop()
+
+async def run(dp: Dispatcher, bot: Bot):
+    """Замена dp.start_polling для webhook-режима и воркеров: тот же startup/shutdown, до SIGTERM/SIGINT."""
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    try:
+        await stopping.wait()
+    finally:
+        logging.info("Webhook: остановка")
+        try:
+            await dp.emit_shutdown(bot=bot, **workflow_data)
+        finally:
+            await bot.session.close()
+
+def stats() -> dict:
+    return {"mode": BOT_MODE, "queued": _pending, "workers": len(_workers), **_stats}
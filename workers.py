@@ -0,0 +1,217 @@
+import os
+import sys
+import time
+import zlib
+import signal
+import asyncio
+import logging
+import tempfile
+from collections import Counter
+from typing import List, Optional
+
+from aiohttp import ClientError, ClientSession, UnixConnector
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import broadcast
+import database_async as db
+import outbox
+import web
+import webhook
+from bot import create_bot, create_dispatcher
+from config import (
+    BOT_MODE, BOT_WORKERS, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WORKER_QUEUE_SIZE, WORKER_BATCH, WORKER_RESTART_MAX_DELAY, WORKER_STOP_TIMEOUT,
+)
+
+# Шардированный режим (BOT_WORKERS > 1). Главный процесс — ingress: получает апдейты
+# (getUpdates или webhook панели), по владельцу апдейта (webhook.route_key, обычно
+# from_user.id) выбирает один из N воркеров и пересылает пачками на его unix-сокет.
+# Воркер — обычный bot.py со всеми роутерами, так что состояние FSM и порядок апдейтов
+# пользователя живут в одном процессе. Ingress же держит веб-панель и рассылки и
+# перезапускает упавших воркеров с нарастающей паузой.
+# Пачка уходит воркеру строго по порядку; пока воркер перезапускается или занят (503),
+# ingress повторяет её, а очередь копится до WORKER_QUEUE_SIZE — дальше polling
+# ждёт, а webhook отвечает Telegram 503. Апдейты, принятые воркером и не обработанные
+# к его падению, теряются — как и в обычном webhook-режиме.
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+POLL_TIMEOUT = 30
+RETRY_DELAY = 1
+HEALTHY_AFTER = 60  # проработал столько секунд — пауза перед перезапуском сбрасывается
+
+def shard(key: int, workers: int) -> int:
+    # не key % N: внутри воркера полосы webhook выбираются по key % WEBHOOK_CONCURRENCY,
+    # и при общих делителях воркеру досталась бы только часть полос
+    return zlib.crc32(key.to_bytes(8, "little", signed=True)) % workers
+
+class Worker:
+    """Процесс-воркер: запуск и перезапуск, очередь апдейтов и их пересылка."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.socket = os.path.join(tempfile.gettempdir(), f"beem-{os.getpid()}-w{index}.sock")
+        self.queue: asyncio.Queue = asyncio.Queue(WORKER_QUEUE_SIZE)
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+        self.forwarded = 0
+        self.retries = 0
+        self.dropped = 0
+
+    async def supervise(self, stop: asyncio.Event):
+        delay = RETRY_DELAY
+        while not stop.is_set():
+            started = time.monotonic()
+            env = {**os.environ, "BOT_WORKER_ID": str(self.index), "BOT_WORKER_SOCKET": self.socket}
+            # своя сессия: Ctrl+C в терминале получает только ingress и гасит воркеров по порядку
+            self.process = await asyncio.create_subprocess_exec(sys.executable, SCRIPT, env=env,
+                                                                start_new_session=True)
+            code = await self.process.wait()
+            if stop.is_set():
+                return
+            self.restarts += 1
+            if time.monotonic() - started > HEALTHY_AFTER:
+                delay = RETRY_DELAY
+            logging.error(f"💥 Воркер {self.index} завершился с кодом {code}, перезапуск через {delay} с")
+            if await outbox.sleep(delay, stop):
+                return
+            delay = min(delay * 2, WORKER_RESTART_MAX_DELAY)
+
+    async def forward(self):
+        url = f"http://worker{WEBHOOK_PATH}"
+        headers = {webhook.SECRET_HEADER: WEBHOOK_SECRET}
+        async with ClientSession(connector=UnixConnector(path=self.socket)) as http:
+            while True:
+                batch = [await self.queue.get()]
+                while len(batch) < WORKER_BATCH and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                while True:
+                    try:
+                        async with http.post(url, json=batch, headers=headers) as resp:
+                            status = resp.status
+                    except (ClientError, OSError):
+                        status = None  # воркер ещё не поднялся или перезапускается
+                    if status == 200:
+                        self.forwarded += len(batch)
+                        break
+                    if status in (400, 401):
+                        # повтор не поможет, а очередь за этой пачкой встала бы навсегда
+                        self.dropped += len(batch)
+                        logging.error(f"Воркер {self.index} отклонил {len(batch)} апдейтов: HTTP {status}")
+                        break
+                    self.retries += 1
+                    await asyncio.sleep(RETRY_DELAY)
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def stop(self):
+        process = self.process
+        if process is None or process.returncode is not None:
+            return
+        process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), WORKER_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.error(f"Воркер {self.index} не остановился за {WORKER_STOP_TIMEOUT} с, kill")
+            process.kill()
+            await process.wait()
+
+    def stats(self) -> dict:
+        return {"pid": self.process.pid if self.process else None, "queued": self.queue.qsize(),
+                "forwarded": self.forwarded, "retries": self.retries, "dropped": self.dropped,
+                "restarts": self.restarts}
+
+_workers: List[Worker] = []
+
+def _worker_for(update: dict) -> Worker:
+    return _workers[shard(webhook.route_key(update), len(_workers))]
+
+def _accept(updates: List[dict]) -> bool:
+    """Sink для webhook: раскладывает пачку по очередям воркеров целиком или не берёт ничего."""
+    targets = [_worker_for(update) for update in updates]
+    for worker, count in Counter(targets).items():
+        if worker.queue.maxsize - worker.queue.qsize() < count:
+            return False
+    for worker, update in zip(targets, updates):
+        worker.queue.put_nowait(update)
+    return True
+
+async def _poll(bot: Bot, allowed_updates: List[str], stop: asyncio.Event):
+    offset = None
+    stopped = asyncio.ensure_future(stop.wait())
+    while not stop.is_set():
+        fetch = asyncio.ensure_future(
+            bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates))
+        await asyncio.wait({fetch, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        if not fetch.done():
+            fetch.cancel()  # остановка посреди long-poll: полученное раньше уже раздано
+            break
+        try:
+            updates = fetch.result()
+        except TelegramAPIError as e:
+            logging.warning(f"getUpdates: {e}, повтор через {RETRY_DELAY * 5} с")
+            await outbox.sleep(RETRY_DELAY * 5, stop)
+            continue
+        for update in updates:
+            # очередь воркера полна — ждём, а не теряем: getUpdates просто приостанавливается
+            data = update.model_dump(mode="json", by_alias=True, exclude_unset=True)
+            await _worker_for(data).queue.put(data)
+            offset = update.update_id + 1
+    if offset is not None:
+        # подтверждаем разданное, иначе после рестарта Telegram пришлёт его повторно
+        try:
+            await bot.get_updates(offset=offset, timeout=0, limit=1, allowed_updates=allowed_updates)
+        except TelegramAPIError:
+            pass
+
+def stats() -> dict:
+    return {"workers": [worker.stats() for worker in _workers]}
+
+async def main():
+    """Ingress + супервизор: до SIGTERM/SIGINT, затем останавливает всё по порядку."""
+    global _workers
+    bot = create_bot()
+    # диспетчер ingress апдейтов не обрабатывает — нужен только список их типов
+    allowed_updates = create_dispatcher(MemoryStorage()).resolve_used_update_types()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    _workers = [Worker(i) for i in range(BOT_WORKERS)]
+    await db.startup()
+    await broadcast.start(bot)
+    supervisors = [asyncio.create_task(worker.supervise(stop)) for worker in _workers]
+    forwarders = [asyncio.create_task(worker.forward()) for worker in _workers]
+    await web.start()
+    poller = None
+    if BOT_MODE == "webhook":
+        webhook.set_sink(_accept)
+        await webhook.register(bot, allowed_updates)
+    else:
+        await bot.delete_webhook(drop_pending_updates=False)
+        poller = asyncio.create_task(_poll(bot, allowed_updates, stop))
+    logging.info(f"🐝 Beem Bot запущен! ({BOT_MODE}, воркеров: {BOT_WORKERS})")
+
+    try:
+        await stop.wait()
+    finally:
+        logging.info("Ingress: остановка")
+        webhook.set_sink(None)
+        if poller is not None:
+            await poller  # прерывает long-poll и подтверждает offset
+        await web.stop()
+        try:
+            # раздаём принятое, пока воркеры живы
+            await asyncio.wait_for(asyncio.gather(*(w.queue.join() for w in _workers)), WORKER_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.error(f"Не переданы воркерам: {sum(w.queue.qsize() for w in _workers)} апдейтов")
+        for task in forwarders:
+            task.cancel()
+        await asyncio.gather(*forwarders, return_exceptions=True)
+        await asyncio.gather(*(worker.stop() for worker in _workers))
+        await asyncio.gather(*supervisors)
+        await broadcast.stop()
+        await db.shutdown()
+        await bot.session.close()